@@ -0,0 +1,230 @@
+"""
+Game loop benchmark: scripted 4 ships scenarios on each level, headless (SDL dummy video / audio).
+
+Reports the frames/s and the per stage frame times (p50/p95/p99/max, see stage_timers.py),
+compared to the baseline of your machine (--save: game_loop_baseline.json, not committed, frame times
+are machine specific). Fails (exit code 1) if a scenario got slower than the tolerance.
+
+python3 benchmarks/game_loop.py
+python3 benchmarks/game_loop.py --save
+python3 benchmarks/game_loop.py --levels=1,6 --scenarios=dogfight --frames=1000 --output=dogfight.json
+python3 benchmarks/game_loop.py --replay=match1.mrp,match2.mrp
+"""
+
+import os, sys, json, time, argparse, platform
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(ROOT, "benchmarks", "game_loop_baseline.json")
+
+# before pygame is imported
+os.environ["SDL_VIDEODRIVER"] = "dummy"
+os.environ["SDL_AUDIODRIVER"] = "dummy"
+
+sys.path.insert(0, ROOT)
+os.chdir(ROOT) # assets paths are relative
+
+import pygame
+import mayhem
+
+# 4 views, as in a local game
+WIDTH = 704 * 2
+HEIGHT = 448 * 2
+
+LEVEL_SWITCH_FRAMES = 10
+
+# stages under this p95 are not compared (timer noise)
+STAGE_MIN_MS = 0.05
+
+# -------------------------------------------------------------------------------------------------
+# Scenarios: scenario(env, frame) sets the ships inputs before each simulation step
+
+def idle(env, frame):
+    # landed ships, nothing pressed: the floor cost of a frame
+    pass
+
+def dogfight(env, frame):
+    for i, ship in enumerate(env.ships):
+        ship.thrust_pressed = (frame // 20 + i) % 3 != 0
+        ship.left_pressed   = (frame // 15 + i) % 4 == 0
+        ship.right_pressed  = (frame // 15 + i) % 4 == 2
+
+        # press / release: one shot every other frame, up to MAX_SHOOT per ship
+        ship.shoot_pressed = frame % 2 == 0
+
+def mass_explosion(env, frame):
+    # all the ships explode together, again as soon as they are back
+    for ship in env.ships:
+        if not ship.explod and not ship.game_over:
+            ship.explod = True
+
+def level_switch(env, frame):
+    if frame and frame % LEVEL_SWITCH_FRAMES == 0:
+        levels = available_levels()
+        env.set_level_and_ships(levels[(levels.index(env.level) + 1) % len(levels)])
+
+def replay(env, frame):
+    # --replay: the inputs are set by env.replay_frame()
+    pass
+
+SCENARIOS = {
+    "idle": idle,
+    "dogfight": dogfight,
+    "mass_explosion": mass_explosion,
+    "level_switch": level_switch,
+}
+
+# -------------------------------------------------------------------------------------------------
+
+def available_levels():
+    return [level for level, map_path in sorted(mayhem.LEVEL_MAPS.items()) if os.path.exists(map_path)]
+
+def run_scenario(game, level, scenario, frames, warmup, play_recorded=""):
+    """ Returns {"fps", "stages"} for frames simulated + rendered frames, after warmup frames
+        (replays: until the end of the replay if shorter) """
+
+    env = mayhem.MayhemEnv(game, level=level, max_fps=0, debug_print=0, show_all_players=True, play_recorded=play_recorded)
+
+    # one simulation step + one render per frame, no real time: reproducible
+    env.timers.window = frames
+    t0 = 0.
+    measured = 0
+
+    for frame in range(warmup + frames):
+
+        if frame == warmup:
+            env.timers.reset()
+            env.timers.enable()
+            t0 = time.perf_counter()
+
+        env.timers.start("input")
+        env.handle_local_events()
+
+        env.timers.start("scenario")
+        SCENARIOS.get(scenario, replay)(env, frame)
+
+        env.step_local()
+
+        # end of the replay
+        if not env.running:
+            break
+
+        env.render(env.ships, 1.)
+
+        env.timers.end_frame()
+
+        if frame >= warmup:
+            measured += 1
+
+    elapsed = time.perf_counter() - t0
+
+    return {"fps": measured / elapsed if measured else 0., "stages": env.timers.summary()}
+
+def compare(name, result, baseline, tolerance):
+    """ Prints result vs baseline, returns False if slower than tolerance """
+
+    line = "%-28s %8.1f fps" % (name, result["fps"])
+
+    if name not in baseline:
+        print(line + "  (no baseline, not checked)")
+        return True
+
+    ratio = baseline[name]["fps"] / result["fps"]
+    line += "  (baseline %.1f fps, x%.2f)" % (baseline[name]["fps"], ratio)
+
+    ok = ratio <= 1 + tolerance
+    if not ok:
+        line += "  FAIL"
+
+    print(line)
+
+    # stages p95 which got slower than tolerance
+    for stage, p in result["stages"].items():
+        base = baseline[name]["stages"].get(stage)
+        if base and base["p95"] > STAGE_MIN_MS and p["p95"] / base["p95"] > 1 + tolerance:
+            print("    %-12s p95 %.3f ms (baseline %.3f ms)" % (stage, p["p95"], base["p95"]))
+
+    return ok
+
+# -------------------------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-levels', '--levels', help='comma separated, default: all the levels found in assets', action="store", default="")
+    parser.add_argument('-scenarios', '--scenarios', help='comma separated: %s' % ", ".join(SCENARIOS), action="store", default=",".join(SCENARIOS))
+    parser.add_argument('-frames', '--frames', help='measured frames per scenario', type=int, action="store", default=600)
+    parser.add_argument('-warmup', '--warmup', help='frames before measuring (tiles decoding...)', type=int, action="store", default=30)
+    parser.add_argument('-tolerance', '--tolerance', help='allowed slowdown vs baseline', type=float, action="store", default=0.15)
+    parser.add_argument('-baseline', '--baseline', help='baseline JSON file (--save output) to compare with, or to write with --save', action="store", default=BASELINE)
+    parser.add_argument('-save', '--save', help='save the results as the new baseline', action="store_true", default=False)
+    parser.add_argument('-output', '--output', help='also write the results to this JSON file', action="store", default="")
+    parser.add_argument('-stages', '--stages', help='print the per stage percentiles', action="store_true", default=False)
+    parser.add_argument('-replay', '--replay', help='comma separated replay files (--record_play) to run after the scenarios', action="store", default="")
+
+    args = parser.parse_args()
+
+    if args.levels:
+        levels = [int(level) for level in args.levels.split(",")]
+    else:
+        levels = available_levels()
+
+    scenarios = args.scenarios.split(",")
+    for scenario in scenarios:
+        if scenario not in SCENARIOS:
+            parser.error("unknown scenario %s" % scenario)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+    elif not args.save:
+        print("No baseline %s: running without the regression check (--save to create it)" % args.baseline)
+
+    pygame.init()
+    pygame.mixer.init()
+    game = mayhem.GameWindow(WIDTH, HEIGHT)
+
+    results = {}
+    failed = False
+
+    runs = [("level%s/%s" % (level, scenario), level, scenario, "") for level in levels for scenario in scenarios]
+    for path in filter(None, args.replay.split(",")):
+        runs.append(("replay/%s" % os.path.basename(path), 6, "replay", os.path.abspath(path)))
+
+    for name, level, scenario, play_recorded in runs:
+
+        result = run_scenario(game, level, scenario, args.frames, args.warmup, play_recorded)
+        results[name] = result
+
+        if not compare(name, result, baseline, args.tolerance):
+            failed = True
+
+        if args.stages:
+            for stage, p in result["stages"].items():
+                print("    %-12s p50 %7.3f  p95 %7.3f  p99 %7.3f  max %7.3f ms" % (stage, p["p50"], p["p95"], p["p99"], p["max"]))
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "pygame": pygame.version.ver,
+            "platform": platform.platform(),
+            "size": [WIDTH, HEIGHT],
+            "frames": args.frames,
+            "warmup": args.warmup,
+        },
+        "results": results,
+    }
+
+    paths = []
+    if args.output:
+        paths.append(args.output)
+    if args.save:
+        paths.append(args.baseline)
+
+    for path in paths:
+        with open(path, "w") as f:
+            json.dump(report, f, indent=4)
+        print("Results saved to %s" % path)
+
+    sys.exit(1 if failed else 0)
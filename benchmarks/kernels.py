@@ -0,0 +1,298 @@
+"""
+Hot kernels microbenchmark: per call cost of the Ship collision / motion functions against the shot
+count, the ship count, the platform count and the map size, headless (SDL dummy video / audio).
+
+Each kernel prints a scaling curve (us per call for each size) and its growth exponent between the
+smallest and the biggest size (1 = linear, 2 = quadratic): check it before raising MAX_SHOOT or the
+number of players.
+
+python3 benchmarks/kernels.py
+python3 benchmarks/kernels.py --kernels=collide_shots,move_shots --output=kernels.json
+"""
+
+import os, sys, json, math, time, random, argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# before pygame is imported
+os.environ["SDL_VIDEODRIVER"] = "dummy"
+os.environ["SDL_AUDIODRIVER"] = "dummy"
+
+sys.path.insert(0, ROOT)
+os.chdir(ROOT) # assets paths are relative
+
+import pygame
+import mayhem
+
+MIN_TIME = 0.2 # s measured per size
+SEED = 1
+
+# ships views, as in a local game
+WIDTH = 704 * 2
+HEIGHT = 448 * 2
+
+# -------------------------------------------------------------------------------------------------
+
+def measure(kernel, setup=None, calls_per_setup=1):
+    """ us per kernel() call, setup() (not measured) every calls_per_setup calls """
+
+    min_time = MIN_TIME
+    calls = 0
+    total = 0.
+
+    while total < min_time:
+        if setup:
+            setup()
+
+        for _ in range(calls_per_setup):
+            t0 = time.perf_counter()
+            kernel()
+            total += time.perf_counter() - t0
+            calls += 1
+
+    return total / calls * 1e6
+
+def growth(curve):
+    """ log-log slope between the first and the last point (size > 0) """
+
+    curve = [(n, t) for n, t in curve if n > 0]
+    if len(curve) < 2:
+        return 0.
+
+    (n0, t0), (n1, t1) = curve[0], curve[-1]
+    if n1 == n0 or t0 <= 0:
+        return 0.
+    return math.log(t1 / t0) / math.log(n1 / n0)
+
+def format_size(size):
+    # map sizes in pixels
+    if size >= 100000:
+        return "%.1fMpx" % (size / 1e6)
+    return str(size)
+
+def new_ship(ship_number, xpos, ypos):
+    ship = mayhem.Ship(WIDTH, HEIGHT, True, str(ship_number), xpos, ypos,
+                       mayhem.SHIP_1_PIC, mayhem.SHIP_1_PIC_THRUST, mayhem.SHIP_1_PIC_SHIELD, 0, mayhem.SHIP_MAX_LIVES)
+
+    ship.image_rotated = pygame.transform.rotate(ship.image, ship.angle)
+    ship.mask = pygame.mask.from_surface(ship.image_rotated)
+    return ship
+
+def new_shot(rnd, x, y):
+    shot = mayhem.Shot()
+    shot.x = shot.xposprecise = x
+    shot.y = shot.yposprecise = y
+
+    angle = rnd.uniform(0, 2 * math.pi)
+    shot.dx = 5.1 * math.cos(angle)
+    shot.dy = 5.1 * math.sin(angle)
+    return shot
+
+# -------------------------------------------------------------------------------------------------
+# Kernels: kernel(env) => {curve name: [(size, us per call), ...]}
+
+def bench_collide_map(env):
+    """ Ship.collide_map: per level (map size), far from the walls (distance field early out)
+        and close to the walls, with the ship size mask (USE_MINI_MASK) and the whole map mask """
+
+    curves = {"far": [], "mini_mask": [], "full_mask": []}
+    rnd = random.Random(SEED)
+
+    for level in available_levels():
+        env.set_level_and_ships(level)
+        level_map = env.level_map
+        size = level_map.width * level_map.height
+
+        # ship positions: far from any wall / close to a wall without touching it
+        far, near = [], []
+        while len(far) < 50 or len(near) < 50:
+            x = rnd.randrange(0, level_map.width - mayhem.SHIP_SPRITE_SIZE)
+            y = rnd.randrange(0, level_map.height - mayhem.SHIP_SPRITE_SIZE)
+
+            distance = level_map.distance_at(x + mayhem.SHIP_SPRITE_SIZE//2, y + mayhem.SHIP_SPRITE_SIZE//2)
+            if distance > mayhem.SHIP_RADIUS:
+                far.append((x, y))
+            elif distance > 0:
+                near.append((x, y))
+
+        ship = new_ship(1, 0, 0)
+
+        def run(positions):
+            for ship.xpos, ship.ypos in positions[:50]:
+                ship.collide_map(level_map, env.platforms)
+                ship.explod = False
+
+        level_map.get_mask() # built once, not measured
+
+        for name, positions, mini_mask in (("far", far, True), ("mini_mask", near, True), ("full_mask", near, False)):
+            mayhem.USE_MINI_MASK = mini_mask
+            curves[name].append((size, measure(lambda: run(positions)) / 50))
+
+        mayhem.USE_MINI_MASK = True
+
+    return curves
+
+def bench_collide_ship(env):
+    """ Ship.collide_ship for all the ships (one frame), ships spread on the map / all in the same spot """
+
+    curves = {"spread": [], "cluster": []}
+    rnd = random.Random(SEED)
+
+    for count in (2, 4, 8, 16, 32):
+        for name in curves:
+            if name == "spread":
+                ships = [new_ship(i, rnd.randrange(0, 1500), rnd.randrange(0, 2300)) for i in range(count)]
+            else:
+                ships = [new_ship(i, 400 + rnd.randrange(0, 24), 400 + rnd.randrange(0, 24)) for i in range(count)]
+
+            def frame():
+                for ship in ships:
+                    ship.collide_ship(ships)
+                for ship in ships:
+                    ship.explod = False
+
+            curves[name].append((count, measure(frame)))
+
+    return curves
+
+def bench_collide_shots(env):
+    """ Ship.collide_shots for all the ships (one frame): 4 ships against the shots per ship,
+        20 shots per ship against the ship count. Shields on: every shot is tested """
+
+    curves = {"shots (4 ships)": [], "ships (20 shots)": []}
+    rnd = random.Random(SEED)
+
+    def new_frame(ship_count, shot_count):
+        ships = [new_ship(i, 200 + 64 * i, 400) for i in range(ship_count)]
+
+        for ship in ships:
+            ship.shield = True
+
+            # shots around the other ships, inside or next to their masks
+            for _ in range(shot_count):
+                target = rnd.choice(ships)
+                ship.shots.append(new_shot(rnd, target.xpos + rnd.randrange(-8, 40), target.ypos + rnd.randrange(-8, 40)))
+
+        def frame():
+            for ship in ships:
+                ship.collide_shots(ships)
+
+        return frame
+
+    for shot_count in (0, 5, 10, 20, 40, 80):
+        curves["shots (4 ships)"].append((shot_count, measure(new_frame(4, shot_count))))
+
+    for ship_count in (2, 4, 8, 16):
+        curves["ships (20 shots)"].append((ship_count, measure(new_frame(ship_count, 20))))
+
+    return curves
+
+def bench_is_landed(env):
+    """ Ship.is_landed against the platform count (level platforms repeated) """
+
+    curves = {"platforms": []}
+
+    env.set_level_and_ships(6)
+    platforms = list(env.platforms)
+
+    ship = new_ship(1, 100, 100)
+    ship.vy = 1.
+
+    for count in (4, 16, 64, 256):
+        env.platforms = (platforms * (count // len(platforms) + 1))[:count]
+        curves["platforms"].append((count, measure(lambda: ship.is_landed(env))))
+
+    env.platforms = platforms
+
+    return curves
+
+def bench_move_shots(env):
+    """ Ship.move_shots (one frame) against the shot count, shots flying for 30 frames """
+
+    curves = {"shots": []}
+    rnd = random.Random(SEED)
+
+    env.set_level_and_ships(6)
+    level_map = env.level_map
+
+    for count in (10, 100, 1000):
+        shots = []
+
+        def setup():
+            shots[:] = [new_shot(rnd, rnd.randrange(0, level_map.width), rnd.randrange(0, level_map.height)) for _ in range(count)]
+
+        curves["shots"].append((count, measure(lambda: mayhem.Ship.move_shots(None, level_map, shots), setup, calls_per_setup=30)))
+
+    return curves
+
+def bench_rotate_mask(env):
+    """ do_move rotation: transform.rotate + mask.from_surface, all angles, against the sprite size """
+
+    curves = {"sprite size": []}
+
+    ship = new_ship(1, 0, 0)
+    angles = [a * env.SHIP_ANGLESTEP for a in range(int(360 / env.SHIP_ANGLESTEP))]
+
+    for size in (32, 64, 128):
+        image = pygame.transform.scale(ship.ship_pic, (size, size))
+
+        def rotate_all():
+            for angle in angles:
+                image_rotated = pygame.transform.rotate(image, angle)
+                pygame.mask.from_surface(image_rotated)
+
+        curves["sprite size"].append((size, measure(rotate_all) / len(angles)))
+
+    return curves
+
+KERNELS = {
+    "collide_map": bench_collide_map,
+    "collide_ship": bench_collide_ship,
+    "collide_shots": bench_collide_shots,
+    "is_landed": bench_is_landed,
+    "move_shots": bench_move_shots,
+    "rotate_mask": bench_rotate_mask,
+}
+
+def available_levels():
+    return [level for level, map_path in sorted(mayhem.LEVEL_MAPS.items()) if os.path.exists(map_path)]
+
+# -------------------------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-kernels', '--kernels', help='comma separated: %s' % ", ".join(KERNELS), action="store", default=",".join(KERNELS))
+    parser.add_argument('-min_time', '--min_time', help='seconds measured per size', type=float, action="store", default=MIN_TIME)
+    parser.add_argument('-output', '--output', help='write the curves to this JSON file', action="store", default="")
+
+    args = parser.parse_args()
+
+    kernels = args.kernels.split(",")
+    for kernel in kernels:
+        if kernel not in KERNELS:
+            parser.error("unknown kernel %s" % kernel)
+
+    MIN_TIME = args.min_time
+
+    pygame.init()
+    pygame.mixer.init()
+    game = mayhem.GameWindow(WIDTH, HEIGHT)
+    env = mayhem.MayhemEnv(game, level=6, max_fps=0, debug_print=0, show_all_players=True)
+
+    results = {}
+
+    for kernel in kernels:
+        curves = KERNELS[kernel](env)
+        results[kernel] = curves
+
+        print(kernel)
+        for name, curve in curves.items():
+            points = "  ".join("%s: %.2f" % (format_size(size), us) for size, us in curve)
+            print("    %-18s %s us  (growth %.2f)" % (name, points, growth(curve)))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+        print("Results saved to %s" % args.output)
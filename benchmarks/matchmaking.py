@@ -0,0 +1,134 @@
+"""
+Matchmaking benchmark: GameServerFactory.add_player() / del_player() latency against the number of
+rooms, without network (players are stubs, the messages are packed but not sent).
+
+    join_free: one room has a free ship (a player just left it), a player joins it
+    join_new:  all the rooms are full, a player joins: new room, then leaves: room removed, id released
+
+Each curve should stay flat (growth exponent close to 0) as the room count grows.
+
+python3 benchmarks/matchmaking.py
+python3 benchmarks/matchmaking.py --rooms=100,1000,10000,50000 --output=matchmaking.json
+"""
+
+import os, sys, json, math, time, random, argparse, contextlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import server
+
+SEED = 1
+SHIPS_PER_ROOM = 4
+
+# -------------------------------------------------------------------------------------------------
+
+class StubPlayer():
+    """ What add_player() / del_player() use of a PlayerProtocol """
+
+    state = server.PlayerProtocol.STATE_OPEN
+
+    def __init__(self, number):
+        self.peer = "stub:%s" % number
+        self.room_id = None
+        self.ship_nb = None
+
+    def sendMessage(self, payload, isBinary=False):
+        pass
+
+    def sendPreparedMessage(self, prepared):
+        pass
+
+def new_factory(room_count):
+    """ Server with room_count full rooms, returns (factory, players) """
+
+    # the reactor does not run: the tick loops are scheduled, never called. join_new needs a room over room_count
+    factory = server.GameServerFactory("ws://127.0.0.1:4444", limits=dict(server.DEFAULT_LIMITS, max_rooms=room_count + 1))
+
+    players = []
+    for i in range(room_count * SHIPS_PER_ROOM):
+        player = StubPlayer(i)
+        factory.add_player(player)
+        players.append(player)
+
+    return factory, players
+
+def join_free(factory, players, rnd, count):
+    """ us per join into the room a random player just left """
+
+    total = 0.
+    for _ in range(count):
+        i = rnd.randrange(len(players))
+        factory.del_player(players[i])
+
+        player = StubPlayer(-1)
+        t0 = time.perf_counter()
+        factory.add_player(player)
+        total += time.perf_counter() - t0
+
+        players[i] = player
+
+    return total / count * 1e6
+
+def join_new(factory, players, rnd, count):
+    """ us per join (new room) + leave (room removed) with all the rooms full """
+
+    total = 0.
+    for _ in range(count):
+        player = StubPlayer(-1)
+        t0 = time.perf_counter()
+        factory.add_player(player)
+        factory.del_player(player)
+        total += time.perf_counter() - t0
+
+    return total / count * 1e6
+
+SCENARIOS = {
+    "join_free": join_free,
+    "join_new": join_new,
+}
+
+def growth(curve):
+    """ log-log slope between the first and the last point """
+
+    (n0, t0), (n1, t1) = curve[0], curve[-1]
+    if n1 == n0 or t0 <= 0:
+        return 0.
+    return math.log(t1 / t0) / math.log(n1 / n0)
+
+# -------------------------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-rooms', '--rooms', help='comma separated room counts', action="store", default="10,100,1000,10000")
+    parser.add_argument('-ops', '--ops', help='measured joins per room count', type=int, action="store", default=2000)
+    parser.add_argument('-output', '--output', help='write the curves to this JSON file', action="store", default="")
+
+    args = parser.parse_args()
+
+    room_counts = [int(count) for count in args.rooms.split(",")]
+
+    curves = {name: [] for name in SCENARIOS}
+
+    for room_count in room_counts:
+        rnd = random.Random(SEED)
+
+        # the server logs each join / leave
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            factory, players = new_factory(room_count)
+            results = {name: scenario(factory, players, rnd, args.ops) for name, scenario in SCENARIOS.items()}
+
+        for name, us in results.items():
+            curves[name].append((room_count, us))
+
+        print("%6s rooms: %s" % (room_count, "  ".join("%s %.1f us" % (name, us) for name, us in results.items())))
+
+    for name, curve in curves.items():
+        print("%-10s growth %.2f" % (name, growth(curve)))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(curves, f, indent=4)
+        print("Results saved to %s" % args.output)
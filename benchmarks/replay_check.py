@@ -0,0 +1,109 @@
+"""
+Replay regression check: re-simulates recorded matches (--record_play) in turbo mode, headless
+(SDL dummy video / audio), and compares the state hash after each step to the saved one.
+
+Run it with --save before a physics change, then without: any replay whose simulation changed
+fails (exit code 1) with the first frame where the state differs.
+
+python3 benchmarks/replay_check.py --save replays/*.mrp
+python3 benchmarks/replay_check.py replays/*.mrp
+"""
+
+import os, sys, argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# before pygame is imported
+os.environ["SDL_VIDEODRIVER"] = "dummy"
+os.environ["SDL_AUDIODRIVER"] = "dummy"
+
+sys.path.insert(0, ROOT)
+
+import pygame
+import mayhem
+from replay import turbo_replay, print_summary
+
+WIDTH = 704 * 2
+HEIGHT = 448 * 2
+
+HASHES_EXT = ".hashes"
+
+# -------------------------------------------------------------------------------------------------
+
+def first_difference(path, expected_path):
+    """ (frame, hash, expected hash) of the first different line, None if same """
+
+    with open(path) as f, open(expected_path) as expected:
+        for line, expected_line in zip(f, expected):
+            if line != expected_line:
+                frame, h = line.split()
+                return int(frame), h, expected_line.split()[1]
+
+    # one of them is shorter
+    with open(path) as f, open(expected_path) as expected:
+        count, expected_count = sum(1 for _ in f), sum(1 for _ in expected)
+
+    if count != expected_count:
+        return min(count, expected_count) + 1, "frames %s" % count, "frames %s" % expected_count
+
+    return None
+
+def check_replay(game, path, save, render_every):
+    """ Returns False if the hashes differ from the saved ones """
+
+    expected_path = path + HASHES_EXT
+    hashes_path = expected_path if save else expected_path + ".new"
+
+    # the replay header gives the level, motion, physics and seed
+    env = mayhem.MayhemEnv(game, max_fps=0, debug_print=0, show_all_players=True, play_recorded=path)
+    summary = turbo_replay(env, render_every=render_every, hashes_path=hashes_path)
+    env.replay.close()
+
+    print(path)
+    print_summary(summary)
+
+    if save:
+        print("Hashes saved to %s" % hashes_path)
+        return True
+
+    if not os.path.exists(expected_path):
+        print("    no %s (run with --save)" % expected_path)
+        os.remove(hashes_path)
+        return True
+
+    difference = first_difference(hashes_path, expected_path)
+    os.remove(hashes_path)
+
+    if difference:
+        print("    FAIL at frame %s: %s (saved %s)" % difference)
+        return False
+
+    print("    same as saved")
+    return True
+
+# -------------------------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('replays', help='replay files', nargs="+")
+    parser.add_argument('-save', '--save', help='save the hashes (replay file + %s)' % HASHES_EXT, action="store_true", default=False)
+    parser.add_argument('-render', '--render', help='render one frame every N steps (0 = none)', type=int, action="store", default=0)
+
+    args = parser.parse_args()
+
+    replays = [os.path.abspath(path) for path in args.replays]
+    os.chdir(ROOT) # assets paths are relative
+
+    pygame.init()
+    pygame.mixer.init()
+    game = mayhem.GameWindow(WIDTH, HEIGHT)
+
+    failed = False
+
+    for path in replays:
+        if not check_replay(game, path, args.save, args.render):
+            failed = True
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,251 @@
+"""
+Game server load harness: rooms of 4 simulated players pushing PLAYER_UPDATE at PLAYER_UPDATE_RATE,
+against the single process server (--workers=0) and sharded servers (server.py --workers N).
+
+For each server configuration the room count is ramped up until the server can not keep up: fewer than
+DELIVERED_MIN of the relayed updates arrive, or their p99 age is over AGE_MAX_MS. Reports the updates
+delivered, their age, the CPU used by the server processes, and the highest room count sustained.
+
+--idle_rooms adds rooms whose players push the same update at PLAYER_IDLE_UPDATE_RATE, as game_client.py
+does for a landed ship: they should cost the server (almost) nothing.
+
+The simulated players run in --procs processes (spawned per step, one reactor each): the load
+generators and the server workers need their own cores for the capacity to scale with the workers.
+
+python3 benchmarks/server_load.py
+python3 benchmarks/server_load.py --workers=0,2,4 --rooms=20,40,80,160 --procs=4 --output=server_load.json
+python3 benchmarks/server_load.py --workers=0 --rooms=0,10 --idle_rooms=100
+"""
+
+import os, sys, json, time, socket, argparse, subprocess, multiprocessing
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from game_protocol import Action, PROTOCOL_VERSION, PLAYER_UPDATE_RATE, PLAYER_IDLE_UPDATE_RATE
+
+SHIPS_PER_ROOM = 4
+
+DELIVERED_MIN = 0.9
+AGE_MAX_MS = 50
+
+CONNECT_TIME = 3 # s given to the players to log in before measuring
+START_TIMEOUT = 10 # s for the server (and its workers) to listen
+
+# -------------------------------------------------------------------------------------------------
+# Load generator process
+
+def generate(url, rooms, idle_rooms, start, duration, results):
+    """ Players of the given rooms, counts the updates of the active ones received between start and start + duration """
+
+    import msgpack
+
+    from twisted.internet import reactor, task
+    from autobahn.twisted.websocket import WebSocketClientFactory, WebSocketClientProtocol, connectWS
+
+    stats = {"received":0, "ages":[], "logged":0, "sent":0}
+    players = []
+
+    class LoadPlayer(WebSocketClientProtocol):
+
+        def onOpen(self):
+            self.ship_nb = None
+            msg = {"a":Action.LOGIN, "p":{"room_id":self.factory.room_id, "version":PROTOCOL_VERSION}}
+            self.sendMessage(msgpack.packb(msg, use_bin_type=True), isBinary=True)
+
+        def onMessage(self, payload, isBinary):
+            msg = msgpack.unpackb(payload, raw=False)
+
+            if msg["a"] == Action.OTHER_PLAYER_UPDATE:
+                now = time.time()
+                if start <= now < start + duration and "t" in msg["p"]:
+                    stats["received"] += 1
+                    stats["ages"].append(now - msg["p"]["t"])
+
+            elif msg["a"] == Action.LOGIN_OK:
+                self.ship_nb = msg["p"]["ship_nb"]
+                self.seq = 0
+                stats["logged"] += 1
+                players.append(self)
+
+            elif msg["a"] == Action.LOGIN_REDIRECT:
+                self.sendClose()
+                connect(msg["p"]["url"], self.factory.room_id, self.factory.idle)
+
+    def connect(url, room_id, idle=False):
+        factory = WebSocketClientFactory(url)
+        factory.protocol = LoadPlayer
+        factory.room_id = room_id
+        factory.idle = idle
+        connectWS(factory)
+
+    pushes = [0]
+
+    def push():
+        now = time.time()
+
+        pushes[0] += 1
+        idle_push = pushes[0] % (PLAYER_UPDATE_RATE // PLAYER_IDLE_UPDATE_RATE) == 0
+
+        for player in players:
+            if player.factory.idle and not idle_push:
+                continue
+
+            player.seq += 1
+
+            update = {"ship_number":player.ship_nb, "player_name":"load", "level":6, "xpos":100., "ypos":100., "angle":0.,
+                      "landed":player.factory.idle, "explod":False, "tp":not player.factory.idle, "sp":False, "shots":[],
+                      "game_over":False, "lives":10, "seq":player.seq}
+
+            # idle ships: nothing changes but the seq (keep-alive)
+            if not player.factory.idle:
+                update["t"] = now
+                if start <= now < start + duration:
+                    stats["sent"] += 1
+
+            player.sendMessage(msgpack.packb({"a":Action.PLAYER_UPDATE, "p":update}, use_bin_type=True), isBinary=True)
+
+    def done():
+        results.put(stats)
+        reactor.stop()
+
+    for room in rooms:
+        for _ in range(SHIPS_PER_ROOM):
+            connect(url, room)
+
+    for room in idle_rooms:
+        for _ in range(SHIPS_PER_ROOM):
+            connect(url, room, idle=True)
+
+    task.LoopingCall(push).start(1. / PLAYER_UPDATE_RATE)
+    reactor.callLater(start + duration - time.time() + 0.5, done)
+    reactor.run()
+
+# -------------------------------------------------------------------------------------------------
+
+def wait_listening(port, timeout=START_TIMEOUT):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+def server_cpu(pid):
+    """ CPU seconds used by pid and its children (Linux /proc), None elsewhere """
+
+    try:
+        pids = [pid] + [int(child) for child in open("/proc/%s/task/%s/children" % (pid, pid)).read().split()]
+        total = 0
+        for p in pids:
+            fields = open("/proc/%s/stat" % p).read().rsplit(")", 1)[1].split()
+            total += int(fields[11]) + int(fields[12]) # utime, stime
+        return total / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError):
+        return None
+
+def run_step(url, pid, room_count, idle_room_count, procs, duration):
+
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+
+    start = time.time() + CONNECT_TIME
+    rooms = ["load-%s" % room for room in range(room_count)]
+    idle_rooms = ["idle-%s" % room for room in range(idle_room_count)]
+
+    generators = [ctx.Process(target=generate, args=(url, rooms[i::procs], idle_rooms[i::procs], start, duration, results))
+                  for i in range(procs)]
+    for generator in generators:
+        generator.start()
+
+    time.sleep(max(0, start - time.time()))
+    cpu0 = server_cpu(pid)
+    time.sleep(duration)
+    cpu1 = server_cpu(pid)
+
+    stats = [results.get() for _ in generators]
+    for generator in generators:
+        generator.join()
+
+    # each player receives the updates of the other ships of its room
+    sent = sum(s["sent"] for s in stats)
+    expected = sent * (SHIPS_PER_ROOM - 1)
+    received = sum(s["received"] for s in stats)
+    ages = sorted(age for s in stats for age in s["ages"]) or [0.]
+
+    return {"rooms":room_count, "idle_rooms":idle_room_count, "logged":sum(s["logged"] for s in stats),
+            "delivered":received / expected if expected else 1.,
+            "age_p50_ms":ages[len(ages) // 2] * 1000, "age_p99_ms":ages[int(len(ages) * 0.99)] * 1000,
+            "server_cpu":(cpu1 - cpu0) / duration if cpu0 is not None and cpu1 is not None else None}
+
+def run_server(workers, port, room_counts, idle_room_count, procs, duration):
+    """ Ramps the room count up on a fresh server, returns the steps """
+
+    url = "ws://127.0.0.1:%s" % port
+
+    # admission limits over the highest step: the harness measures the capacity, not the limits
+    max_rooms = max(room_counts) + idle_room_count
+    limits = ["--max_rooms", str(max_rooms), "--max_connections", str(max_rooms * SHIPS_PER_ROOM)]
+
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, "server.py"), "--url", url, "--workers", str(workers)] + limits,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    steps = []
+    try:
+        ports = [port] + [port + 1 + shard for shard in range(workers)]
+        if not all(wait_listening(p) for p in ports):
+            print("Server not listening on %s" % ports)
+            return steps
+
+        for room_count in room_counts:
+            step = run_step(url, server.pid, room_count, idle_room_count, procs, duration)
+            steps.append(step)
+
+            cpu = "%.0f%%" % (step["server_cpu"] * 100) if step["server_cpu"] is not None else "-"
+            print("workers %s rooms %4s: players %4s delivered %5.1f%%  age p50 %6.1f ms p99 %6.1f ms  server cpu %s" %
+                  (workers, room_count, step["logged"], step["delivered"] * 100, step["age_p50_ms"], step["age_p99_ms"], cpu))
+
+            if not sustained(step):
+                break
+    finally:
+        server.terminate()
+        server.wait()
+
+    return steps
+
+def sustained(step):
+    return step["delivered"] >= DELIVERED_MIN and step["age_p99_ms"] <= AGE_MAX_MS
+
+# -------------------------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-workers', '--workers', help='comma separated server worker counts (0: single process server)', action="store", default="0,2")
+    parser.add_argument('-rooms', '--rooms', help='comma separated room counts, ramped up until the server can not keep up', action="store", default="5,10,20,40,80")
+    parser.add_argument('-idle_rooms', '--idle_rooms', help='rooms of idle players (same update again and again) at each step', type=int, action="store", default=0)
+    parser.add_argument('-procs', '--procs', help='load generator processes', type=int, action="store", default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument('-duration', '--duration', help='measured seconds per room count', type=float, action="store", default=5.)
+    parser.add_argument('-port', '--port', help='server port (workers on the next ones)', type=int, action="store", default=4700)
+    parser.add_argument('-output', '--output', help='write the results to this JSON file', action="store", default="")
+
+    args = parser.parse_args()
+
+    room_counts = [int(count) for count in args.rooms.split(",")]
+
+    results = {}
+    for workers in [int(count) for count in args.workers.split(",")]:
+        steps = run_server(workers, args.port, room_counts, args.idle_rooms, args.procs, args.duration)
+        results[workers] = steps
+
+    print()
+    for workers, steps in results.items():
+        capacity = max([step["rooms"] for step in steps if sustained(step)], default=0)
+        print("workers %s: %s rooms sustained (%s players)" % (workers, capacity, capacity * SHIPS_PER_ROOM))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+        print("Results saved to %s" % args.output)
@@ -0,0 +1,124 @@
+"""
+Cold start benchmark, based on python -X importtime.
+
+Fails (exit code 1) if an optional subsystem leaks back into the default import of mayhem.py or
+if the import time is over its absolute budget. Once you saved a baseline of your machine (--save:
+startup_baseline.json, not committed, import times are machine specific), also if it regressed.
+
+python3 benchmarks/startup.py
+python3 benchmarks/startup.py --save
+python3 benchmarks/startup.py --runs=10 --tolerance=0.25
+"""
+
+import os, sys, re, json, argparse, subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(ROOT, "benchmarks", "startup_baseline.json")
+
+# module imported => modules which must not be imported by it (only loaded when their mode is selected)
+TARGETS = {
+    "mayhem": ("moderngl", "imgui", "my_imgui", "pygame_menu", "numpy", "twisted", "autobahn", "msgpack"),
+    "server": ("pygame", "pygame_menu", "moderngl", "imgui"),
+}
+
+# module imported => import time budget (ms), whatever the machine and the baseline: about 3 times
+# the import time of a laptop, only a gross regression (a heavy subsystem imported again) goes over
+BUDGETS_MS = {
+    "mayhem": 250,
+    "server": 1000,
+}
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)$")
+
+# -------------------------------------------------------------------------------------------------
+
+def import_time(module):
+    """ Returns (total import time in us, set of imported modules) for a fresh interpreter """
+
+    p = subprocess.run([sys.executable, "-X", "importtime", "-c", "import %s" % module],
+                       cwd=ROOT, capture_output=True, text=True)
+    if p.returncode != 0:
+        raise RuntimeError("import %s failed:\n%s" % (module, p.stderr))
+
+    total_us = 0
+    modules = set()
+
+    for line in p.stderr.splitlines():
+        m = IMPORTTIME_LINE.match(line)
+        if not m:
+            continue
+
+        cumulative, indent, name = int(m.group(2)), len(m.group(3)), m.group(4)
+        modules.add(name)
+
+        # top level imports only, nested ones are already in the cumulative time
+        if indent == 1:
+            total_us += cumulative
+
+    return total_us, modules
+
+def measure(module, runs):
+    best_us = None
+    modules = set()
+
+    for _ in range(runs):
+        us, modules = import_time(module)
+        if best_us is None or us < best_us:
+            best_us = us
+
+    return best_us, modules
+
+# -------------------------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-runs', '--runs', help='imports per target, best one is kept', type=int, action="store", default=5)
+    parser.add_argument('-tolerance', '--tolerance', help='allowed slowdown vs baseline', type=float, action="store", default=0.25)
+    parser.add_argument('-baseline', '--baseline', help='baseline JSON file (module => import time in us) to compare with, or to write with --save', action="store", default=BASELINE)
+    parser.add_argument('-save', '--save', help='save the results as the new baseline', action="store_true", default=False)
+
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    elif not args.save:
+        print("No baseline %s: only the budgets are checked (--save to create it)" % args.baseline)
+
+    results = {}
+    failed = False
+
+    for module, forbidden in TARGETS.items():
+        us, modules = measure(module, args.runs)
+        results[module] = us
+
+        leaked = sorted(set(name.split(".")[0] for name in modules) & set(forbidden))
+        if leaked:
+            failed = True
+            print("FAIL %s imports %s" % (module, ", ".join(leaked)))
+
+        line = "%-8s %8.1f ms" % (module, us / 1000.)
+
+        if us / 1000. > BUDGETS_MS[module]:
+            failed = True
+            line += "  (budget %s ms)  FAIL" % BUDGETS_MS[module]
+
+        if module in baseline:
+            ratio = us / baseline[module]
+            line += "  (baseline %.1f ms, x%.2f)" % (baseline[module] / 1000., ratio)
+
+            if ratio > 1 + args.tolerance:
+                failed = True
+                line += "  FAIL"
+
+        print(line)
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=4)
+        print("Baseline saved to %s" % args.baseline)
+
+    sys.exit(1 if failed else 0)
@@ -1,28 +1,9 @@
-import sys, json, enum, msgpack
+import sys, json, msgpack
 
 from twisted.internet import reactor
 from autobahn.twisted.websocket import WebSocketClientFactory, WebSocketClientProtocol, connectWS
 
-# -------------------------------------------------------------------------------------------------
-
-class Action(str, enum.Enum):
-
-    PLAY        = enum.auto()
-    LOGIN_OK    = enum.auto()
-    LOGIN_DENY  = enum.auto()
-    LOGIN       = enum.auto()
-    EXITED      = enum.auto()
-
-    PLAYER_UPDATE = enum.auto()
-    PLAYER_UPDATE_REQUEST = enum.auto()
-
-    OTHER_PLAYER_UPDATE = enum.auto()
-
-    SERVER_STAT_REGISTER = enum.auto()
-    SERVER_STAT_OK = enum.auto()
-    SERVER_STAT_UPDATE = enum.auto()
-
-    OTHER_PLAYER_DISCONNECT = enum.auto()
+from game_protocol import Action, PROTOCOL_VERSION
 
 # -------------------------------------------------------------------------------------------------
 
@@ -33,7 +14,7 @@ class GameClientProtocol(WebSocketClientProtocol):
 
         # login test
         if 0:
-            msg = {"a" : Action.LOGIN, "p":{"room_id":3}}
+            msg = {"a" : Action.LOGIN, "p":{"room_id":3, "version":PROTOCOL_VERSION}}
             #msg = {"a" : Action.LOGIN, "p":""}
 
             #self.sendMessage(json.dumps(msg).encode('utf8'))
@@ -58,21 +39,15 @@ class GameClientProtocol(WebSocketClientProtocol):
             elif r["a"] == Action.LOGIN_DENY:
                 print("Failed to enter in the game: %s"  % r["p"])
 
+            elif r["a"] == Action.LOGIN_REDIRECT:
+                print("Sharded server, room served by %s" % r["p"]["url"])
+
             elif r["a"] == Action.SERVER_STAT_OK:
                 print("Watching server stat...")
 
             elif r["a"] == Action.SERVER_STAT_UPDATE:
                 print("Server stat= %s" % r["p"])
 
-            # elif r["a"] == Action.PLAYER_UPDATE_REQUEST:
-            #     print("Player update requested, sending player update...")
-
-            #     ship_update = { "ship_number":"3", "player_name":"alex", "level":"6", "xpos":"999", "ypos":"666", "angle":"55", 
-            #                     "tp":"True", "sp":"False", "shots":[(500, 500), (600, 600),] }
-                
-            #     msg = {"a" : Action.PLAYER_UPDATE, "p":ship_update}
-            #     self.sendMessage(json.dumps(msg).encode('utf8'))
-
             elif r["a"] == Action.OTHER_PLAYER_UPDATE:
                 print("Received another player update: ", r["p"])
                 # todo update player pos in the gameplay
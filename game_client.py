@@ -0,0 +1,172 @@
+import msgpack
+
+from twisted.internet import reactor
+from twisted.internet.protocol import ReconnectingClientFactory
+from autobahn.twisted.websocket import WebSocketClientFactory, WebSocketClientProtocol, connectWS
+
+from game_protocol import Action, PROTOCOL_VERSION, PLAYER_UPDATE_RATE, PLAYER_IDLE_UPDATE_RATE
+
+# -------------------------------------------------------------------------------------------------
+# Websocket game client used by mayhem.py in online mode (imported only when a server is selected)
+
+class GameClientProtocol(WebSocketClientProtocol):
+
+    # connect to the game server
+    # then the player pushes its position etc at a fixed rate (GameClientFactory.push_update())
+    # the server relays the last one to all other players in the room at each tick
+     
+    def onOpen(self):
+        print("Connected to the GameServer, username=%s" % self.factory.player_name)
+        print("Requesting room_id=%s" % self.factory.room_id)
+
+        self.factory.client = self
+
+        msg = {"a":Action.LOGIN, "p":{"room_id":self.factory.room_id, "version":PROTOCOL_VERSION}}
+        self.sendMessage(msgpack.packb(msg, use_bin_type=True), isBinary=True)
+
+    def onMessage(self, payload, isBinary):
+
+        r = msgpack.unpackb(payload, raw=False)
+
+        if r["a"] == Action.LOGIN_OK:
+            print("Entered in the game in room %s as ship n°%s" % (str(r["p"]["room_id"]), str(r["p"]["ship_nb"])))
+            self.factory.room_id = str(r["p"]["room_id"])
+            self.factory.ship_number = str(r["p"]["ship_nb"]) # we are ship #x in the game
+            self.factory._state = Action.PLAY
+
+        elif r["a"] == Action.LOGIN_DENY:
+            print("Failed to enter in the game: %s"  % r["p"])
+            # TODO retry
+
+        # sharded server: our room is on this worker, LOGIN again there (see onClose())
+        elif r["a"] == Action.LOGIN_REDIRECT:
+            print("Room served by %s, reconnecting" % r["p"]["url"])
+            self.factory.redirect_url = r["p"]["url"]
+            self.sendClose()
+
+        elif r["a"] == Action.OTHER_PLAYER_UPDATE:
+            #print("Received another player update: ", r["p"])
+
+            ship_update = r["p"]
+            ship_number = str(ship_update["ship_number"])
+
+            # older than the last one received for this ship: ignored
+            seq = ship_update.get("seq", 0)
+            if seq and seq <= self.factory.other_seqs.get(ship_number, 0):
+                return
+            self.factory.other_seqs[ship_number] = seq
+
+            setattr(self.factory, "other_player_%s" % ship_number, ship_update)
+
+        elif r["a"] == Action.OTHER_PLAYER_DISCONNECT:
+            print("Received another player disconnect: ", r["p"])
+
+            ship_number = r["p"]
+
+            # the next player on this ship starts again from seq 1
+            self.factory.other_seqs.pop(str(ship_number), None)
+
+            try:
+                if ship_number in ("1", 1):
+                    del self.factory.other_player_1
+                elif ship_number in ("2", 2):
+                    del self.factory.other_player_2
+                elif ship_number in ("3", 3):
+                    del self.factory.other_player_3
+                elif ship_number in ("4", 4):
+                    del self.factory.other_player_4
+            except Exception as e:
+                print("Failed to remove other player %s : %s" % (str(ship_number), repr(e)))
+
+    def onClose(self, wasClean, code, reason):
+        self.factory.client = None
+
+        if self.factory.redirect_url:
+            self.factory.setSessionParameters(self.factory.redirect_url)
+            self.factory.redirect_url = None
+            connectWS(self.factory)
+            return
+
+        print("Exited from the GameServer")
+        self.factory._state = Action.EXITED
+
+# -------------------------------------------------------------------------------------------------
+
+#class GameClientFactory(WebSocketClientFactory, ReconnectingClientFactory):
+class GameClientFactory(WebSocketClientFactory):
+    """ Player update paquet vars """
+
+    def __init__(self, url, player_name, room_id, lives):
+        WebSocketClientFactory.__init__(self, url)
+        #ReconnectingClientFactory.__init__(self)
+
+        self._state = Action.LOGIN
+
+        self.server_url = url
+        self.redirect_url = None
+        self.player_name = player_name
+        self.room_id = room_id
+
+        # connected protocol instance, see push_update()
+        self.client = None
+        self.seq = 0
+        self.disconnect_scheduled = False
+
+        # last update pushed (without seq), unchanged updates not pushed since
+        self.last_pushed = None
+        self.skipped_pushes = 0
+
+        # ship_number => seq of the last OTHER_PLAYER_UPDATE received
+        self.other_seqs = {}
+        
+        #{ ship_number: 1, "player_name":"tony", "level":"6", "xpos":"412", "ypos":"517", "angle":"250", "tp":"True", "sp":"False", landed, "shots":[(x,y), (x2, y2), ...]} }
+        self.ship_number = "1"
+        self.level = 6
+        self.xpos = 0
+        self.ypos = 0
+        self.angle = 0
+        self.tp = False
+        self.sp = False
+        self.landed = True
+        self.shots = []
+        self.explod = False
+        self.game_over = False
+        self.lives = lives
+
+    def push_update(self):
+        """ Sends our player update (called by mayhem.py at PLAYER_UPDATE_RATE) """
+
+        if self.client is None or self._state != Action.PLAY:
+            return
+
+        # { "ship_number":"3", "player_name":"tony, "level":"6", "xpos":"412", "ypos":"517", "angle":"250", "tp":"True", "sp":"False", "shots":[(x,y), (x2, y2), ...], "seq":1 }
+        ship_update = { "ship_number":self.ship_number, "player_name":self.player_name, "level":self.level,
+                        "xpos":self.xpos, "ypos":self.ypos, "angle":self.angle, "landed":self.landed, "explod":self.explod,
+                        "tp":self.tp, "sp":self.sp, "shots":self.shots, "game_over":self.game_over, "lives":self.lives }
+
+        # nothing changed (landed, game over...): keep-alive rate only
+        if ship_update == self.last_pushed and self.skipped_pushes + 1 < PLAYER_UPDATE_RATE // PLAYER_IDLE_UPDATE_RATE:
+            self.skipped_pushes += 1
+            return
+
+        self.last_pushed = dict(ship_update)
+        self.skipped_pushes = 0
+
+        self.seq += 1
+        ship_update["seq"] = self.seq
+
+        msg = {"a":Action.PLAYER_UPDATE, "p":ship_update}
+        self.client.sendMessage(msgpack.packb(msg, use_bin_type=True), isBinary=True)
+
+        if self.game_over and not self.disconnect_scheduled:
+            #print("Game Over, disconnecting...")
+            self.disconnect_scheduled = True
+            reactor.callLater(5, self.client.dropConnection, abort=True)
+
+    #def clientConnectionFailed(self, connector, reason):
+    #    print("Client connection failed .. retrying ..")
+    #    self.retry(connector)
+
+    #def clientConnectionLost(self, connector, reason):
+    #    print("Client connection lost .. retrying ..")
+    #    self.retry(connector)
@@ -0,0 +1,38 @@
+import enum
+
+# -------------------------------------------------------------------------------------------------
+# Messages exchanged between the GameServer (server.py) and the game clients (mayhem.py, client.py)
+#
+# msg = {"a":Action.xxx, "p":payload} packed with msgpack
+#
+# Players push their PLAYER_UPDATE at PLAYER_UPDATE_RATE (with a sequence number "seq"), the server
+# relays the newest one of each player to the other players of the room at each tick (OTHER_PLAYER_UPDATE).
+# Idle ships (landed, game over...) only push at PLAYER_IDLE_UPDATE_RATE, and their rooms are ticked slower
+#
+# A sharded server (server.py --workers N) answers LOGIN with LOGIN_REDIRECT {"url":worker url}: the
+# client reconnects to this worker and sends its LOGIN again
+
+PROTOCOL_VERSION = 3 # sent with LOGIN, 2: pushed updates (no more PLAYER_UPDATE_REQUEST), 3: LOGIN_REDIRECT
+
+PLAYER_UPDATE_RATE = 60 # Hz
+PLAYER_IDLE_UPDATE_RATE = 2 # Hz, keep-alive: an update identical to the previous one (but its seq) is not pushed more often
+
+class Action(str, enum.Enum):
+
+    PLAY        = enum.auto()
+    LOGIN_OK    = enum.auto()
+    LOGIN_DENY  = enum.auto()
+    LOGIN       = enum.auto()
+    EXITED      = enum.auto()
+
+    PLAYER_UPDATE = enum.auto()
+
+    OTHER_PLAYER_UPDATE = enum.auto()
+
+    SERVER_STAT_REGISTER = enum.auto()
+    SERVER_STAT_OK = enum.auto()
+    SERVER_STAT_UPDATE = enum.auto()
+
+    OTHER_PLAYER_DISCONNECT = enum.auto()
+
+    LOGIN_REDIRECT = enum.auto()
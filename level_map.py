@@ -0,0 +1,301 @@
+"""
+Level maps as tiles (mayhem.py): the source image is only kept per tile, compressed, and a tile is
+converted to the display format, with its terrain mask, when first used (LRU cache, TILE_CACHE_BUDGET).
+
+    level_map = TiledMap(path)
+    level_map.blit(dest, dest_pos, area)      # like dest.blit(map, dest_pos, area)
+    level_map.overlap(mask, pos), level_map.is_solid(x, y), level_map.distance_at(x, y)
+    level_map.next_frame()                    # each render / simulation step
+
+What still grows with the map area: the compressed tile sources (about 1/10 of a byte per pixel on
+the shipped maps), the pyramid (1/2 map and below, display format) and the distance field (a byte
+per DISTANCE_CELL x DISTANCE_CELL cell). get_mask() builds a full map mask (a bit per pixel), kept
+until the map is dropped: only the big mask collision path (USE_MINI_MASK off) uses it.
+"""
+
+import zlib, collections
+
+import pygame
+
+# -------------------------------------------------------------------------------------------------
+
+TILE_SIZE = 128
+
+# zlib level of the tile sources (the maps are mostly background: fast and about 10x smaller)
+TILE_SOURCE_COMPRESSION = 1
+
+# bytes of decoded tiles (display format surface + mask) kept in memory, least recently used tiles are evicted
+TILE_CACHE_BUDGET = 12 * 1024 * 1024
+
+# the map is downsampled by 2 until this size, for the minimap and the overview
+PYRAMID_MIN_SIZE = 64
+
+# distance field: distance to the nearest terrain pixel, per cell of DISTANCE_CELL x DISTANCE_CELL pixels
+# (a lower bound, good enough to skip the mask tests far from any wall), clamped at DISTANCE_MAX
+DISTANCE_CELL = 4 # divides the tile size: each tile fills whole cells
+DISTANCE_MAX = 64
+
+# -------------------------------------------------------------------------------------------------
+
+class MapTile():
+    def __init__(self, surface, mask, x, y):
+        self.surface = surface
+        self.mask = mask
+        self.x = x
+        self.y = y
+        self.size_bytes = surface.get_width() * surface.get_height() * surface.get_bytesize() + mask.get_size()[0] * mask.get_size()[1] // 8
+        self.last_frame = 0
+
+# -------------------------------------------------------------------------------------------------
+
+class TiledMap():
+    """ A level map split in fixed size tiles, only the tiles around a ship or a view are decoded """
+
+    def __init__(self, map_path, tile_size=TILE_SIZE, cache_budget=TILE_CACHE_BUDGET):
+
+        # the source is only kept per tile, compressed (the maps are 256 colors: a byte per pixel):
+        # a tile is converted to the display format and gets its terrain mask when first used
+        source = pygame.image.load(map_path)
+
+        self.width, self.height = source.get_size()
+        self.rect = source.get_rect()
+
+        if source.get_bitsize() == 8:
+            self.source_format = "P"
+            self.palette = source.get_palette()
+        else:
+            self.source_format = "RGB"
+            self.palette = None
+
+        self.tile_size = tile_size
+        self.cols = (self.width + tile_size - 1) // tile_size
+        self.rows = (self.height + tile_size - 1) // tile_size
+
+        # (col, row) => compressed source pixels
+        self.tile_sources = {}
+
+        # (col, row) => MapTile, in least recently used order
+        self.tiles = collections.OrderedDict()
+        self.cache_budget = cache_budget
+        self.cache_bytes = 0
+
+        self.frame = 0
+        self.decoded = 0
+        self.evicted = 0
+
+        # full map mask, only built when asked (see USE_MINI_MASK)
+        self.mask = None
+
+        # built once at load, one converted tile at a time (never the whole map in the display format)
+        self.distance_cols = (self.width + DISTANCE_CELL - 1) // DISTANCE_CELL
+        self.distance_rows = (self.height + DISTANCE_CELL - 1) // DISTANCE_CELL
+        half, solid_cells = self.scan_tiles(source)
+
+        # [1/2 map, 1/4 map, ...]
+        self.pyramid = self.build_pyramid(half)
+
+        # distance to the nearest terrain pixel, one byte per cell
+        self.distance = self.build_distance_field(solid_cells)
+
+    def next_frame(self):
+        """ A new render or simulation step: the tiles used from now on are protected from eviction """
+
+        self.frame += 1
+        self.evict()
+
+    def tile_area(self, col, row):
+        return pygame.Rect(col * self.tile_size, row * self.tile_size, self.tile_size, self.tile_size).clip(self.rect)
+
+    def tile_source(self, col, row, area):
+        """ The source pixels of a tile, as loaded """
+
+        data = zlib.decompress(self.tile_sources[(col, row)])
+        source = pygame.image.frombytes(data, area.size, self.source_format)
+        if self.palette is not None:
+            source.set_palette(self.palette)
+
+        return source
+
+    def decode_tile(self, col, row):
+        area = self.tile_area(col, row)
+
+        surface = self.tile_source(col, row, area).convert()
+        surface.set_colorkey( (0, 0, 0) ) # used for the mask, black = background
+        mask = pygame.mask.from_surface(surface)
+        surface.set_colorkey(None) # black is also the screen clear color: blit it opaque (faster)
+
+        self.decoded += 1
+
+        return MapTile(surface, mask, area.x, area.y)
+
+    def get_tile(self, col, row):
+        key = (col, row)
+
+        tile = self.tiles.get(key)
+        if tile is None:
+            tile = self.decode_tile(col, row)
+            tile.last_frame = self.frame
+            self.tiles[key] = tile
+            self.cache_bytes += tile.size_bytes
+
+            # the simulation alone (turbo replay, split mode process) decodes tiles too, without rendering
+            self.evict()
+        else:
+            self.tiles.move_to_end(key)
+            tile.last_frame = self.frame
+
+        return tile
+
+    def evict(self):
+        # never evict a tile used in the current frame, even over budget
+        while self.cache_bytes > self.cache_budget and self.tiles:
+            key, tile = next(iter(self.tiles.items()))
+            if tile.last_frame >= self.frame:
+                break
+
+            del self.tiles[key]
+            self.cache_bytes -= tile.size_bytes
+            self.evicted += 1
+
+    def tiles_in_rect(self, rect):
+        rect = pygame.Rect(rect).clip(self.rect)
+        if not rect.width or not rect.height:
+            return
+
+        for row in range(rect.top // self.tile_size, (rect.bottom - 1) // self.tile_size + 1):
+            for col in range(rect.left // self.tile_size, (rect.right - 1) // self.tile_size + 1):
+                yield self.get_tile(col, row)
+
+    def blit(self, dest, dest_pos, area):
+        """ Blit the map area on dest at dest_pos, like dest.blit(map, dest_pos, area) """
+
+        area = pygame.Rect(area)
+        dx = dest_pos[0] - area.x
+        dy = dest_pos[1] - area.y
+
+        for tile in self.tiles_in_rect(area):
+            tile_area = area.clip(tile.surface.get_rect(topleft=(tile.x, tile.y)))
+            dest.blit(tile.surface, (tile_area.x + dx, tile_area.y + dy), tile_area.move(-tile.x, -tile.y))
+
+    def is_solid(self, x, y):
+        """ True if there is terrain at (x, y), raises IndexError when out of the map """
+
+        if x < 0 or y < 0 or x >= self.width or y >= self.height:
+            raise IndexError("pixel (%s, %s) out of the map" % (x, y))
+
+        tile = self.get_tile(x // self.tile_size, y // self.tile_size)
+        return tile.mask.get_at((x - tile.x, y - tile.y))
+
+    def overlap(self, mask, pos):
+        """ True if mask, at pos in the map, overlaps the terrain (only the tiles under the mask are tested) """
+
+        x, y = pos
+        w, h = mask.get_size()
+
+        for tile in self.tiles_in_rect((x, y, w, h)):
+            if tile.mask.overlap(mask, (x - tile.x, y - tile.y)):
+                return True
+
+        return False
+
+    def scan_tiles(self, source):
+        """ Stores the compressed tile sources, returns (1/2 map, solid distance cells [col, row]) from
+        the converted tiles, one at a time """
+        import numpy as np
+
+        half = pygame.Surface((max(1, self.width // 2), max(1, self.height // 2))).convert()
+        solid_cells = np.zeros((self.distance_cols, self.distance_rows), dtype=bool)
+
+        for row in range(self.rows):
+            for col in range(self.cols):
+                area = self.tile_area(col, row)
+                tile_source = source.subsurface(area)
+
+                data = pygame.image.tobytes(tile_source, self.source_format)
+                self.tile_sources[(col, row)] = zlib.compress(data, TILE_SOURCE_COMPRESSION)
+
+                surface = tile_source.convert()
+
+                # tiles at even positions: their halves tile the 1/2 map
+                if area.width >= 2 and area.height >= 2:
+                    half.blit(pygame.transform.smoothscale(surface, (area.width // 2, area.height // 2)), (area.x // 2, area.y // 2))
+
+                # terrain = everything but the black background (like the masks), a cell is solid if any of its pixels is
+                solid = pygame.surfarray.array2d(surface) != surface.map_rgb( (0, 0, 0) ) # [x, y]
+
+                cols = (area.width + DISTANCE_CELL - 1) // DISTANCE_CELL
+                rows = (area.height + DISTANCE_CELL - 1) // DISTANCE_CELL
+                padded = np.zeros((cols * DISTANCE_CELL, rows * DISTANCE_CELL), dtype=bool)
+                padded[:area.width, :area.height] = solid
+
+                x, y = area.x // DISTANCE_CELL, area.y // DISTANCE_CELL
+                solid_cells[x:x + cols, y:y + rows] = padded.reshape(cols, DISTANCE_CELL, rows, DISTANCE_CELL).any(axis=(1, 3))
+
+        return half, solid_cells
+
+    def build_pyramid(self, half):
+        pyramid = []
+
+        surface = half
+        while surface.get_width() >= PYRAMID_MIN_SIZE and surface.get_height() >= PYRAMID_MIN_SIZE:
+            pyramid.append(surface)
+
+            surface = pygame.transform.smoothscale(surface, (surface.get_width() // 2, surface.get_height() // 2))
+
+        return pyramid
+
+    def build_distance_field(self, reached):
+        import numpy as np
+
+        # chessboard distance in cells: grow the solid cells by one cell (3x3) per step
+        steps = DISTANCE_MAX // DISTANCE_CELL
+        cells = np.full(reached.shape, steps, dtype=np.uint8)
+        cells[reached] = 0
+
+        for d in range(1, steps):
+            grown = reached.copy()
+            grown[1:, :] |= reached[:-1, :]
+            grown[:-1, :] |= reached[1:, :]
+            reached = grown.copy()
+            reached[:, 1:] |= grown[:, :-1]
+            reached[:, :-1] |= grown[:, 1:]
+
+            cells[reached & (cells == steps)] = d
+
+        # d cells away => at least (d - 1) * DISTANCE_CELL pixels away
+        distance = (cells.astype(np.int32) - 1).clip(0) * DISTANCE_CELL
+
+        # row major bytes: fast lookups without numpy
+        return distance.astype(np.uint8).T.tobytes()
+
+    def distance_at(self, x, y):
+        """ Lower bound of the distance (px) from (x, y) to the nearest terrain pixel, 0 when out of the map """
+
+        if x < 0 or y < 0 or x >= self.width or y >= self.height:
+            return 0
+
+        return self.distance[(y // DISTANCE_CELL) * self.distance_cols + x // DISTANCE_CELL]
+
+    def get_overview(self, max_width, max_height):
+        """ Returns (surface, scale): the biggest downsampled map fitting in max_width x max_height """
+
+        overview = self.pyramid[-1]
+        for surface in self.pyramid:
+            if surface.get_width() <= max_width and surface.get_height() <= max_height:
+                overview = surface
+                break
+
+        return overview, overview.get_width() / self.width
+
+    def get_mask(self):
+        """ Full map terrain mask, built from the tile masks (not cached as tiles) """
+
+        if self.mask is None:
+            self.mask = pygame.mask.Mask((self.width, self.height))
+
+            for row in range(self.rows):
+                for col in range(self.cols):
+                    tile = self.decode_tile(col, row)
+                    self.mask.draw(tile.mask, (tile.x, tile.y))
+
+        return self.mask
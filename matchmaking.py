@@ -0,0 +1,116 @@
+"""
+Matchmaking index (server.py): the rooms with a free ship and the released room ids, so that a join
+or a leave costs O(log rooms) instead of a scan of all the rooms.
+
+    index.add_room(room_id)              # room created
+    index.set_free(room_id, has_free)    # after a ship was taken / given back
+    index.first_free_room()              # room to join, None if all full
+    index.new_room_id(rooms)             # smallest unused room id (1, 2, ... or first_id, first_id + id_step, ...)
+    index.remove_room(room_id)           # room deleted, its id can be reused
+
+Rooms are joined in creation order, as the scan of the rooms dict did. The free rooms heap is ordered
+by creation number; the entries of rooms which got full or were removed are dropped lazily, and the
+heap is rebuilt when they outnumber the live ones (FREE_ROOMS_COMPACT).
+
+Sharded server (server.py --workers N): shard_of(room_id, N) is the worker hosting a room.
+"""
+
+import heapq, zlib, itertools
+
+FREE_ROOMS_COMPACT = 64 # rebuild the heap past this many entries if more than half are stale
+
+# -------------------------------------------------------------------------------------------------
+
+class RoomIndex():
+
+    def __init__(self, first_id=1, id_step=1):
+
+        self.creation = itertools.count()
+        self.room_order = {} # room_id => creation number
+
+        # rooms with a free ship: heap of (creation number, room_id), + stale entries
+        self.free_rooms = []
+        self.has_free = set()
+
+        # room ids < next_id not used by a room, ids are first_id + k * id_step (a shard's ids, see shard_of())
+        self.first_id = first_id
+        self.id_step = id_step
+        self.released_ids = []
+        self.next_id = first_id
+
+    def __len__(self):
+        return len(self.room_order)
+
+    def add_room(self, room_id, has_free=True):
+        self.room_order[room_id] = next(self.creation)
+        self.set_free(room_id, has_free)
+
+    def remove_room(self, room_id):
+        self.room_order.pop(room_id, None)
+        self.has_free.discard(room_id)
+
+        # named rooms ("tony") or ids not given by new_room_id() yet: nothing to reuse
+        if self.is_own_id(room_id) and room_id < self.next_id:
+            heapq.heappush(self.released_ids, room_id)
+
+    def is_own_id(self, room_id):
+        return isinstance(room_id, int) and room_id >= self.first_id and (room_id - self.first_id) % self.id_step == 0
+
+    def free_room_count(self):
+        return len(self.has_free)
+
+    def set_free(self, room_id, has_free):
+
+        if not has_free:
+            # its heap entry is now stale
+            self.has_free.discard(room_id)
+
+        elif room_id not in self.has_free:
+            self.has_free.add(room_id)
+            heapq.heappush(self.free_rooms, (self.room_order[room_id], room_id))
+
+        if len(self.free_rooms) > max(FREE_ROOMS_COMPACT, 2 * len(self.has_free)):
+            self.free_rooms = [(self.room_order[room_id], room_id) for room_id in self.has_free]
+            heapq.heapify(self.free_rooms)
+
+    def first_free_room(self):
+        """ Oldest room with a free ship, None if all full """
+
+        while self.free_rooms:
+            order, room_id = self.free_rooms[0]
+
+            if room_id in self.has_free and self.room_order.get(room_id) == order:
+                return room_id
+
+            # full or removed (or removed then created again: newer entry)
+            heapq.heappop(self.free_rooms)
+
+        return None
+
+    def new_room_id(self, rooms):
+        """ Smallest of our ids not used as a room id """
+
+        while True:
+            if self.released_ids:
+                room_id = heapq.heappop(self.released_ids)
+            else:
+                room_id = self.next_id
+                self.next_id += self.id_step
+
+            # created by name (LOGIN with this room_id) in the meantime
+            if room_id not in rooms:
+                return room_id
+
+# -------------------------------------------------------------------------------------------------
+
+def shard_of(room_id, shard_count):
+    """ Shard (worker process) hosting room_id: the rooms are not moved, so a fixed mapping is enough
+
+    Numbered rooms: shard k creates the ids k + 1, k + 1 + shard_count... (RoomIndex(k + 1, shard_count))
+    Named rooms: crc32 of the name (stable across processes, unlike hash())
+    """
+
+    if isinstance(room_id, int) and room_id > 0:
+        return (room_id - 1) % shard_count
+
+    return zlib.crc32(str(room_id).encode("utf8")) % shard_count
@@ -20,31 +20,56 @@ python3 mayhem.py --server=ws://127.0.0.1:9000 --player_name=tony --ship_control
 python3 mayhem.py --server=ws://127.0.0.1:9000 --player_name=tony --ship_control=k1 -zoom
 python3 mayhem.py --server=ws://192.168.1.75:9000 --player_name=alex --ship_control=j1 -sap
 
+python3 mayhem.py --no_menu --width=1200 --height=800 --fps=60
+
 """
 
-import os, sys, argparse, random, math, time, pickle, json, enum
+import os, sys, argparse, random, math, time, pickle, json
 from random import randint
 import collections
 
-from twisted.internet import reactor
-from twisted.internet import task
-from twisted.internet.protocol import ReconnectingClientFactory
-from autobahn.twisted.websocket import WebSocketClientFactory, WebSocketClientProtocol, connectWS
-
 import pygame
 from pygame import gfxdraw
 from pygame.locals import *
 
-import pygame_menu
-
-import numpy as np
-import moderngl as mgl
-from shader_program import ShaderProgram
-
-import imgui
-import my_imgui.pygame_imgui as pygame_imgui
+from game_protocol import Action, PLAYER_UPDATE_RATE
+from level_map import TiledMap
+from stage_timers import StageTimers
+from sampling_profiler import SamplingProfiler, PROFILE_SWITCH_INTERVAL
+from replay import ReplayWriter, ReplayReader, set_ship_inputs, turbo_replay, print_summary, REPLAY_KEYFRAME_FRAMES
 
-import msgpack
+# -------------------------------------------------------------------------------------------------
+# Optional subsystems: imported only when their mode is selected, so that a local, non OpenGL
+# session does not pay for moderngl / imgui / pygame_menu / Twisted / Autobahn at startup
+
+np = None
+mgl = None
+ShaderProgram = None
+imgui = None
+pygame_imgui = None
+pygame_menu = None
+reactor = None
+task = None
+
+def load_opengl():
+    global np, mgl, ShaderProgram
+    import numpy as np
+    import moderngl as mgl
+    from shader_program import ShaderProgram
+
+def load_imgui():
+    global imgui, pygame_imgui
+    import imgui
+    import my_imgui.pygame_imgui as pygame_imgui
+
+def load_menu():
+    global pygame_menu
+    import pygame_menu
+
+def load_network():
+    global reactor, task
+    from twisted.internet import reactor
+    from twisted.internet import task
 
 # -------------------------------------------------------------------------------------------------
 # General
@@ -55,6 +80,10 @@ WHITE    = (255, 255, 255)
 RED      = (255, 0, 0)
 LVIOLET  = (128, 0, 128)
 
+# minimap / overview markers
+SHIP_COLORS = {"1":(255, 255, 0), "2":(0, 255, 255), "3":(255, 0, 255), "4":(0, 255, 0)}
+MINIMAP_SIZE = 200
+
 USE_MINI_MASK = True # mask the size of the ship (instead of the player view size)
 
 # -------------------------------------------------------------------------------------------------
@@ -63,6 +92,7 @@ USE_MINI_MASK = True # mask the size of the ship (instead of the player view siz
 SHIP_ANGLE_LAND = 30
 SHIP_MAX_LIVES = 20
 SHIP_SPRITE_SIZE = 32
+SHIP_RADIUS = 24 # ship pixels are at most 16*sqrt(2) px from its center, whatever the angle
 
 iXfrott  = 0.984
 iYfrott  = 0.99
@@ -103,6 +133,8 @@ MAP_5 = os.path.join("assets", "level5", "Mayhem_Level5_Map_256c.bmp")
 MAP_6 = os.path.join("assets", "level6", "mayhem_big_holes.bmp")
 MAP_7 = os.path.join("assets", "level7", "mayhem_big2_holes1.bmp")
 
+LEVEL_MAPS = {1:MAP_1, 2:MAP_2, 3:MAP_3, 4:MAP_4, 5:MAP_5, 6:MAP_6, 7:MAP_7}
+
 SOUND_THURST  = os.path.join("assets", "default", "sfx_loop_thrust.wav")
 SOUND_EXPLOD  = os.path.join("assets", "default", "sfx_boom.wav")
 SOUND_BOUNCE  = os.path.join("assets", "default", "sfx_rebound.wav")
@@ -129,6 +161,29 @@ MARGIN_SIZE = 0
 W_PERCENT   = 1.0
 H_PERCENT   = 1.0
 
+# -------------------------------------------------------------------------------------------------
+# Menu
+
+MENU_FPS = 60
+MENU_IDLE_TIMEOUT = 500 # ms, the menu wakes up at least this often (text input cursor blink)
+
+# -------------------------------------------------------------------------------------------------
+# Simulation
+
+SIM_FPS = 60 # physics steps per second, whatever the render rate (-fps)
+MAX_CATCHUP_STEPS = 8 # per rendered frame, beyond that the game slows down instead of freezing the display
+
+# load governor: frame work time / frame budget, averaged over the last frames
+GOVERNOR_RAISE = 0.9 # degrade one more level above this load
+GOVERNOR_LOWER = 0.4 # back to the previous level below this load
+GOVERNOR_MAX_LEVEL = 2 # 1: render every other frame, 2: + no explosion particles, name labels, debug text
+
+# t: per stage frame times overlay, refreshed every STAGE_OVERLAY_REFRESH frames
+STAGE_OVERLAY_REFRESH = 30
+
+# game loop stages, in order (--stage_timers CSV columns)
+STAGES = ("input", "network", "update", "collision", "shots", "explod", "draw", "map_blit", "hud", "upload", "gl_render", "flip")
+
 # -------------------------------------------------------------------------------------------------
 
 class FPSCounter:
@@ -148,7 +203,83 @@ class FPSCounter:
             return 0
         else:
             return len(self.frame_times) / sum(self.frame_times)
-        
+
+class LoadGovernor(FPSCounter):
+    """ Watches the work time of the last frames (not the time spent waiting) and degrades the rendering
+        when over budget: the simulation always runs at SIM_FPS """
+
+    def __init__(self, max_fps):
+        super().__init__()
+        self.budget = 1. / (max_fps or SIM_FPS)
+        self.level = 0
+        self.frame_count = 0
+
+    def start_frame(self):
+        self.time = time.perf_counter()
+
+    def end_frame(self):
+        self.tick()
+
+        # wait for a full window of frames at the current level
+        if len(self.frame_times) < self.frame_times.maxlen:
+            return
+
+        load = self.get_load()
+
+        if load > GOVERNOR_RAISE and self.level < GOVERNOR_MAX_LEVEL:
+            self.set_level(self.level + 1)
+        elif load < GOVERNOR_LOWER and self.level > 0:
+            self.set_level(self.level - 1)
+
+    def set_level(self, level):
+        print("Load governor: level %s -> %s (load=%.2f)" % (self.level, level, self.get_load()))
+        self.level = level
+        self.frame_times.clear()
+
+    def get_load(self):
+        if not self.frame_times:
+            return 0
+        return sum(self.frame_times) / len(self.frame_times) / self.budget
+
+    def should_render(self):
+        self.frame_count += 1
+        return self.level == 0 or self.frame_count % 2 == 0
+
+    def cosmetics(self):
+        # explosion particles, name labels, debug text
+        return self.level < 2
+
+class FixedTimestep:
+    """ Accumulates the real elapsed time and tells how many fixed simulation steps to run """
+
+    def __init__(self, rate=SIM_FPS, max_steps=MAX_CATCHUP_STEPS):
+        self.step = 1. / rate
+        self.max_steps = max_steps
+        self.reset()
+
+    def reset(self):
+        self.time = time.perf_counter()
+        self.accumulator = 0.
+
+    def advance(self):
+        t1 = time.perf_counter()
+        self.accumulator += t1 - self.time
+        self.time = t1
+
+        steps = int(self.accumulator / self.step)
+        self.accumulator -= steps * self.step
+
+        # too late (slow machine, window dragged...): drop the backlog
+        if steps > self.max_steps:
+            steps = self.max_steps
+            self.accumulator = 0.
+
+        return steps
+
+    def alpha(self):
+        # how far we are between the last simulated step and the next one, for rendering
+        return min(1., self.accumulator / self.step)
+
 # -------------------------------------------------------------------------------------------------
 
 class Debris():
@@ -174,6 +305,7 @@ class Shot():
         self.yposprecise = 0
         self.dx = 0
         self.dy = 0
+        self.free_steps = 0 # moves left before the shot can reach the terrain (see TiledMap.distance_at())
 
 # -------------------------------------------------------------------------------------------------
 
@@ -218,6 +350,8 @@ class Ship():
         self.ypos = ypos
         self.xposprecise = xpos
         self.yposprecise = ypos
+        self.prev_xpos = xpos # see save_position()
+        self.prev_ypos = ypos
 
         self.vx = 0.0
         self.vy = 0.0
@@ -268,6 +402,11 @@ class Ship():
         self.image = self.ship_pic
         self.mask = pygame.mask.from_surface(self.image)
 
+        # drawable before the first update() (the first rendered frame may come before the first simulation step)
+        self.image_rotated = self.image
+        self.rot_xoffset = 0
+        self.rot_yoffset = 0
+
         self.joystick_number = joystick_number
 
     def reset(self):
@@ -304,6 +443,59 @@ class Ship():
         if self.lives == 0:
             self.game_over = True
 
+    def get_state(self):
+        """ Simulation state, JSON compatible (replay keyframes) """
+
+        images = (self.ship_pic, self.ship_pic_thrust, self.ship_pic_shield)
+
+        return {
+            "pos": [self.xpos, self.ypos, self.xposprecise, self.yposprecise, self.prev_xpos, self.prev_ypos],
+            "motion": [self.vx, self.vy, self.ax, self.ay, self.impactx, self.impacty, self.angle, self.thrust],
+            "flags": [self.shield, self.shoot, self.shoot_delay, self.landed, self.bounce, self.explod, self.game_over],
+            "inputs": [self.left_pressed, self.right_pressed, self.thrust_pressed, self.shoot_pressed, self.shield_pressed],
+            "image": images.index(self.image),
+            "lives": self.lives,
+            "explod_tick": self.explod_tick,
+            "last_landed_pos": list(self.last_landed_pos),
+            "shots": [[shot.x, shot.y, shot.xposprecise, shot.yposprecise, shot.dx, shot.dy, shot.free_steps] for shot in self.shots],
+            "debris": [[deb.x, deb.y, deb.xposprecise, deb.yposprecise, deb.ax, deb.ay, deb.vx, deb.vy, deb.impultion, deb.angle] for deb in self.debris],
+        }
+
+    def set_state(self, state):
+
+        self.xpos, self.ypos, self.xposprecise, self.yposprecise, self.prev_xpos, self.prev_ypos = state["pos"]
+        self.vx, self.vy, self.ax, self.ay, self.impactx, self.impacty, self.angle, self.thrust = state["motion"]
+        self.shield, self.shoot, self.shoot_delay, self.landed, self.bounce, self.explod, self.game_over = state["flags"]
+        self.left_pressed, self.right_pressed, self.thrust_pressed, self.shoot_pressed, self.shield_pressed = state["inputs"]
+
+        self.image = (self.ship_pic, self.ship_pic_thrust, self.ship_pic_shield)[state["image"]]
+        self.lives = state["lives"]
+        self.explod_tick = state["explod_tick"]
+        self.last_landed_pos = tuple(state["last_landed_pos"])
+
+        self.shots = []
+        for values in state["shots"]:
+            shot = Shot()
+            shot.x, shot.y, shot.xposprecise, shot.yposprecise, shot.dx, shot.dy, shot.free_steps = values
+            self.shots.append(shot)
+
+        self.debris = []
+        for values in state["debris"]:
+            deb = Debris()
+            deb.x, deb.y, deb.xposprecise, deb.yposprecise, deb.ax, deb.ay, deb.vx, deb.vy, deb.impultion, deb.angle = values
+            self.debris.append(deb)
+
+        # as at the end of do_move()
+        self.image_rotated = pygame.transform.rotate(self.image, self.angle)
+        self.mask = pygame.mask.from_surface(self.image_rotated)
+
+        rect = self.image_rotated.get_rect()
+        self.rot_xoffset = int( ((SHIP_SPRITE_SIZE - rect.width)/2) )
+        self.rot_yoffset = int( ((SHIP_SPRITE_SIZE - rect.height)/2) )
+
+        self.sound_thrust.stop()
+        self.sound_shield.stop()
+
     def init_debris(self):
 
         for i in range(8):
@@ -337,22 +529,8 @@ class Ship():
                 self.sound_explod.play()
                 self.init_debris()
             else:
-                # draw explosion
-                ship_cx = self.xpos + SHIP_SPRITE_SIZE/2;
-                ship_cy = self.ypos + SHIP_SPRITE_SIZE/2;
-
-                c = max(0, 200 - self.explod_tick)
-
-                for p in range(0, int((240 - self.explod_tick)/4)):           
-                    r = (32-(self.explod_tick*2)) * math.sqrt(random.uniform(0, 1))
-                    theta = random.uniform(0, 1) * 2 * math.pi;
-                    x = r * math.cos(theta);
-                    y = r * math.sin(theta);
-
-                    gfxdraw.pixel(env.map_buffer, int(ship_cx + x) , int(ship_cy + y), (c, c, c))
-
                 # debris
-                for deb in self.debris:
+                for deb in list(self.debris): # copy of self.debris
 
                     # move debris
                     deb.ax = deb.impultion * -math.cos(math.radians(90 - deb.angle))
@@ -372,18 +550,13 @@ class Ship():
 
                     deb.impultion = 0
 
-                    # plot debris
                     deb.x = int(deb.xposprecise)
                     deb.y = int(deb.yposprecise)             
                     
                     try:
-                        c = env.map_buffer.get_at((int(deb.x), int(deb.y)))
-                        if (c.r != 0) or (c.g != 0) or (c.b != 0):
+                        if env.level_map.is_solid(deb.x, deb.y):
                             self.debris.remove(deb)
 
-                        gfxdraw.pixel(env.map_buffer, int(deb.x) , int(deb.y), WHITE)
-                        #pygame.draw.circle(env.map_buffer, WHITE, (int(deb.x) , int(deb.y)), 1)
-
                     # out of surface
                     except IndexError:
                         self.debris.remove(deb)
@@ -391,7 +564,7 @@ class Ship():
             # explosion time
             self.explod_tick +=1
 
-            if self.explod_tick > env.max_fps * 2:
+            if self.explod_tick > SIM_FPS * 2:
                 self.reset()
 
                 # remove other_player_x from the game_factory if needed
@@ -402,31 +575,7 @@ class Ship():
         if self.explod or self.game_over:
             return
         
-        # normal play
-        if not env.play_recorded:
-
-            # record play ?
-            if env.record_play:
-                env.played_data.append((left_pressed, right_pressed, thrust_pressed, shield_pressed, shoot_pressed))
-
-        # play recorded
-        else:
-            try:
-                data_i = env.played_data[env.frames]
-
-                left_pressed   = True if data_i[0] else False
-                right_pressed  = True if data_i[1] else False
-                thrust_pressed = True if data_i[2] else False
-                shield_pressed = True if data_i[3] else False
-                shoot_pressed  = True if data_i[4] else False
-
-            except:
-                print("End of playback")
-                print("Frames=", env.frames)
-                print("%s seconds" % int(env.frames/env.max_fps))
-                sys.exit(0)
-
-
+        # recorded / played inputs: see MayhemEnv.replay_frame()
         self.do_move(env, left_pressed, right_pressed, thrust_pressed, shoot_pressed, shield_pressed)
 
     def do_move(self, env, left_pressed, right_pressed, thrust_pressed, shoot_pressed, shield_pressed):
@@ -595,22 +744,31 @@ class Ship():
         self.rot_xoffset = int( ((SHIP_SPRITE_SIZE - rect.width)/2) )  # used in draw() and collide_map()
         self.rot_yoffset = int( ((SHIP_SPRITE_SIZE - rect.height)/2) ) # used in draw() and collide_map()
 
-    def plot_shots(self, map_buffer, shots):
+    def move_shots(self, level_map, shots):
         for shot in list(shots): # copy of self.shots
             shot.xposprecise += shot.dx
             shot.yposprecise += shot.dy
             shot.x = int(shot.xposprecise)
             shot.y = int(shot.yposprecise)
 
+            # step ahead: far from the terrain, no need to test the next moves
+            if shot.free_steps > 0:
+                shot.free_steps -= 1
+
+                if level_map.rect.collidepoint(shot.x, shot.y):
+                    continue
+
+            distance = level_map.distance_at(shot.x, shot.y)
+            if distance:
+                speed = math.hypot(shot.dx, shot.dy)
+                if speed:
+                    shot.free_steps = int(max(0, distance - 2) / speed) # - 2: pixel truncation
+                continue
+
             try:
-                c = map_buffer.get_at((int(shot.x), int(shot.y)))
-                if (c.r != 0) or (c.g != 0) or (c.b != 0):
+                if level_map.is_solid(shot.x, shot.y):
                     shots.remove(shot)
 
-                gfxdraw.pixel(map_buffer, int(shot.x) , int(shot.y), WHITE)
-                #pygame.draw.circle(map_buffer, WHITE, (int(shot.x) , int(shot.y)), 1)
-                #pygame.draw.line(map_buffer, WHITE, (int(self.xpos + SHIP_SPRITE_SIZE/2), int(self.ypos + SHIP_SPRITE_SIZE/2)), (int(shot.x), int(shot.y)))
-
             # out of surface
             except IndexError:
                 shots.remove(shot)
@@ -681,46 +839,103 @@ class Ship():
 
         return test_it
 
-    def draw(self, map_buffer, render_name=False):
+    def save_position(self):
+        # position before the simulation step, to interpolate when rendering between 2 steps
+        self.prev_xpos = self.xpos
+        self.prev_ypos = self.ypos
+
+    def render_pos(self, alpha=1.):
+        dx = self.xpos - self.prev_xpos
+        dy = self.ypos - self.prev_ypos
+
+        # teleported (respawn, level change, network update): no interpolation
+        if abs(dx) > SHIP_SPRITE_SIZE or abs(dy) > SHIP_SPRITE_SIZE:
+            return self.xpos, self.ypos
+
+        return self.prev_xpos + dx * alpha, self.prev_ypos + dy * alpha
+
+    # draw*(): offset = screen position of the map (0, 0) in the view being rendered
+
+    def draw(self, surface, offset, render_name=False, alpha=1.):
 
         if self.explod or self.game_over:
             return
         
-        map_buffer.blit(self.image_rotated, (self.xpos + self.rot_xoffset, self.ypos + self.rot_yoffset))
+        ox, oy = offset
+        xpos, ypos = self.render_pos(alpha)
+        surface.blit(self.image_rotated, (int(xpos) + self.rot_xoffset + ox, int(ypos) + self.rot_yoffset + oy))
         
         if render_name:
             pn = self.ship_font.render('%s' % (self.player_name, ), False, (128, 128, 128, 128))
-            map_buffer.blit(pn, (self.xpos + SHIP_SPRITE_SIZE - 8, self.ypos - SHIP_SPRITE_SIZE + 8))
+            surface.blit(pn, (int(xpos) + SHIP_SPRITE_SIZE - 8 + ox, int(ypos) - SHIP_SPRITE_SIZE + 8 + oy))
+
+    def draw_shots(self, surface, offset):
+        ox, oy = offset
+
+        for shot in self.shots:
+            gfxdraw.pixel(surface, int(shot.x + ox), int(shot.y + oy), WHITE)
+            #pygame.draw.circle(surface, WHITE, (int(shot.x + ox), int(shot.y + oy)), 1)
+
+    def draw_explosion(self, surface, offset, particles=True):
+
+        # explod_sequence() already moved to the next tick
+        explod_tick = self.explod_tick - 1
+
+        if not self.explod or explod_tick <= 0:
+            return
+
+        ox, oy = offset
+
+        # explosion particles: cosmetic only, seeded by the tick so that every view renders the same ones
+        rnd = random.Random(explod_tick)
+
+        ship_cx = self.xpos + SHIP_SPRITE_SIZE/2 + ox
+        ship_cy = self.ypos + SHIP_SPRITE_SIZE/2 + oy
+
+        c = max(0, 200 - explod_tick)
+
+        # particles are skipped by the load governor
+        if particles:
+            for p in range(0, int((240 - explod_tick)/4)):           
+                r = (32-(explod_tick*2)) * math.sqrt(rnd.uniform(0, 1))
+                theta = rnd.uniform(0, 1) * 2 * math.pi;
+                x = r * math.cos(theta);
+                y = r * math.sin(theta);
+
+                gfxdraw.pixel(surface, int(ship_cx + x) , int(ship_cy + y), (c, c, c))
+
+        # debris
+        for deb in self.debris:
+            gfxdraw.pixel(surface, int(deb.x + ox) , int(deb.y + oy), WHITE)
         
-    def collide_map(self, map_buffer, map_buffer_mask, platforms):
+    def collide_map(self, level_map, platforms):
 
         if self.explod or self.game_over:
             return
         
-        # ship size mask
+        # nearest wall farther than the ship radius: no mask test needed
+        if level_map.distance_at(self.xpos + SHIP_SPRITE_SIZE//2, self.ypos + SHIP_SPRITE_SIZE//2) > SHIP_RADIUS:
+            return
+
+        # ship size mask: only the map tiles under the ship are tested
         if USE_MINI_MASK:
             mini_area = Rect(self.xpos, self.ypos, SHIP_SPRITE_SIZE, SHIP_SPRITE_SIZE)
-            try:
-                mini_subsurface = map_buffer.subsurface(mini_area)
-            except ValueError:
+            if not level_map.rect.contains(mini_area):
                 # wrap W or H
                 return
             
-            mini_subsurface.set_colorkey( (0, 0, 0) ) # used for the mask, black = background
-            mini_mask = pygame.mask.from_surface(mini_subsurface)
-
             if self.do_test_collision(platforms):
-                offset = (self.rot_xoffset, self.rot_yoffset) # pos of the ship
+                offset = (self.xpos + self.rot_xoffset, self.ypos + self.rot_yoffset) # pos of the ship
 
-                if mini_mask.overlap(self.mask, offset): # https://stackoverflow.com/questions/55817422/collision-between-masks-in-pygame/55818093#55818093
+                if level_map.overlap(self.mask, offset):
                     self.explod = True
 
-        # player view size mask
+        # whole map mask
         else:
             if self.do_test_collision(platforms):
                 offset = (self.xpos + self.rot_xoffset, self.ypos + self.rot_yoffset) # pos of the ship
 
-                if map_buffer_mask.overlap(self.mask, offset): # https://stackoverflow.com/questions/55817422/collision-between-masks-in-pygame/55818093#55818093
+                if level_map.get_mask().overlap(self.mask, offset): # https://stackoverflow.com/questions/55817422/collision-between-masks-in-pygame/55818093#55818093
                     self.explod = True
 
     def collide_ship(self, ships):
@@ -779,7 +994,9 @@ class MayhemEnv():
 
         self.player_name = player_name
         self.ship_control = ship_control
-        self.show_all_players = show_all_players
+
+        # local: the screen is always split between the 4 ships
+        self.show_all_players = show_all_players or not game_client_factory
 
         # Websoket game client
         self.game_client_factory = game_client_factory
@@ -795,29 +1012,43 @@ class MayhemEnv():
         self.debug_print = debug_print
         self.max_fps = max_fps
 
-        # record / play recorded
+        # record / play recorded (replay.py), opened once the level is set
         self.record_play = record_play
-        self.played_data = [] # [(0,0,0), (0,0,1), ...] (left, right, thrust)
-
         self.play_recorded = play_recorded
 
-        if self.play_recorded:
-            with open(self.play_recorded, "rb") as f:
-                self.played_data = pickle.load(f)
+        self.recorder = None
+        self.replay = None
+        self.replay_frames = None
 
         # FPS
         self.clock = pygame.time.Clock()
         self.paused = False
+        self.running = True
+
+        # m: minimap, o: whole level overview (spectator)
+        self.show_minimap = False
+        self.show_overview = False
         self.frames = 0
 
         self.lastTime = time.time()
         self.currentTime = time.time()
         self.fps = FPSCounter()
 
+        # simulation at SIM_FPS, rendering at max_fps (0: as fast as possible)
+        self.timestep = FixedTimestep()
+        self.governor = LoadGovernor(max_fps)
+
+        # per stage frame times (t: overlay, --stage_timers: file)
+        self.timers = StageTimers()
+        self.show_timers = False
+        self.timers_summary = {}
+        self.active_ships = []
+
+        # f / --profile: samples tagged with the current stage
+        self.profiler = SamplingProfiler(lambda: self.timers.stage)
+
         # per level data
-        self.map = self.game.getv("map", current_level=self.level)
-        self.map_buffer = self.game.getv("map_buffer", current_level=self.level)
-        self.map_buffer_mask = self.game.getv("map_buffer_mask", current_level=self.level)
+        self.level_map = self.game.get_level_map(self.level)
         self.platforms = self.game.getv("platforms", current_level=self.level)
 
         # game physics
@@ -853,6 +1084,8 @@ class MayhemEnv():
 
         self.set_level_and_ships(self.level)
 
+        self.init_replay()
+
     def get_fps(self):
         self.currentTime = time.time()
         delta = self.currentTime - self.lastTime
@@ -875,16 +1108,151 @@ class MayhemEnv():
 
         self.fps.tick()
 
+    def get_physics(self):
+        return {"SHIP_THRUST_MAX":self.SHIP_THRUST_MAX, "iG":self.iG, "SHIP_ANGLESTEP":self.SHIP_ANGLESTEP}
+
+    def set_physics(self, physics):
+        self.SHIP_THRUST_MAX = physics["SHIP_THRUST_MAX"]
+        self.iG = physics["iG"]
+        self.SHIP_ANGLESTEP = physics["SHIP_ANGLESTEP"]
+
+    def get_state(self):
+        """ Simulation state (replay keyframes), JSON compatible """
+        return {"frame":self.frames, "level":self.level, "physics":self.get_physics(), "ships":[ship.get_state() for ship in self.ships]}
+
+    def set_state(self, state):
+
+        if state["level"] != self.level:
+            self.set_level_and_ships(state["level"], force=True)
+
+        self.set_physics(state["physics"])
+        self.frames = state["frame"]
+
+        for ship, ship_state in zip(self.ships, state["ships"]):
+            ship.set_state(ship_state)
+
+    def init_replay(self):
+
+        if self.play_recorded:
+            self.replay = ReplayReader(self.play_recorded)
+            header = self.replay.header
+
+            self.motion = header["motion"]
+            self.set_physics(header["physics"])
+            random.seed(header["seed"])
+
+            if header["level"] != self.level:
+                self.set_level_and_ships(header["level"], force=True)
+
+            self.replay_frames = self.replay.frames()
+
+        elif self.record_play:
+            seed = randint(0, 2**31)
+            random.seed(seed)
+
+            # local: the 4 ships, online: ours
+            header = {"level":self.level, "motion":self.motion, "physics":self.get_physics(), "seed":seed,
+                      "ships":1 if self.game_client_factory else 4, "sim_fps":SIM_FPS, "created":time.time()}
+            self.recorder = ReplayWriter(self.record_play, header)
+
+            self.recorded_level = self.level
+            self.recorded_physics = self.get_physics()
+
+            self.record_keyframe()
+
+    def replay_frame(self):
+        """ Before a simulation step: records the ships inputs, or sets them from the replay.
+            Returns False at the end of the replay (no more step to simulate) """
+
+        if self.replay_frames:
+            try:
+                frame, events, masks = next(self.replay_frames)
+            except StopIteration:
+                self.replay_frames = None
+
+                print("End of playback")
+                print("Frames=", self.frames)
+                print("%s seconds" % int(self.frames/SIM_FPS))
+                self.stop_loop()
+                return False
+
+            for event in events:
+                if "level" in event:
+                    self.set_level_and_ships(event["level"], force=True)
+                if "physics" in event:
+                    self.set_physics(event["physics"])
+
+            ships = [self.ship_x] if self.game_client_factory else self.ships
+            for ship, mask in zip(ships, masks):
+                set_ship_inputs(ship, mask)
+
+        elif self.recorder:
+            if self.level != self.recorded_level:
+                self.recorded_level = self.level
+                self.recorder.record_event(self.frames, {"level":self.level})
+
+            physics = self.get_physics()
+            if physics != self.recorded_physics:
+                self.recorded_physics = physics
+                self.recorder.record_event(self.frames, {"physics":physics})
+
+            ships = [self.ship_x] if self.game_client_factory else self.ships
+            self.recorder.record_frame(self.frames, ships)
+
+        return True
+
+    def record_keyframe(self):
+        """ After a step: the state before the events (level change...) of the next frame """
+
+        # local: the whole state can be restored (online: the other ships come from the network)
+        if self.recorder and not self.game_client_factory and self.frames % REPLAY_KEYFRAME_FRAMES == 0:
+            self.recorder.record_keyframe(self.frames, self.get_state())
+
+    def seek(self, frame):
+        """ Playback (local): jumps to frame, restores the keyframe before it then simulates the frames left """
+
+        if not self.replay or self.game_client_factory:
+            return
+
+        self.replay.index()
+        frame = max(0, min(frame, self.replay.last_frame))
+
+        keyframe = self.replay.keyframe(frame)
+        if keyframe is None:
+            print("No keyframe before frame %s" % frame)
+            return
+
+        keyframe_frame, state, offset = keyframe
+
+        self.set_state(state)
+        self.replay_frames = self.replay.frames(offset)
+
+        for _ in range(frame - keyframe_frame):
+            self.step_local()
+
+        for ship in self.ships:
+            ship.save_position()
+
+        self.timestep.reset()
+
     def record_it(self):
 
-        if self.record_play:
-            with open(self.record_play, "wb") as f:
-                pickle.dump(self.played_data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        if self.recorder:
+            self.recorder.close()
+
+            print("Recorded %s" % self.record_play)
+            print("Frames=", self.recorder.frames)
+            print("%s seconds" % int(self.recorder.frames/SIM_FPS))
 
-            time.sleep(0.1)
-            print("Frames=", self.frames)
-            print("%s seconds" % int(self.frames/self.max_fps))
-            sys.exit(0)
+    def stop_loop(self):
+        if self.game.use_opengl:
+            self.game.frame_tex.release()
+
+        # online mode is driven by the twisted reactor, local mode by run_local_loop()
+        if self.game_client_factory:
+            reactor.stop()
+        else:
+            self.running = False
 
     def ship_key_down(self, key, ship, key_mapping):
 
@@ -948,6 +1316,7 @@ class MayhemEnv():
                 self.MAP_HEIGHT *= 3
 
             self.platforms = self.game.getv("platforms", current_level=self.level)
+            self.level_map = self.game.get_level_map(self.level)
 
             SHIP1_X = (self.platforms[0][0] + self.platforms[0][1])/2 - 16
             SHIP1_Y = self.platforms[0][2] -29
@@ -1025,67 +1394,18 @@ class MayhemEnv():
             for ship in self.ships:
                 ship.reset()
             play_now = False
-            if self.game.use_opengl:
-                self.game.frame_tex.release()
-            reactor.stop()
+            self.stop_loop()
         else:
             play_now = False
 
         # play loop
         if play_now:
 
-            # 1. -------
-            # Set our player status in self.game_client_factory: will be send each time we received a message action = Action.PLAYER_UPDATE_REQUEST
-
             # self.game_client_factory.ship_number is set by the server when we logged
             self.ship_x = getattr(self, "ship_%s" % str(self.game_client_factory.ship_number))
             self.ship_x.player_name = self.player_name
 
-            # player_name set in init()
-            # { "ship_number":"3", "player_name":"tony, "level":"6", "xpos":"412", "ypos":"517", "angle":"250", "tp":"True", "sp":"False", "shots":[(x,y), (x2, y2), ...] }
-            self.game_client_factory.level     = self.level # only ship_1 can set the level number
-            self.game_client_factory.xpos      = self.ship_x.xposprecise
-            self.game_client_factory.ypos      = self.ship_x.yposprecise
-            self.game_client_factory.angle     = self.ship_x.angle
-            self.game_client_factory.tp        = self.ship_x.thrust_pressed
-            self.game_client_factory.sp        = self.ship_x.shield_pressed
-            self.game_client_factory.landed    = self.ship_x.landed
-            self.game_client_factory.explod    = self.ship_x.explod
-            self.game_client_factory.game_over = self.ship_x.game_over
-            self.game_client_factory.lives     = self.ship_x.lives
-
-            particles = []
-            for s in self.ship_x.shots:
-                particles.append((s.x, s.y))
-            #for d in self.ship_x.debris:
-            #    particles.append((d.x, d.y))
-
-            self.game_client_factory.shots = particles
-
-            # 2. -------
-            # Get other players status if any
-
-            self.other_ships = []
-
-            others = ["1", "2", "3", "4"]
-            others.remove(self.game_client_factory.ship_number) # remove ourself from the list
-
-            for ship_number in others:
-                try:
-                    ship_update = getattr(self.game_client_factory, "other_player_%s" % str(ship_number))
-                except:
-                    ship_update = None
-
-                if ship_update:
-                    self.other_ships.append(ship_update)
-
-            #print("other_ships=", self.other_ships)
-
-            # 1. self.ship_x is the ship we play with, this will update its posx etc. and we change the states of self.game_client_factory based on that
-            #    then our player xpos etc. will be transmitted throught self.game_client_factory each time we receive a message Action.PLAYER_UPDATE_REQUEST
-            #
-            # 2. self.other_ships contains the other ships last updates we got from the server (message Action.OTHER_PLAYER_UPDATE)
-            #    then we need to render those ships and process collision etc accordingly
+            self.timers.start("input")
 
             ship_keys = SHIP_2_KEYS
             if self.ship_control == "k2":
@@ -1095,20 +1415,24 @@ class MayhemEnv():
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     self.record_it()
-                    if self.game.use_opengl:
-                        self.game.frame_tex.release()
-                    reactor.stop()
+                    self.stop_loop()
                     #sys.exit(0)
 
                 elif event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_ESCAPE:
                         self.record_it()
-                        if self.game.use_opengl:
-                            self.game.frame_tex.release()
-                        reactor.stop()
+                        self.stop_loop()
                         #sys.exit(0)
                     elif event.key == pygame.K_p:
                         self.paused = not self.paused
+                    elif event.key == pygame.K_m:
+                        self.show_minimap = not self.show_minimap
+                    elif event.key == pygame.K_o:
+                        self.show_overview = not self.show_overview
+                    elif event.key == pygame.K_t:
+                        self.toggle_timers()
+                    elif event.key == pygame.K_f:
+                        self.toggle_profiler()
 
                     elif event.key == pygame.K_1:
                         self.set_level_and_ships(1)
@@ -1166,184 +1490,211 @@ class MayhemEnv():
                 except:
                     pass
 
-            # per level data
-            self.map = self.game.getv("map", current_level=self.level)
-            self.map_buffer = self.game.getv("map_buffer", current_level=self.level)
-            self.map_buffer_mask = self.game.getv("map_buffer_mask", current_level=self.level)
-            self.platforms = self.game.getv("platforms", current_level=self.level)
+            self.governor.start_frame()
 
-            # clear screen
-            self.game.screen.fill((0,0,0))
+            # fixed rate simulation, whatever the rate this loop is called at
+            for _ in range(self.timestep.advance()):
+                self.step_online()
 
-            self.map_buffer.blit(self.map, (0, 0))
+            if self.governor.should_render():
+                self.render(self.active_ships, self.timestep.alpha())
 
-            # update ship pos
-            self.ship_x.update(self, self.ship_x.left_pressed, self.ship_x.right_pressed, self.ship_x.thrust_pressed, 
-                                     self.ship_x.shoot_pressed, self.ship_x.shield_pressed)
+            self.governor.end_frame()
+            self.timers.end_frame()
 
-            self.active_ships = []
-            self.active_ships.append(self.ship_x)
+    def step_online(self):
 
-            # { "ship_number":"3", "player_name":"tony, "level":"6", "xpos":"412", "ypos":"517", "angle":"250", "tp":"True", "sp":"False", "shots":[(x,y), (x2, y2), ...] }
-            for other_ship in self.other_ships:
-                o_ship = getattr(self, "ship_%s" % str(other_ship["ship_number"]))
-                
-                # only ship 1 can change the level, so for this case we are not ship 1
-                # but ship 1 changed the level, so we follow and change the level (possible only with force=1)
-                if (other_ship["ship_number"] == "1") and (other_ship["level"] != self.level):
-                    self.set_level_and_ships(other_ship["level"], force=True)
-                    self.ship_x.sound_thrust.stop()
-                    self.ship_x.sound_shoot.stop()
-                    self.ship_x.sound_shield.stop()
-                    self.ship_x.sound_bounce.stop()
-                    self.ship_x.sound_explod.stop()
-
-                o_ship.player_name = other_ship["player_name"]
-
-                o_ship.xpos   = other_ship["xpos"]
-                o_ship.ypos   = other_ship["ypos"]
-                o_ship.angle  = other_ship["angle"]
-                o_ship.landed = other_ship["landed"]
-                o_ship.explod = other_ship["explod"]
-                o_ship.thrust_pressed = other_ship["tp"]
-                o_ship.shield_pressed = other_ship["sp"]
-                o_ship.game_over = other_ship["game_over"]
-                o_ship.lives = other_ship["lives"]
-
-                if other_ship["tp"]:
-                    o_ship.thrust = True
-                else:
-                    o_ship.thrust = False
+        self.timers.start("network")
 
-                if other_ship["sp"]:
-                    o_ship.shield = True
-                else:
-                    o_ship.shield = False
+        # 1. -------
+        # Set our player status in self.game_client_factory, pushed to the server at PLAYER_UPDATE_RATE
 
-                o_ship.image = o_ship.ship_pic
-                if o_ship.shield_pressed:
-                    o_ship.image = o_ship.ship_pic_shield
-                if o_ship.thrust_pressed:
-                    o_ship.image = o_ship.ship_pic_thrust
+        # player_name set in init()
+        # { "ship_number":"3", "player_name":"tony, "level":"6", "xpos":"412", "ypos":"517", "angle":"250", "tp":"True", "sp":"False", "shots":[(x,y), (x2, y2), ...] }
+        self.game_client_factory.level     = self.level # only ship_1 can set the level number
+        self.game_client_factory.xpos      = self.ship_x.xposprecise
+        self.game_client_factory.ypos      = self.ship_x.yposprecise
+        self.game_client_factory.angle     = self.ship_x.angle
+        self.game_client_factory.tp        = self.ship_x.thrust_pressed
+        self.game_client_factory.sp        = self.ship_x.shield_pressed
+        self.game_client_factory.landed    = self.ship_x.landed
+        self.game_client_factory.explod    = self.ship_x.explod
+        self.game_client_factory.game_over = self.ship_x.game_over
+        self.game_client_factory.lives     = self.ship_x.lives
 
-                o_ship.image_rotated = pygame.transform.rotate(o_ship.image, o_ship.angle)
-                o_ship.mask = pygame.mask.from_surface(o_ship.image_rotated)
+        particles = []
+        for s in self.ship_x.shots:
+            particles.append((s.x, s.y))
+        #for d in self.ship_x.debris:
+        #    particles.append((d.x, d.y))
 
-                rect = o_ship.image_rotated.get_rect()
-                o_ship.rot_xoffset = int( ((SHIP_SPRITE_SIZE - rect.width)/2) )  # used in draw() and collide_map()
-                o_ship.rot_yoffset = int( ((SHIP_SPRITE_SIZE - rect.height)/2) ) # used in draw() and collide_map()
+        self.game_client_factory.shots = particles
 
-                o_shots = []
-                for o_shot in other_ship["shots"]:
-                    shot = Shot()
-                    shot.x = o_shot[0]
-                    shot.xposprecise = o_shot[0]
-                    shot.y = o_shot[1]
-                    shot.yposprecise = o_shot[1]
+        if self.frames % max(1, SIM_FPS // PLAYER_UPDATE_RATE) == 0:
+            self.game_client_factory.push_update()
 
-                    o_shots.append(shot)
+        # 2. -------
+        # Get other players status if any
 
-                o_ship.shots = o_shots
+        self.other_ships = []
 
-                self.active_ships.append(o_ship)
+        others = ["1", "2", "3", "4"]
+        others.remove(self.game_client_factory.ship_number) # remove ourself from the list
 
-            # collide_map
-            #for ship in self.active_ships:
-            #    ship.collide_map(self.map_buffer, self.map_buffer_mask, self.platforms)
-            self.ship_x.collide_map(self.map_buffer, self.map_buffer_mask, self.platforms)
+        for ship_number in others:
+            try:
+                ship_update = getattr(self.game_client_factory, "other_player_%s" % str(ship_number))
+            except:
+                ship_update = None
 
-            for ship in self.active_ships:
-                ship.collide_ship(self.active_ships)
-                
-            for ship in self.active_ships:
-                ship.plot_shots(self.map_buffer, ship.shots)
+            if ship_update:
+                self.other_ships.append(ship_update)
 
-            for ship in self.active_ships:
-                ship.explod_sequence(self)
+        #print("other_ships=", self.other_ships)
 
-            for ship in self.active_ships:
-                ship.collide_shots(self.active_ships)
+        # 1. self.ship_x is the ship we play with, this will update its posx etc. and we change the states of self.game_client_factory based on that
+        #    then our player xpos etc. will be pushed to the server by self.game_client_factory.push_update()
+        #
+        # 2. self.other_ships contains the other ships last updates we got from the server (message Action.OTHER_PLAYER_UPDATE)
+        #    then we need to render those ships and process collision etc accordingly
 
-            # blit ship in the map
-            for ship in self.active_ships:
-                if ship == self.ship_x:
-                    ship.draw(self.map_buffer)
-                else:
-                    ship.draw(self.map_buffer, render_name=True)
-            # blit the map area around the ship on the screen
-            for ship in self.active_ships:
+        if not self.replay_frame():
+            return
 
-                if not self.show_all_players:
-                    if ship != self.ship_x:
-                        continue
+        # tiles used by this step are kept, the older ones can be evicted (no render: turbo replay, split mode)
+        self.level_map.next_frame()
 
-                # clipping to avoid black when the ship is close to the edges
-                rx = ship.xpos - ship.view_width/2
-                ry = ship.ypos - ship.view_height/2
-                if rx < 0:
-                    rx = 0
-                elif rx > (self.MAP_WIDTH - ship.view_width):
-                    rx = (self.MAP_WIDTH - ship.view_width)
-                if ry < 0:
-                    ry = 0
-                elif ry > (self.MAP_HEIGHT - ship.view_height):
-                    ry = (self.MAP_HEIGHT - ship.view_height)
+        for ship in self.ships:
+            ship.save_position()
 
-                sub_area1 = Rect(rx, ry, ship.view_width, ship.view_height)
+        # update ship pos
+        self.timers.start("update")
+        self.ship_x.update(self, self.ship_x.left_pressed, self.ship_x.right_pressed, self.ship_x.thrust_pressed, 
+                                 self.ship_x.shoot_pressed, self.ship_x.shield_pressed)
 
-                self.game.screen.blit(self.map_buffer, (ship.view_left, ship.view_top), sub_area1)
+        self.timers.start("network")
 
-            # debug on screen
-            self.screen_print_info()
+        self.active_ships = []
+        self.active_ships.append(self.ship_x)
 
-            # split lines
-            if self.show_all_players:
-                cv = (225, 225, 225)
-                pygame.draw.line( self.game.screen, cv, (0, int(self.game.screen_height/2)), (self.game.screen_width, int(self.game.screen_height/2)) )
-                pygame.draw.line( self.game.screen, cv, (int(self.game.screen_width/2), 0), (int(self.game.screen_width/2), (self.game.screen_height)) )
+        # { "ship_number":"3", "player_name":"tony, "level":"6", "xpos":"412", "ypos":"517", "angle":"250", "tp":"True", "sp":"False", "shots":[(x,y), (x2, y2), ...] }
+        for other_ship in self.other_ships:
+            o_ship = getattr(self, "ship_%s" % str(other_ship["ship_number"]))
+            
+            # only ship 1 can change the level, so for this case we are not ship 1
+            # but ship 1 changed the level, so we follow and change the level (possible only with force=1)
+            if (other_ship["ship_number"] == "1") and (other_ship["level"] != self.level):
+                self.set_level_and_ships(other_ship["level"], force=True)
+                self.ship_x.sound_thrust.stop()
+                self.ship_x.sound_shoot.stop()
+                self.ship_x.sound_shield.stop()
+                self.ship_x.sound_bounce.stop()
+                self.ship_x.sound_explod.stop()
 
-            if self.game.use_opengl:
-                self.game.set_uniform(self.game.screen_program, "time", self.frames)
+            o_ship.player_name = other_ship["player_name"]
 
-                try:
-                    self.game.frame_tex.write(self.game.display.get_view('1'))
-                    #self.frame_tex.write(self.display.get_buffer())
-                except:
-                    pass
+            o_ship.xpos   = other_ship["xpos"]
+            o_ship.ypos   = other_ship["ypos"]
+            o_ship.angle  = other_ship["angle"]
+            o_ship.landed = other_ship["landed"]
+            o_ship.explod = other_ship["explod"]
+            o_ship.thrust_pressed = other_ship["tp"]
+            o_ship.shield_pressed = other_ship["sp"]
+            o_ship.game_over = other_ship["game_over"]
+            o_ship.lives = other_ship["lives"]
 
-                self.game.vao.render(mode=mgl.TRIANGLE_STRIP)
+            if other_ship["tp"]:
+                o_ship.thrust = True
+            else:
+                o_ship.thrust = False
 
-                if self.game.show_options:
-                    self.show_options_ui()
-                    imgui.render()
-                    self.game.imgui_renderer.render(imgui.get_draw_data())
+            if other_ship["sp"]:
+                o_ship.shield = True
+            else:
+                o_ship.shield = False
 
-            # display
-            pygame.display.flip()
-            self.frames += 1
+            o_ship.image = o_ship.ship_pic
+            if o_ship.shield_pressed:
+                o_ship.image = o_ship.ship_pic_shield
+            if o_ship.thrust_pressed:
+                o_ship.image = o_ship.ship_pic_thrust
 
-            self.get_fps()
+            o_ship.image_rotated = pygame.transform.rotate(o_ship.image, o_ship.angle)
+            o_ship.mask = pygame.mask.from_surface(o_ship.image_rotated)
 
-    def game_loop_local(self):
+            rect = o_ship.image_rotated.get_rect()
+            o_ship.rot_xoffset = int( ((SHIP_SPRITE_SIZE - rect.width)/2) )  # used in draw() and collide_map()
+            o_ship.rot_yoffset = int( ((SHIP_SPRITE_SIZE - rect.height)/2) ) # used in draw() and collide_map()
+
+            o_shots = []
+            for o_shot in other_ship["shots"]:
+                shot = Shot()
+                shot.x = o_shot[0]
+                shot.xposprecise = o_shot[0]
+                shot.y = o_shot[1]
+                shot.yposprecise = o_shot[1]
+
+                o_shots.append(shot)
+
+            o_ship.shots = o_shots
+
+            self.active_ships.append(o_ship)
+
+        # collide_map
+        self.timers.start("collision")
+        #for ship in self.active_ships:
+        #    ship.collide_map(self.level_map, self.platforms)
+        self.ship_x.collide_map(self.level_map, self.platforms)
+
+        for ship in self.active_ships:
+            ship.collide_ship(self.active_ships)
+            
+        self.timers.start("shots")
+        for ship in self.active_ships:
+            ship.move_shots(self.level_map, ship.shots)
+
+        self.timers.start("explod")
+        for ship in self.active_ships:
+            ship.explod_sequence(self)
+
+        self.timers.start("collision")
+        for ship in self.active_ships:
+            ship.collide_shots(self.active_ships)
+
+        self.timers.stop()
+
+        self.frames += 1
+
+    def handle_local_events(self):
 
         # events
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 self.record_it()
-                if self.game.use_opengl:
-                    self.game.frame_tex.release()
-                reactor.stop()
+                self.stop_loop()
                 #sys.exit(0)
 
             elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_ESCAPE:
                     self.record_it()
-                    if self.game.use_opengl:
-                        self.game.frame_tex.release()
-                    reactor.stop()
+                    self.stop_loop()
                     #sys.exit(0)
                 elif event.key == pygame.K_p:
                     self.paused = not self.paused
+                elif event.key == pygame.K_m:
+                    self.show_minimap = not self.show_minimap
+                elif event.key == pygame.K_o:
+                    self.show_overview = not self.show_overview
+                elif event.key == pygame.K_t:
+                    self.toggle_timers()
+                elif event.key == pygame.K_f:
+                    self.toggle_profiler()
+
+                # playback: 10s back / forward
+                elif event.key == pygame.K_PAGEUP:
+                    self.seek(self.frames - SIM_FPS * 10)
+                elif event.key == pygame.K_PAGEDOWN:
+                    self.seek(self.frames + SIM_FPS * 10)
 
                 elif event.key == pygame.K_1:
                     self.set_level_and_ships(1)
@@ -1414,89 +1765,244 @@ class MayhemEnv():
                 except:
                     pass
 
+    def game_loop_local(self):
+
+        self.timers.start("input")
+        self.handle_local_events()
+
         # core
         if not self.paused:
-            # per level data
-            self.map = self.game.getv("map", current_level=self.level)
-            self.map_buffer = self.game.getv("map_buffer", current_level=self.level)
-            self.map_buffer_mask = self.game.getv("map_buffer_mask", current_level=self.level)
-            self.platforms = self.game.getv("platforms", current_level=self.level)
 
-            # clear screen
-            self.game.screen.fill((0,0,0))
+            self.governor.start_frame()
 
-            self.map_buffer.blit(self.map, (0, 0))
+            # fixed rate simulation, whatever the rate this loop is called at
+            for _ in range(self.timestep.advance()):
+                self.step_local()
 
-            # update ship pos
-            for ship in self.ships:
-                ship.update(self, ship.left_pressed, ship.right_pressed, ship.thrust_pressed, ship.shoot_pressed, ship.shield_pressed)
+            if self.governor.should_render():
+                self.render(self.ships, self.timestep.alpha())
 
-            # collide_map
-            for ship in self.ships:
-                ship.collide_map(self.map_buffer, self.map_buffer_mask, self.platforms)
+            self.governor.end_frame()
 
-            for ship in self.ships:
-                ship.collide_ship(self.ships)
-                
-            for ship in self.ships:
-                ship.plot_shots(self.map_buffer, ship.shots)
+        else:
+            self.timestep.reset()
 
-            for ship in self.ships:
-                ship.explod_sequence(self)
+        self.timers.end_frame()
 
-            for ship in self.ships:
-                ship.collide_shots(self.ships)
+    def step_local(self):
 
-            # blit ship in the map
-            for ship in self.ships:
-                ship.draw(self.map_buffer)
+        if not self.replay_frame():
+            return
 
-            for ship in self.ships:
+        # tiles used by this step are kept, the older ones can be evicted (no render: turbo replay, split mode)
+        self.level_map.next_frame()
+
+        for ship in self.ships:
+            ship.save_position()
+
+        # update ship pos
+        self.timers.start("update")
+        for ship in self.ships:
+            ship.update(self, ship.left_pressed, ship.right_pressed, ship.thrust_pressed, ship.shoot_pressed, ship.shield_pressed)
+
+        # collide_map
+        self.timers.start("collision")
+        for ship in self.ships:
+            ship.collide_map(self.level_map, self.platforms)
+
+        for ship in self.ships:
+            ship.collide_ship(self.ships)
+            
+        self.timers.start("shots")
+        for ship in self.ships:
+            ship.move_shots(self.level_map, ship.shots)
+
+        self.timers.start("explod")
+        for ship in self.ships:
+            ship.explod_sequence(self)
+
+        self.timers.start("collision")
+        for ship in self.ships:
+            ship.collide_shots(self.ships)
+
+        self.timers.stop()
 
-                # clipping to avoid black when the ship is close to the edges
-                rx = ship.xpos - ship.view_width/2
-                ry = ship.ypos - ship.view_height/2
-                if rx < 0:
-                    rx = 0
-                elif rx > (self.MAP_WIDTH - ship.view_width):
-                    rx = (self.MAP_WIDTH - ship.view_width)
-                if ry < 0:
-                    ry = 0
-                elif ry > (self.MAP_HEIGHT - ship.view_height):
-                    ry = (self.MAP_HEIGHT - ship.view_height)
-
-                # blit the map area around the ship on the screen
-                sub_area1 = Rect(rx, ry, ship.view_width, ship.view_height)
-                self.game.screen.blit(self.map_buffer, (ship.view_left, ship.view_top), sub_area1)
-
-            # debug on screen
-            self.screen_print_info()
+        self.frames += 1
+        self.record_keyframe()
+
+    def render(self, ships, alpha):
+
+        self.timers.start("draw")
+
+        self.level_map.next_frame()
+
+        # clear screen
+        self.game.screen.fill((0,0,0))
+
+        # render the view around each ship (online: ours only if not show_all_players), or the whole level
+        if self.show_overview:
+            self.draw_overview(ships, self.game.screen.get_rect())
+        else:
+            for ship in ships:
 
+                if not self.show_all_players:
+                    if ship != self.ship_x:
+                        continue
+
+                self.draw_view(ship, ships, alpha)
+
+            if self.show_minimap:
+                self.draw_minimap(ships)
+
+        # debug on screen
+        self.timers.start("hud")
+        self.screen_print_info()
+
+        if self.show_timers:
+            self.draw_timers()
+
+        # split lines
+        if self.show_all_players and not self.show_overview:
             cv = (225, 225, 225)
             pygame.draw.line( self.game.screen, cv, (0, int(self.game.screen_height/2)), (self.game.screen_width, int(self.game.screen_height/2)) )
             pygame.draw.line( self.game.screen, cv, (int(self.game.screen_width/2), 0), (int(self.game.screen_width/2), (self.game.screen_height)) )
 
-            if self.game.use_opengl:
-                self.game.set_uniform(self.game.screen_program, "time", self.frames)
+        if self.game.use_opengl:
+            self.timers.start("upload")
+            self.game.set_uniform(self.game.screen_program, "time", self.frames)
 
-                try:
-                    self.game.frame_tex.write(self.game.display.get_view('1'))
-                    #self.frame_tex.write(self.display.get_buffer())
-                except:
-                    pass
+            try:
+                self.game.frame_tex.write(self.game.display.get_view('1'))
+                #self.frame_tex.write(self.display.get_buffer())
+            except:
+                pass
+
+            self.timers.start("gl_render")
+            self.game.vao.render(mode=mgl.TRIANGLE_STRIP)
+
+            if self.game.show_options:
+                self.show_options_ui()
+                imgui.render()
+                self.game.imgui_renderer.render(imgui.get_draw_data())
+
+        # display
+        self.timers.start("flip")
+        pygame.display.flip()
+
+        self.timers.stop()
+        self.get_fps()
+
+    def draw_view(self, view_ship, ships, alpha=1.):
+
+        # the view follows the interpolated ship position
+        xpos, ypos = view_ship.render_pos(alpha)
+
+        # clipping to avoid black when the ship is close to the edges
+        rx = xpos - view_ship.view_width/2
+        ry = ypos - view_ship.view_height/2
+        if rx < 0:
+            rx = 0
+        elif rx > (self.MAP_WIDTH - view_ship.view_width):
+            rx = (self.MAP_WIDTH - view_ship.view_width)
+        if ry < 0:
+            ry = 0
+        elif ry > (self.MAP_HEIGHT - view_ship.view_height):
+            ry = (self.MAP_HEIGHT - view_ship.view_height)
+
+        view = Rect(view_ship.view_left, view_ship.view_top, view_ship.view_width, view_ship.view_height)
+        offset = (view.left - int(rx), view.top - int(ry))
+
+        self.game.screen.set_clip(view)
+
+        # blit the map area around the ship on the screen (only the tiles of this area are decoded)
+        self.timers.start("map_blit")
+        self.level_map.blit(self.game.screen, view.topleft, Rect(rx, ry, view_ship.view_width, view_ship.view_height))
+
+        self.timers.start("draw")
+
+        for ship in ships:
+            ship.draw_shots(self.game.screen, offset)
+
+        cosmetics = self.governor.cosmetics()
+
+        for ship in ships:
+            ship.draw_explosion(self.game.screen, offset, particles=cosmetics)
+
+        # online: other players names
+        for ship in ships:
+            render_name = bool(self.game_client_factory) and ship != self.ship_x and cosmetics
+            ship.draw(self.game.screen, offset, render_name=render_name, alpha=alpha)
+
+        self.game.screen.set_clip(None)
+
+    def draw_overview(self, ships, area):
+        # precomputed downsampled map: costs a small blit, no per frame scaling
+        overview, scale = self.level_map.get_overview(area.width, area.height)
+
+        left = area.left + (area.width - overview.get_width()) // 2
+        top = area.top + (area.height - overview.get_height()) // 2
+
+        self.game.screen.blit(overview, (left, top))
+
+        for ship in ships:
+            if ship.game_over:
+                continue
+
+            for shot in ship.shots:
+                self.game.screen.set_at((left + int(shot.x * scale), top + int(shot.y * scale)), WHITE)
+
+            if ship.explod:
+                color = RED
+            else:
+                color = SHIP_COLORS.get(str(ship.ship_number), WHITE)
+
+            cx = left + int((ship.xpos + SHIP_SPRITE_SIZE/2) * scale)
+            cy = top + int((ship.ypos + SHIP_SPRITE_SIZE/2) * scale)
+            pygame.draw.rect(self.game.screen, color, (cx - 2, cy - 2, 4, 4))
+
+        return Rect(left, top, overview.get_width(), overview.get_height())
+
+    def draw_minimap(self, ships):
+        area = Rect(self.game.screen_width - MINIMAP_SIZE - 5, 5, MINIMAP_SIZE, MINIMAP_SIZE)
+
+        minimap = self.draw_overview(ships, area)
+        pygame.draw.rect(self.game.screen, (225, 225, 225), minimap.inflate(2, 2), 1)
+
+    def toggle_timers(self):
+        self.show_timers = not self.show_timers
+        self.enable_timers()
+
+    def toggle_profiler(self):
+        self.profiler.toggle()
+        self.enable_timers()
+
+    def enable_timers(self):
+        # the profiler tags its samples with the current stage
+        self.timers.enable(self.show_timers or self.timers.output is not None or self.profiler.running)
+
+    def draw_timers(self):
+
+        if self.timers.frames % STAGE_OVERLAY_REFRESH == 0 or not self.timers_summary:
+            self.timers_summary = self.timers.summary()
 
-                self.game.vao.render(mode=mgl.TRIANGLE_STRIP)
+        x = self.game.screen_width - 330
+        y = self.game.screen_height - 25 * (len(self.timers_summary) + 1) - 5
 
-                if self.game.show_options:
-                    self.show_options_ui()
-                    imgui.render()
-                    self.game.imgui_renderer.render(imgui.get_draw_data())
+        if self.show_minimap and not self.show_overview:
+            y = max(y, MINIMAP_SIZE + 10)
 
-            # display
-            pygame.display.flip()
-            self.frames += 1
+        pygame.draw.rect(self.game.screen, (0, 0, 0), (x - 5, y - 5, 330, 25 * (len(self.timers_summary) + 1) + 5))
 
-            self.get_fps()
+        # one column per value: the font is not monospace
+        rows = [("stage (ms)", "p50", "p95", "p99", "max")]
+        for stage, p in self.timers_summary.items():
+            rows.append((stage, "%.2f" % p["p50"], "%.2f" % p["p95"], "%.2f" % p["p99"], "%.2f" % p["max"]))
+
+        for row in rows:
+            for column, value in zip((0, 100, 160, 220, 280), row):
+                text = self.myfont.render(value, False, (255, 255, 255))
+                self.game.screen.blit(text, (x + column, y))
+            y += 25
 
     def screen_print_info(self):
 
@@ -1525,8 +2031,13 @@ class MayhemEnv():
                     go = self.myfont_big.render('GAME OVER', False, (255, 0, 0))
                     self.game.screen.blit(go, (self.ship_x.view_left, self.ship_x.view_top + offset + 20))
 
+        # load governor degradation level
+        if self.governor.level:
+            load = self.myfont.render('LOAD %s (%.0f%%)' % (self.governor.level, self.governor.get_load() * 100), False, (255, 128, 0))
+            self.game.screen.blit(load, (DEBUG_TEXT_XPOS + 5, self.game.screen_height - 25))
+
         # debug text
-        if self.debug_print:
+        if self.debug_print and self.governor.cosmetics():
             ship_pos = self.myfont.render('Pos: %s %s' % (self.ship_1.xpos, self.ship_1.ypos), False, (255, 255, 255))
             self.game.screen.blit(ship_pos, (DEBUG_TEXT_XPOS + 5, 30))
 
@@ -1571,6 +2082,8 @@ class GameWindow():
         self.screen = self.window
 
         if use_opengl:
+            load_opengl()
+
             # pg.draw on this surface. then this surface is converted into a texture
             # then this texture is sampled2D in the FS and rendered into the screen (which is a 2 triangles  => quad)
             self.display = pygame.Surface((self.screen_width, self.screen_height))
@@ -1603,62 +2116,14 @@ class GameWindow():
             self.ctx.clear(color=(0.0, 0.0, 0.0))
 
             if show_options:
+                load_imgui()
+
                 imgui.create_context()
                 self.imgui_renderer = pygame_imgui.PygameRenderer()
                 imgui.get_io().display_size = self.screen_width, self.screen_height
         
-        # Background
-        self.map_1 = pygame.image.load(MAP_1).convert() # .convert_alpha()
-        #self.map.set_colorkey( (0, 0, 0) ) # used for the mask, black = background
-        #self.map_rect = self.map.get_rect()
-        #self.map_mask = pygame.mask.from_surface(self.map)
-
-        self.map_buffer_1 = self.map_1.copy() # pygame.Surface((self.map.get_width(), self.map.get_height()))
-
-        self.map_buffer_1.set_colorkey( (0, 0, 0) )
-        self.map_buffer_mask_1 = pygame.mask.from_surface(self.map_buffer_1)
-
-        # map2
-        self.map_2 = pygame.image.load(MAP_2).convert() # .convert_alpha()
-        self.map_buffer_2 = self.map_2.copy() # pygame.Surface((self.map.get_width(), self.map.get_height()))
-
-        self.map_buffer_2.set_colorkey( (0, 0, 0) )
-        self.map_buffer_mask_2 = pygame.mask.from_surface(self.map_buffer_2)
-
-        # map3
-        self.map_3 = pygame.image.load(MAP_3).convert() # .convert_alpha()
-        self.map_buffer_3 = self.map_3.copy() # pygame.Surface((self.map.get_width(), self.map.get_height()))
-
-        self.map_buffer_3.set_colorkey( (0, 0, 0) )
-        self.map_buffer_mask_3 = pygame.mask.from_surface(self.map_buffer_3)
-
-        # map4
-        self.map_4 = pygame.image.load(MAP_4).convert() # .convert_alpha()
-        self.map_buffer_4 = self.map_4.copy() # pygame.Surface((self.map.get_width(), self.map.get_height()))
-
-        self.map_buffer_4.set_colorkey( (0, 0, 0) )
-        self.map_buffer_mask_4 = pygame.mask.from_surface(self.map_buffer_4)
-
-        # map5
-        self.map_5 = pygame.image.load(MAP_5).convert() # .convert_alpha()
-        self.map_buffer_5 = self.map_5.copy() # pygame.Surface((self.map.get_width(), self.map.get_height()))
-
-        self.map_buffer_5.set_colorkey( (0, 0, 0) )
-        self.map_buffer_mask_5 = pygame.mask.from_surface(self.map_buffer_5)
-
-        # map6
-        self.map_6 = pygame.image.load(MAP_6).convert() # .convert_alpha()
-        self.map_buffer_6 = self.map_6.copy() # pygame.Surface((self.map.get_width(), self.map.get_height()))
-
-        self.map_buffer_6.set_colorkey( (0, 0, 0) )
-        self.map_buffer_mask_6 = pygame.mask.from_surface(self.map_buffer_6)
-
-        # map7
-        self.map_7 = pygame.image.load(MAP_7).convert() # .convert_alpha()
-        self.map_buffer_7 = self.map_7.copy() # pygame.Surface((self.map.get_width(), self.map.get_height()))
-
-        self.map_buffer_7.set_colorkey( (0, 0, 0) )
-        self.map_buffer_mask_7 = pygame.mask.from_surface(self.map_buffer_7)
+        # level maps, loaded on first use
+        self.level_maps = {}
 
         # platforms
         self.platforms_1 = [ ( 464, 513, 333 ),
@@ -1739,6 +2204,15 @@ class GameWindow():
     def getv(self, name, current_level=6):
         return getattr(self, "%s_%s" % (name, str(current_level)))
 
+    def get_level_map(self, level):
+        level_map = self.level_maps.get(level)
+
+        if level_map is None:
+            level_map = TiledMap(LEVEL_MAPS[level])
+            self.level_maps[level] = level_map
+
+        return level_map
+
     def surf_to_texture(self, surf):
         tex = self.ctx.texture(surf.get_size(), 4)
         tex.filter = (mgl.NEAREST, mgl.NEAREST)
@@ -1754,137 +2228,6 @@ class GameWindow():
 
 # -------------------------------------------------------------------------------------------------
 
-class Action(str, enum.Enum):
-
-    PLAY        = enum.auto()
-    LOGIN_OK    = enum.auto()
-    LOGIN_DENY  = enum.auto()
-    LOGIN       = enum.auto()
-    EXITED      = enum.auto()
-
-    PLAYER_UPDATE = enum.auto()
-    PLAYER_UPDATE_REQUEST = enum.auto()
-
-    OTHER_PLAYER_UPDATE = enum.auto()
-
-    SERVER_STAT_REGISTER = enum.auto()
-    SERVER_STAT_OK = enum.auto()
-    SERVER_STAT_UPDATE = enum.auto()
-
-    OTHER_PLAYER_DISCONNECT = enum.auto()
-
-# -------------------------------------------------------------------------------------------------
-
-class GameClientProtocol(WebSocketClientProtocol):
-
-    # connect to the game server
-    # then the server send a player update request
-    # => the player sent back its position etc
-    # when the server gets it, it brodcast that to all other players in the room
-     
-    def onOpen(self):
-        print("Connected to the GameServer, username=%s" % self.factory.player_name)
-        print("Requesting room_id=%s" % self.factory.room_id)
-
-        msg = {"a":Action.LOGIN, "p":{"room_id":self.factory.room_id}}
-        self.sendMessage(msgpack.packb(msg, use_bin_type=True), isBinary=True)
-
-    def onMessage(self, payload, isBinary):
-
-        r = msgpack.unpackb(payload, raw=False)
-
-        if r["a"] == Action.LOGIN_OK:
-            print("Entered in the game in room %s as ship n°%s" % (str(r["p"]["room_id"]), str(r["p"]["ship_nb"])))
-            self.factory.room_id = str(r["p"]["room_id"])
-            self.factory.ship_number = str(r["p"]["ship_nb"]) # we are ship #x in the game
-            self.factory._state = Action.PLAY
-
-        elif r["a"] == Action.LOGIN_DENY:
-            print("Failed to enter in the game: %s"  % r["p"])
-            # TODO retry
-
-        elif r["a"] == Action.PLAYER_UPDATE_REQUEST:
-            #print("Player update requested, sending player update...")
-
-            # { "ship_number":"3", "player_name":"tony, "level":"6", "xpos":"412", "ypos":"517", "angle":"250", "tp":"True", "sp":"False", "shots":[(x,y), (x2, y2), ...] }
-            ship_update = { "ship_number":self.factory.ship_number, "player_name":self.factory.player_name, "level":self.factory.level,
-                            "xpos":self.factory.xpos, "ypos":self.factory.ypos, "angle":self.factory.angle, "landed":self.factory.landed, "explod":self.factory.explod,
-                            "tp":self.factory.tp, "sp":self.factory.sp, "shots":self.factory.shots, "game_over":self.factory.game_over, "lives":self.factory.lives }
-            
-            msg = {"a":Action.PLAYER_UPDATE, "p":ship_update}
-            self.sendMessage(msgpack.packb(msg, use_bin_type=True), isBinary=True)
-
-            if self.factory.game_over:
-                #print("Game Over, disconnecting...")
-                reactor.callLater(5, self.dropConnection, abort=True)
-
-        elif r["a"] == Action.OTHER_PLAYER_UPDATE:
-            #print("Received another player update: ", r["p"])
-
-            ship_update = r["p"]
-            setattr(self.factory, "other_player_%s" % str(ship_update["ship_number"]), ship_update)
-
-        elif r["a"] == Action.OTHER_PLAYER_DISCONNECT:
-            print("Received another player disconnect: ", r["p"])
-
-            ship_number = r["p"]
-
-            try:
-                if ship_number in ("1", 1):
-                    del self.factory.other_player_1
-                elif ship_number in ("2", 2):
-                    del self.factory.other_player_2
-                elif ship_number in ("3", 3):
-                    del self.factory.other_player_3
-                elif ship_number in ("4", 4):
-                    del self.factory.other_player_4
-            except Exception as e:
-                print("Failed to remove other player %s : %s" % (str(ship_number), repr(e)))
-
-    def onClose(self, wasClean, code, reason):
-        print("Exited from the GameServer")
-        self.factory._state = Action.EXITED
-
-# -------------------------------------------------------------------------------------------------
-
-#class GameClientFactory(WebSocketClientFactory, ReconnectingClientFactory):
-class GameClientFactory(WebSocketClientFactory):
-    """ Player update paquet vars """
-
-    def __init__(self, url, player_name, room_id):
-        WebSocketClientFactory.__init__(self, url)
-        #ReconnectingClientFactory.__init__(self)
-
-        self._state = Action.LOGIN
-
-        self.server_url = url
-        self.player_name = player_name
-        self.room_id = room_id
-        
-        #{ ship_number: 1, "player_name":"tony", "level":"6", "xpos":"412", "ypos":"517", "angle":"250", "tp":"True", "sp":"False", landed, "shots":[(x,y), (x2, y2), ...]} }
-        self.ship_number = "1"
-        self.level = 6
-        self.xpos = 0
-        self.ypos = 0
-        self.angle = 0
-        self.tp = False
-        self.sp = False
-        self.landed = True
-        self.shots = []
-        self.explod = False
-        self.game_over = False
-        self.lives = SHIP_MAX_LIVES
-
-    #def clientConnectionFailed(self, connector, reason):
-    #    print("Client connection failed .. retrying ..")
-    #    self.retry(connector)
-
-    #def clientConnectionLost(self, connector, reason):
-    #    print("Client connection lost .. retrying ..")
-    #    self.retry(connector)
-
-# -------------------------------------------------------------------------------------------------
-
 class GameMenu():
     
     def __init__(self, user_settings=None):
@@ -1937,12 +2280,13 @@ class GameMenu():
             default_zoom = 0
             default_show_options = 0
 
+        load_menu()
+
         self.menu_surface = pygame.display.set_mode((320*3, 256*3))
 
-        self.background_image = pygame_menu.BaseImage(drawing_mode=pygame_menu.baseimage.IMAGE_MODE_FILL,
-                                image_path=os.path.join(os.path.dirname(__file__), "assets", "wiki", "mayhem_menu%s.png" % str(randint(0, 1)))
-        )
-        #self.background_image.set_alpha(255)
+        # background scaled once to the menu size (instead of an IMAGE_MODE_FILL scaling at each draw)
+        background_image = pygame.image.load(os.path.join(os.path.dirname(__file__), "assets", "wiki", "mayhem_menu%s.png" % str(randint(0, 1)))).convert()
+        self.background_image = pygame.transform.smoothscale(background_image, self.menu_surface.get_size())
 
         theme = pygame_menu.themes.THEME_DARK
         theme.background_color = (0, 0, 0, 210)
@@ -2005,20 +2349,52 @@ class GameMenu():
 
     def loop(self):
 
+        redraw = True
+
         while self.menu_loop:
 
-            events = pygame.event.get()
+            # block until an event comes in, instead of spinning at MENU_FPS
+            #   keys / mouse buttons held down: the menu handles key repeat itself, keep updating it
+            if any(pygame.key.get_pressed()) or any(pygame.mouse.get_pressed()):
+                timeout = int(1000 / MENU_FPS)
+            else:
+                timeout = MENU_IDLE_TIMEOUT
+
+            event = pygame.event.wait(timeout)
+
+            events = []
+            if event.type != pygame.NOEVENT:
+                events = [event] + pygame.event.get()
+            # timeout: nothing happened, only the text input cursor has to blink
+            else:
+                redraw = True
+
             for event in events:
 
                 if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
                     sys.exit(0)
 
-            self.menu.update(events)
-            self.background_image.draw(self.menu_surface)
-            self.menu.draw(self.menu_surface)
+            if self.menu.update(events) or events:
+                redraw = True
+
+            if redraw:
+                self.menu_surface.blit(self.background_image, (0, 0))
+                self.menu.draw(self.menu_surface)
+
+                pygame.display.flip()
+                redraw = False
 
-            pygame.display.flip()
-            self.clock.tick(60)
+            self.clock.tick(MENU_FPS)
+
+# -------------------------------------------------------------------------------------------------
+
+def run_local_loop(game_env, fps):
+    # local mode has no network: a plain pygame loop, no need for the twisted reactor
+    clock = pygame.time.Clock()
+
+    while game_env.running:
+        game_env.game_loop_local()
+        clock.tick(fps)
 
 # -------------------------------------------------------------------------------------------------
 
@@ -2048,12 +2424,15 @@ def run():
 
     parser.add_argument('-width', '--width', help='', type=int, action="store", default=1200)
     parser.add_argument('-height', '--height', help='', type=int, action="store", default=800)
-    parser.add_argument('-fps', '--fps', help='', type=int, action="store", default=60)
+    parser.add_argument('-fps', '--fps', help='render rate, 0 = unlimited, online: SIM_FPS (the simulation always runs at SIM_FPS)', type=int, action="store", default=60)
     parser.add_argument('-dp', '--debug_print', help='', action="store", default=False)
 
     parser.add_argument('-m', '--motion', help='How the ship moves', action="store", default='gravity', choices=("basic", "thrust", "gravity"))
     parser.add_argument('-r', '--record_play', help='', action="store", default="")
     parser.add_argument('-pr', '--play_recorded', help='', action="store", default="")
+    parser.add_argument('-turbo', '--turbo', help='With --play_recorded: replay as fast as possible, render one frame every N steps (0 = none)', type=int, action="store", default=None)
+    parser.add_argument('-seek', '--seek', help='With --play_recorded: start the replay at this frame', type=int, action="store", default=0)
+    parser.add_argument('-hashes', '--hashes', help='With --turbo: write the simulation state hash after each step to this file', action="store", default="")
 
     parser.add_argument('-server', '--server', help='', action="store", default="")
     parser.add_argument('-pn', '--player_name', help='', action="store", default="tony")
@@ -2064,6 +2443,11 @@ def run():
     parser.add_argument('-zoom', '--zoom', help='', action="store_true", default=False)
     parser.add_argument('-opengl', '--opengl', help='', action="store_false", default=True)
     parser.add_argument('-show_options', '--show_options', help='', action="store_true", default=False)
+    parser.add_argument('-nm', '--no_menu', help='Skip the menu and use the command line options', action="store_true", default=False)
+    parser.add_argument('-split', '--split', help='Local mode: run the simulation in its own process', action="store_true", default=False)
+    parser.add_argument('-st', '--stage_timers', help='Stream the per stage frame times (ms) to this .csv or .jsonl file', action="store", default="")
+    parser.add_argument('-profile', '--profile', help='Sample the game loop from the start, write collapsed stacks (flamegraph) to this file (time.strftime format) when stopped with f or at exit', action="store", default="")
+    parser.add_argument('-profile_switch', '--profile_switch', help='Lower the GIL switch interval while profiling: samples on time, but more overhead in the measured code', action="store_true", default=False)
 
     result = parser.parse_args()
     args = dict(result._get_kwargs())
@@ -2082,44 +2466,51 @@ def run():
     zoom = args["zoom"]
     show_options = args["show_options"]
 
-    # load previous user settings
-    user_settings_file = os.path.join(os.path.dirname(__file__), "user_settings.dat")
+    # window size from the command line
+    width  = args["width"]
+    height = args["height"]
 
-    if os.path.exists(user_settings_file):
-        with open(user_settings_file, "rb") as f:
-            user_settings = pickle.load(f)
-    else:
-        user_settings = {}
-    
-    print("user_settings loaded", user_settings)
-
-    gm = GameMenu(user_settings)
-    gm.loop()
-
-    # assign values for our Mayhem env
-    player_name = gm.player_name
-    room_id = gm.room_id
-    ship_control = gm.ship_control
-    show_all_players = gm.show_all_players
-    server = gm.server
-    opengl = gm.opengl
-    zoom = gm.zoom
-    show_options = gm.show_options
-
-    # dump user settings
-    user_settings = {"player_name":player_name, "ship_control":ship_control,"show_all_players":show_all_players, 
-                        "server":server, "opengl":opengl, "zoom":zoom, "show_options":show_options, "room_id":room_id}
-    print("user_settings saved", user_settings)
-    with open(user_settings_file, "wb") as f:
-        pickle.dump(user_settings, f, protocol=pickle.HIGHEST_PROTOCOL)
-
-    # trying fixed "nice looking" width/height
-    if show_all_players:
-        width  = 704*2
-        height = 448*2
-    else:
-        width  = 704
-        height = 448
+    # the menu overrides the command line options (bots and test clients use --no_menu)
+    if not args["no_menu"]:
+
+        # load previous user settings
+        user_settings_file = os.path.join(os.path.dirname(__file__), "user_settings.dat")
+
+        if os.path.exists(user_settings_file):
+            with open(user_settings_file, "rb") as f:
+                user_settings = pickle.load(f)
+        else:
+            user_settings = {}
+        
+        print("user_settings loaded", user_settings)
+
+        gm = GameMenu(user_settings)
+        gm.loop()
+
+        # assign values for our Mayhem env
+        player_name = gm.player_name
+        room_id = gm.room_id
+        ship_control = gm.ship_control
+        show_all_players = gm.show_all_players
+        server = gm.server
+        opengl = gm.opengl
+        zoom = gm.zoom
+        show_options = gm.show_options
+
+        # dump user settings
+        user_settings = {"player_name":player_name, "ship_control":ship_control,"show_all_players":show_all_players, 
+                            "server":server, "opengl":opengl, "zoom":zoom, "show_options":show_options, "room_id":room_id}
+        print("user_settings saved", user_settings)
+        with open(user_settings_file, "wb") as f:
+            pickle.dump(user_settings, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        # trying fixed "nice looking" width/height
+        if show_all_players:
+            width  = 704*2
+            height = 448*2
+        else:
+            width  = 704
+            height = 448
 
     # online ?
     online = False
@@ -2127,30 +2518,70 @@ def run():
         online = True
 
     if online:
+        load_network()
+        from autobahn.twisted.websocket import connectWS
+        from game_client import GameClientFactory, GameClientProtocol
+
         print("Trying to connect to %s" % server)
-        game_client_factory = GameClientFactory(server, player_name, room_id)
+        game_client_factory = GameClientFactory(server, player_name, room_id, SHIP_MAX_LIVES)
         game_client_factory.protocol = GameClientProtocol
         connectWS(game_client_factory)
     else:
         game_client_factory = None
         show_all_players = True
 
+    record_play = args["record_play"]
+    play_recorded = args["play_recorded"]
+
+    # turbo replay, local only
+    turbo = args["turbo"] is not None and play_recorded and not online
+
+    # split mode, local only: the simulation process records / plays, the render process does not
+    split = args["split"] and not online and not turbo
+    if split:
+        sim_args = {"level":level, "motion":args["motion"], "record_play":record_play, "play_recorded":play_recorded}
+        record_play = ""
+        play_recorded = ""
+
     # game env
     game_window = GameWindow(width, height, zoom=zoom, use_opengl=opengl, show_options=show_options)
 
     game_env = MayhemEnv(game_window, level=level, max_fps=fps, debug_print=args["debug_print"], motion=args["motion"],
-                    record_play=args["record_play"], play_recorded=args["play_recorded"], player_name=player_name, 
+                    record_play=record_play, play_recorded=play_recorded, player_name=player_name, 
                     show_all_players=show_all_players, ship_control=ship_control, game_client_factory=game_client_factory)
     
-    if online:
-        game_loop = game_env.game_loop_online
-    else:
-        game_loop = game_env.game_loop_local
+    if args["stage_timers"]:
+        game_env.timers.open_output(args["stage_timers"], columns=STAGES)
+
+    if args["profile_switch"]:
+        game_env.profiler.switch_interval = PROFILE_SWITCH_INTERVAL
 
-    tick = task.LoopingCall(game_loop)
-    tick.start(1.0 / int(args["fps"]))
+    if args["profile"]:
+        game_env.profiler.path = args["profile"]
+        game_env.toggle_profiler()
+
+    if args["seek"]:
+        game_env.seek(args["seek"])
+
+    if turbo:
+        print_summary(turbo_replay(game_env, render_every=args["turbo"], hashes_path=args["hashes"]))
+
+    elif split:
+        # numpy shared memory
+        from split_mode import run_split_loop
+        run_split_loop(game_env, fps, sim_args)
+
+    elif online:
+        tick = task.LoopingCall(game_env.game_loop_online)
+        # fps = 0: at the simulation rate (an interval of 0 would busy-spin the reactor and starve the network)
+        tick.start(1.0 / (fps or SIM_FPS))
+
+        reactor.run()
+    else:
+        run_local_loop(game_env, fps)
 
-    reactor.run()
+    game_env.profiler.stop()
+    game_env.timers.close_output()
 
 # -------------------------------------------------------------------------------------------------
 
@@ -0,0 +1,325 @@
+"""
+Replay files (--record_play / --play_recorded): the inputs of each ship at each simulation step,
+streamed to disk while playing.
+
+    MAGIC, version (2 bytes), header size (4 bytes), header (JSON: level, motion, physics, seed, ships...)
+    then chunks: kind (1 byte), payload size (4 bytes), payload
+
+    b"I" inputs  first frame (4 bytes), frame count (4 bytes), zlib(input masks)
+                 one mask per frame, INPUT_BITS per ship, ship 1 in the low bits
+    b"E" event   frame (4 bytes), JSON ({"level": 3}, {"physics": {...}}), applied before the frame inputs
+    b"K" keyframe  frame (4 bytes), zlib(JSON MayhemEnv.get_state()): the state before the frame inputs,
+                 every REPLAY_KEYFRAME_FRAMES frames (local games)
+
+Input chunks are written (and flushed) every REPLAY_CHUNK_FRAMES frames: a crash loses a few seconds,
+memory use does not depend on the match length.
+
+Seek (MayhemEnv.seek()): restores the nearest keyframe before the frame, then simulates the frames left
+(REPLAY_KEYFRAME_FRAMES at most) without rendering.
+
+Turbo replay (turbo_replay(), mayhem.py --turbo, benchmarks/replay_check.py): steps the simulation as fast
+as possible, renders no frame or one every N, writes a hash of the simulation state after each step.
+"""
+
+import os, json, time, zlib, struct, hashlib
+
+# -------------------------------------------------------------------------------------------------
+
+REPLAY_MAGIC = b"MAYHEMRP"
+REPLAY_VERSION = 1
+
+REPLAY_CHUNK_FRAMES = 600 # 10s at SIM_FPS
+REPLAY_KEYFRAME_FRAMES = 300 # 5s at SIM_FPS: max frames simulated by a seek
+
+CHUNK_INPUTS = b"I"
+CHUNK_EVENT = b"E"
+CHUNK_KEYFRAME = b"K"
+
+# ship input mask
+INPUT_LEFT   = 1
+INPUT_RIGHT  = 2
+INPUT_THRUST = 4
+INPUT_SHOOT  = 8
+INPUT_SHIELD = 16
+INPUT_BITS   = 5
+
+# -------------------------------------------------------------------------------------------------
+
+def ship_input_mask(ship):
+    mask = 0
+
+    if ship.left_pressed:
+        mask |= INPUT_LEFT
+    if ship.right_pressed:
+        mask |= INPUT_RIGHT
+    if ship.thrust_pressed:
+        mask |= INPUT_THRUST
+    if ship.shoot_pressed:
+        mask |= INPUT_SHOOT
+    if ship.shield_pressed:
+        mask |= INPUT_SHIELD
+
+    return mask
+
+def set_ship_inputs(ship, mask):
+    ship.left_pressed   = bool(mask & INPUT_LEFT)
+    ship.right_pressed  = bool(mask & INPUT_RIGHT)
+    ship.thrust_pressed = bool(mask & INPUT_THRUST)
+    ship.shoot_pressed  = bool(mask & INPUT_SHOOT)
+    ship.shield_pressed = bool(mask & INPUT_SHIELD)
+
+def frame_bytes(ships_count):
+    return (ships_count * INPUT_BITS + 7) // 8
+
+def state_hash(env):
+    """ 16 hex digits hash of the simulation state: level, frame, ships (position, speed, lives...), shots, debris """
+
+    h = hashlib.blake2b(digest_size=8)
+    h.update(struct.pack("<iq", env.level, env.frames))
+
+    for ship in env.ships:
+        h.update(struct.pack("<9d3i5?", ship.xpos, ship.ypos, ship.xposprecise, ship.yposprecise, ship.vx, ship.vy,
+                             ship.angle, ship.impactx, ship.impacty, ship.lives, ship.explod_tick, len(ship.shots),
+                             ship.explod, ship.game_over, ship.landed, ship.shield, ship.shoot_delay))
+
+        for shot in ship.shots:
+            h.update(struct.pack("<4d", shot.xposprecise, shot.yposprecise, shot.dx, shot.dy))
+
+        for deb in ship.debris:
+            h.update(struct.pack("<2d", deb.xposprecise, deb.yposprecise))
+
+    return h.hexdigest()
+
+# -------------------------------------------------------------------------------------------------
+
+class ReplayWriter():
+
+    def __init__(self, path, header):
+
+        self.path = path
+        self.header = header
+        self.ships_count = header["ships"]
+        self.frame_bytes = frame_bytes(self.ships_count)
+
+        self.file = open(path, "wb")
+
+        header_json = json.dumps(header).encode("utf-8")
+        self.file.write(REPLAY_MAGIC + struct.pack("<HI", REPLAY_VERSION, len(header_json)) + header_json)
+
+        # pending input chunk
+        self.first_frame = 0
+        self.inputs = bytearray()
+        self.count = 0
+
+        self.frames = 0
+
+    def write_chunk(self, kind, payload):
+        self.file.write(kind + struct.pack("<I", len(payload)) + payload)
+
+    def record_frame(self, frame, ships):
+
+        if not self.count:
+            self.first_frame = frame
+
+        mask = 0
+        for i, ship in enumerate(ships[:self.ships_count]):
+            mask |= ship_input_mask(ship) << (i * INPUT_BITS)
+
+        self.inputs += mask.to_bytes(self.frame_bytes, "little")
+        self.count += 1
+        self.frames += 1
+
+        if self.count >= REPLAY_CHUNK_FRAMES:
+            self.flush()
+
+    def record_event(self, frame, event):
+        # the inputs before the event first: chunks are in frame order
+        self.flush()
+        self.write_chunk(CHUNK_EVENT, struct.pack("<I", frame) + json.dumps(event).encode("utf-8"))
+
+    def record_keyframe(self, frame, state):
+        self.flush()
+        self.write_chunk(CHUNK_KEYFRAME, struct.pack("<I", frame) + zlib.compress(json.dumps(state).encode("utf-8")))
+
+    def flush(self):
+        if self.count:
+            self.write_chunk(CHUNK_INPUTS, struct.pack("<II", self.first_frame, self.count) + zlib.compress(bytes(self.inputs)))
+            self.inputs = bytearray()
+            self.count = 0
+
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+# -------------------------------------------------------------------------------------------------
+
+class ReplayReader():
+    """ Lazy reader: only one chunk in memory at a time """
+
+    def __init__(self, path):
+
+        self.path = path
+        self.file = open(path, "rb")
+
+        magic = self.file.read(len(REPLAY_MAGIC))
+        if magic != REPLAY_MAGIC:
+            raise ValueError("%s is not a Mayhem replay" % path)
+
+        version, header_size = struct.unpack("<HI", self.file.read(6))
+        if version > REPLAY_VERSION:
+            raise ValueError("%s: replay version %s not supported (max %s)" % (path, version, REPLAY_VERSION))
+
+        self.version = version
+        self.header = json.loads(self.file.read(header_size).decode("utf-8"))
+        self.ships_count = self.header["ships"]
+        self.frame_bytes = frame_bytes(self.ships_count)
+
+        # start of the chunks
+        self.data_offset = self.file.tell()
+
+        # see index()
+        self.keyframes = None
+        self.last_frame = None
+
+    def chunks(self, offset=None, headers_only=False):
+        """ (kind, payload, chunk offset) from offset (default: first chunk) to the end of the file.
+            headers_only: payload = its first 8 bytes (frame numbers) """
+
+        offset = self.data_offset if offset is None else offset
+        file_size = os.fstat(self.file.fileno()).st_size
+
+        while True:
+            # seek each time: several iterations can be going on (seek while playing)
+            self.file.seek(offset)
+
+            chunk_header = self.file.read(5)
+            if len(chunk_header) < 5:
+                return
+
+            kind = chunk_header[:1]
+            size, = struct.unpack("<I", chunk_header[1:])
+
+            # truncated (crash while writing): stop at the last complete chunk
+            if offset + 5 + size > file_size:
+                return
+
+            payload = self.file.read(min(size, 8) if headers_only else size)
+
+            yield kind, payload, offset
+            offset += 5 + size
+
+    def index(self):
+        """ Reads the chunk headers only: keyframes [(frame, offset)] and the last frame """
+
+        if self.keyframes is None:
+            self.keyframes = []
+            self.last_frame = -1
+
+            for kind, payload, offset in self.chunks(headers_only=True):
+                if kind == CHUNK_KEYFRAME:
+                    frame, = struct.unpack("<I", payload[:4])
+                    self.keyframes.append((frame, offset))
+
+                elif kind == CHUNK_INPUTS:
+                    first_frame, count = struct.unpack("<II", payload[:8])
+                    self.last_frame = first_frame + count - 1
+
+        return self.keyframes
+
+    def keyframe(self, frame):
+        """ (keyframe frame, state, offset) of the last keyframe at or before frame, None if none """
+
+        found = None
+        for keyframe_frame, offset in self.index():
+            if keyframe_frame > frame:
+                break
+            found = keyframe_frame, offset
+
+        if found is None:
+            return None
+
+        for kind, payload, offset in self.chunks(found[1]):
+            return found[0], json.loads(zlib.decompress(payload[4:]).decode("utf-8")), offset
+
+    def frames(self, offset=None):
+        """ Yields (frame, events, masks): the events to apply then the input mask of each ship,
+            from offset (a keyframe offset to resume after a seek) """
+
+        events = {}
+        ship_mask = (1 << INPUT_BITS) - 1
+
+        for kind, payload, _ in self.chunks(offset):
+
+            if kind == CHUNK_EVENT:
+                frame, = struct.unpack("<I", payload[:4])
+                events.setdefault(frame, []).append(json.loads(payload[4:].decode("utf-8")))
+
+            elif kind == CHUNK_INPUTS:
+                first_frame, count = struct.unpack("<II", payload[:8])
+                inputs = zlib.decompress(payload[8:])
+
+                for i in range(count):
+                    frame = first_frame + i
+                    mask = int.from_bytes(inputs[i * self.frame_bytes:(i + 1) * self.frame_bytes], "little")
+                    masks = [(mask >> (ship * INPUT_BITS)) & ship_mask for ship in range(self.ships_count)]
+
+                    yield frame, events.pop(frame, []), masks
+
+    def close(self):
+        self.file.close()
+
+# -------------------------------------------------------------------------------------------------
+
+def turbo_replay(env, render_every=0, hashes_path=""):
+    """ Plays env replay (MayhemEnv(play_recorded=...)) without real time: renders one frame every
+        render_every steps (0: none), writes "frame hash" lines to hashes_path.
+        Returns the summary: frames, seconds, steps/s, final level / hash / ships state """
+
+    hashes = open(hashes_path, "w") if hashes_path else None
+    first_frame = env.frames # after a seek
+    t0 = time.perf_counter()
+
+    try:
+        while env.running:
+
+            if render_every:
+                env.handle_local_events()
+
+            env.step_local()
+
+            # end of the replay: stop_loop() called, no step done
+            if not env.running:
+                break
+
+            if hashes:
+                hashes.write("%s %s\n" % (env.frames, state_hash(env)))
+
+            if render_every and env.frames % render_every == 0:
+                env.render(env.ships, 1.)
+
+    finally:
+        if hashes:
+            hashes.close()
+
+    elapsed = time.perf_counter() - t0
+
+    return {
+        "frames": env.frames,
+        "seconds": elapsed,
+        "steps_per_s": (env.frames - first_frame) / elapsed if elapsed else 0.,
+        "play_seconds": env.frames / env.replay.header["sim_fps"],
+        "level": env.level,
+        "hash": state_hash(env),
+        "ships": [{"xpos": ship.xpos, "ypos": ship.ypos, "lives": ship.lives, "shots": len(ship.shots),
+                   "explod": ship.explod, "game_over": ship.game_over} for ship in env.ships],
+    }
+
+def print_summary(summary):
+    print("Frames= %s (%.1f s of play) in %.2f s, %.0f steps/s" % (summary["frames"], summary["play_seconds"], summary["seconds"], summary["steps_per_s"]))
+    print("Level= %s  Hash= %s" % (summary["level"], summary["hash"]))
+    for i, ship in enumerate(summary["ships"]):
+        print("    ship %s: pos (%s, %s) lives %s shots %s%s%s" % (i + 1, ship["xpos"], ship["ypos"], ship["lives"], ship["shots"],
+              " explod" if ship["explod"] else "", " game_over" if ship["game_over"] else ""))
@@ -0,0 +1,63 @@
+"""
+Per room tick scheduling (server.py): a timer wheel driven by the server base tick, each room is
+due every tick_interval base ticks (its own rate), so a tick only visits the rooms which are due.
+
+    wheel.schedule(room_id, delay)   # due in delay base ticks (1 <= delay < wheel size)
+    wheel.wake(room_id)              # due at the next base tick if it was due later
+    wheel.remove(room_id)            # room deleted
+    for room_id in wheel.advance():  # one base tick: the rooms due now (to be scheduled again)
+        ...
+
+A room with no state change for a while is scheduled at a low rate (keep-alive) and woken up by
+the next input which changes something, see GameServerFactory.tick().
+"""
+
+TICK_WHEEL_SIZE = 256 # base ticks, longer than the longest room tick interval
+
+# -------------------------------------------------------------------------------------------------
+
+class TickWheel():
+
+    def __init__(self, size=TICK_WHEEL_SIZE):
+
+        self.slots = [set() for _ in range(size)]
+        self.tick = 0
+
+        self.due = {} # room_id => base tick
+
+    def __len__(self):
+        return len(self.due)
+
+    def schedule(self, room_id, delay):
+
+        delay = max(1, min(delay, len(self.slots) - 1))
+
+        self.remove(room_id)
+
+        self.due[room_id] = self.tick + delay
+        self.slots[(self.tick + delay) % len(self.slots)].add(room_id)
+
+    def wake(self, room_id):
+        if self.due.get(room_id, self.tick + 2) > self.tick + 1:
+            self.schedule(room_id, 1)
+
+    def remove(self, room_id):
+        due = self.due.pop(room_id, None)
+        if due is not None:
+            self.slots[due % len(self.slots)].discard(room_id)
+
+    def advance(self):
+        """ Next base tick, returns the rooms due (not scheduled anymore) """
+
+        self.tick += 1
+
+        index = self.tick % len(self.slots)
+        rooms = self.slots[index]
+        if not rooms:
+            return rooms
+
+        self.slots[index] = set()
+        for room_id in rooms:
+            del self.due[room_id]
+
+        return rooms
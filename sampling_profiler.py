@@ -0,0 +1,144 @@
+"""
+Sampling profiler: a background thread samples the stack of one thread (default: the main thread)
+every PROFILE_INTERVAL s with sys._current_frames(). The profiled thread is never paused nor traced,
+the overhead does not depend on the number of function calls (unlike cProfile).
+
+The sampler needs the GIL: with the default switch interval (5 ms) it gets it at most every 5 ms
+while the profiled thread runs Python code, or when it releases it (display flip, sleep...), so the
+samples are late and lean toward these calls. switch_interval (opt-in, e.g. PROFILE_SWITCH_INTERVAL)
+lowers the interpreter switch interval while sampling: samples on time, but the profiled thread pays
+the extra GIL switches, which biases the measured costs. Left unset, the interpreter default is kept.
+
+Each sample is tagged with the current game loop stage (stage_source(), e.g. StageTimers.stage):
+the stage is the root frame of the stacks.
+
+Output: collapsed stacks, one line per distinct stack, "frame;frame;frame count", as read by
+flamegraph.pl, inferno, speedscope...
+
+    profiler = SamplingProfiler(lambda: timers.stage)
+    profiler.start()
+    ...
+    profiler.stop()   # writes the file
+"""
+
+import os, sys, time, threading, collections
+
+# -------------------------------------------------------------------------------------------------
+
+PROFILE_INTERVAL = 0.005 # 200 samples/s
+PROFILE_PATH = "mayhem-%Y%m%d-%H%M%S.folded" # time.strftime() format
+PROFILE_MAX_DEPTH = 128
+PROFILE_SWITCH_INTERVAL = 0.0002 # s, when asked for, see above
+
+NO_STAGE = "no_stage"
+
+# -------------------------------------------------------------------------------------------------
+
+def frame_name(code):
+    return "%s (%s:%s)" % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+class SamplingProfiler():
+
+    def __init__(self, stage_source=None, path=PROFILE_PATH, interval=PROFILE_INTERVAL, thread_id=None, switch_interval=None):
+
+        self.stage_source = stage_source
+        self.path = path
+        self.interval = interval
+        self.thread_id = thread_id if thread_id is not None else threading.main_thread().ident
+
+        # (stage, (code, code, ...) root first) => samples
+        self.samples = collections.Counter()
+        self.sample_count = 0
+
+        self.running = False
+        self.thread = None
+        self.started = 0.
+
+        # GIL switch interval while sampling, None: the interpreter one (restored when stopped)
+        self.switch_interval = switch_interval
+        self.saved_switch_interval = None
+
+    def start(self):
+        if self.running:
+            return
+
+        self.samples.clear()
+        self.sample_count = 0
+
+        self.running = True
+        self.started = time.time()
+
+        if self.switch_interval is not None:
+            self.saved_switch_interval = sys.getswitchinterval()
+            sys.setswitchinterval(self.switch_interval)
+
+        self.thread = threading.Thread(target=self.run, name="sampling_profiler", daemon=True)
+        self.thread.start()
+
+        print("Profiler started (%s samples/s)" % int(1. / self.interval))
+
+    def stop(self):
+        """ Stops sampling and writes the collapsed stacks, returns the file path """
+
+        if not self.running:
+            return None
+
+        self.running = False
+        self.thread.join()
+
+        if self.saved_switch_interval is not None:
+            sys.setswitchinterval(self.saved_switch_interval)
+            self.saved_switch_interval = None
+
+        return self.write()
+
+    def toggle(self):
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+
+    def run(self):
+
+        next_sample = time.perf_counter()
+
+        while self.running:
+            self.sample()
+
+            # fixed rate, not drifting with the sampling cost
+            next_sample += self.interval
+            delay = next_sample - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_sample = time.perf_counter()
+
+    def sample(self):
+
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            return
+
+        stage = self.stage_source() if self.stage_source else None
+
+        # code objects only: names are built once per distinct stack, in write()
+        codes = []
+        while frame is not None and len(codes) < PROFILE_MAX_DEPTH:
+            codes.append(frame.f_code)
+            frame = frame.f_back
+        codes.reverse()
+
+        self.samples[(stage or NO_STAGE, tuple(codes))] += 1
+        self.sample_count += 1
+
+    def write(self):
+
+        path = time.strftime(self.path, time.localtime(self.started))
+
+        with open(path, "w") as f:
+            for (stage, codes), count in self.samples.most_common():
+                f.write("%s;%s %s\n" % (stage, ";".join(frame_name(code) for code in codes), count))
+
+        print("Profiler stopped: %s samples (%.1f s) written to %s" % (self.sample_count, time.time() - self.started, path))
+
+        return path
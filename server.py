@@ -1,16 +1,62 @@
-import sys, json, threading, enum, queue, argparse
+import os, sys, json, time, heapq, signal, threading, queue, argparse
 
 from twisted.internet import reactor
 from twisted.internet import task
+from twisted.internet import stdio
+from twisted.internet.protocol import Protocol, ProcessProtocol
 from twisted.python import log
+from twisted.web import server as web_server, resource
 
 from autobahn.exception import Disconnected
 from autobahn.twisted.websocket import WebSocketServerFactory, WebSocketServerProtocol, listenWS
+from autobahn.websocket.types import ConnectionDeny
+from autobahn.websocket.util import parse_url
 
 import msgpack
 
+from game_protocol import Action, PROTOCOL_VERSION
+from sampling_profiler import SamplingProfiler, PROFILE_SWITCH_INTERVAL
+from matchmaking import RoomIndex, shard_of
+from room_scheduler import TickWheel, TICK_WHEEL_SIZE
+from server_metrics import Metrics, METRICS_PERIOD, SERVER_METRICS, LOBBY_METRICS, prometheus_text
+from tick_costs import TickCosts, DECODE, RELAY, ENCODE, SEND, STAGES, cost_text
+
 DEBUG_PRINT = 0
 
+QUEUE_STATS_PERIOD = 10 # s between two queue stats logs (only if updates were dropped)
+
+TICK_REPORT_PERIOD = 10 # s between two tick overrun reports (only if base ticks overran or were skipped)
+TICK_REPORT_TOP = 3 # most expensive rooms and players logged
+
+# base tick: the highest room tick rate. Rooms with less than 2 players, or whose ships state did not change
+# for ROOM_IDLE_AFTER s (landed, game over...), are ticked at the idle rate until an input changes something
+TICK_RATE = 60 # Hz
+ROOM_RATE = 60 # Hz, default room tick rate
+ROOM_IDLE_RATE = 2 # Hz
+ROOM_IDLE_AFTER = 0.5 # s
+
+# lowest tick rate: a room tick interval must fit in the tick wheel
+MIN_ROOM_RATE = TICK_RATE / (TICK_WHEEL_SIZE - 1) # Hz
+
+# slow connections: past SEND_BUDGET bytes waiting in its send buffer, the ship updates for a connection wait in
+# its queue (only the newest one of each ship) until the buffer drains; dropped if over it for SEND_STALL_TIMEOUT s
+SEND_BUDGET = 32 * 1024 # bytes, about 1 s of updates
+SEND_STALL_TIMEOUT = 5 # s
+
+# per connection and admission limits (a sharded server: per worker), name, default, help (--name option)
+LIMITS = [
+    ("max_messages_per_s", 120,  "Messages per second received from a connection (bursts up to 1 s of them), the others are dropped"),
+    ("max_message_bytes",  4096, "Larger messages close the connection, before they are buffered or decoded"),
+    ("max_shots",          32,   "PLAYER_UPDATE messages with more shots are dropped (the game fires at most 20)"),
+    ("max_connections",    1000, "Open connections, the next ones are refused at the websocket handshake (HTTP 503)"),
+    ("max_rooms",          250,  "Rooms, a login which needs a new room is denied"),
+]
+DEFAULT_LIMITS = {name: value for name, value, _ in LIMITS}
+
+RATE_LIMIT_CLOSE_AFTER = 5 # s worth of messages dropped by max_messages_per_s, without the bucket refilling in between, before the connection is dropped
+
+WORKER_RESPAWN_DELAY = 1 # s before a sharded server restarts a worker which exited
+
 # -------------------------------------------------------------------------------------------------
 
 from functools import wraps
@@ -40,24 +86,127 @@ def synchronized( tlockname ):
 
 # -------------------------------------------------------------------------------------------------
 
-class Action(str, enum.Enum):
+# actions whose payload the server reads: it must be a dict
+DICT_PAYLOAD_ACTIONS = (Action.LOGIN, Action.PLAYER_UPDATE)
 
-    PLAY        = enum.auto()
-    LOGIN_OK    = enum.auto()
-    LOGIN_DENY  = enum.auto()
-    LOGIN       = enum.auto()
-    EXITED      = enum.auto()
+def decode_message(payload):
+    """ {"a":action, "p":payload} from the msgpack bytes, None if malformed """
+
+    try:
+        msg = msgpack.unpackb(payload, raw=False)
 
-    PLAYER_UPDATE = enum.auto()
-    PLAYER_UPDATE_REQUEST = enum.auto()
+        if not isinstance(msg, dict) or "p" not in msg:
+            return None
 
-    OTHER_PLAYER_UPDATE = enum.auto()
+        action = Action(msg["a"])
+        if action in DICT_PAYLOAD_ACTIONS and not isinstance(msg["p"], dict):
+            return None
+
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return None
+
+    return msg
+
+def check_rate(rate):
+    """ A room tick rate (Hz) the tick wheel can schedule, ValueError otherwise """
+
+    if not MIN_ROOM_RATE <= rate <= TICK_RATE:
+        raise ValueError("tick rate %s Hz out of range: %.4f to %s Hz" % (rate, MIN_ROOM_RATE, TICK_RATE))
+
+    return rate
+
+def rate_option(value):
+    """ argparse type of the --room_rate / --idle_rate options """
+
+    try:
+        return check_rate(float(value))
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def login_room_id(p):
+    """ Room requested by a LOGIN payload: int id, name, or None for the first room with space """
+
+    room_id = None
+    try:
+        room_id = int(p["room_id"])
+    except:
+        try:
+            room_id = p["room_id"]
+        except:
+            pass
 
-    SERVER_STAT_REGISTER = enum.auto()
-    SERVER_STAT_OK = enum.auto()
-    SERVER_STAT_UPDATE = enum.auto()
+    # 0, "", None means give me the first room where there is space
+    if room_id in (0, "0", "", "None", "none"):
+        room_id = None
 
-    OTHER_PLAYER_DISCONNECT = enum.auto()
+    return room_id
+
+def login_version_ok(player, p):
+    """ Clients of another protocol version would not understand our messages: denied """
+
+    if p.get("version") == PROTOCOL_VERSION:
+        return True
+
+    print(f"Player {player.peer} denied: protocol version {p.get('version')}, expected {PROTOCOL_VERSION}")
+
+    msg = {"a":Action.LOGIN_DENY, "p":"Protocol version %s required, please update the game" % PROTOCOL_VERSION}
+    player.sendMessage(msgpack.packb(msg, use_bin_type=True), isBinary=True)
+    return False
+
+# transport classes without the twisted TCP buffers (TLS, another twisted release...), warned once
+UNMEASURED_TRANSPORTS = set()
+
+def send_buffer_size(player):
+    """ Bytes written to the connection and not sent yet (twisted TCP transport buffers, private),
+    0 if the transport has none we can read """
+
+    transport = player.transport
+    if transport is None:
+        return 0
+
+    try:
+        return len(transport.dataBuffer) - transport.offset + transport._tempDataLen
+    except AttributeError:
+        transport_class = type(transport)
+        if transport_class not in UNMEASURED_TRANSPORTS:
+            UNMEASURED_TRANSPORTS.add(transport_class)
+            print(f"Send buffers of {transport_class.__name__} transports cannot be read: "
+                  f"no send_buffer metrics and no SEND_BUDGET for their slow clients")
+        return 0
+
+def admit_connection(protocol, prefix=""):
+    """ onConnect(): refuses the websocket handshake once the server has max_connections open (prefix: lobby metrics) """
+
+    metrics = protocol.factory.metrics
+    if metrics.values[prefix + "connections"] >= protocol.factory.limits["max_connections"]:
+        metrics.inc(prefix + "connections_denied_total")
+        raise ConnectionDeny(ConnectionDeny.SERVICE_UNAVAILABLE, "Server full")
+
+def set_message_limit(factory, limit):
+    """ Messages (and frames) over limit bytes fail the connection (close code 1009) as soon as their header is read """
+    factory.setProtocolOptions(maxMessagePayloadSize=limit, maxFramePayloadSize=limit)
+
+class MetricsResource(resource.Resource):
+    """ GET /metrics (any path): Prometheus text """
+
+    isLeaf = True
+
+    def __init__(self, text_source):
+        super().__init__()
+        self.text_source = text_source
+
+    def render_GET(self, request):
+        request.setHeader(b"content-type", b"text/plain; version=0.0.4; charset=utf-8")
+        return self.text_source().encode("utf8")
+
+def listen_metrics(port, text_source):
+    """ Local HTTP endpoint for the metrics scrapers """
+
+    site = web_server.Site(MetricsResource(text_source))
+    site.log = lambda request: None # not one log line per scrape
+
+    reactor.listenTCP(port, site, interface="127.0.0.1")
+    print("Metrics on http://127.0.0.1:%s/metrics" % port)
 
 # -------------------------------------------------------------------------------------------------
 
@@ -69,47 +218,115 @@ class PlayerProtocol(WebSocketServerProtocol):
         self.room_id = None
         self.ship_nb = None
 
+        # last PLAYER_UPDATE received without its seq, see state_changed()
+        self.last_state = None
+
+        # packet queue depth at the last tick, max depth since the last metrics period
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+
+        # updates waiting for our send buffer to drain: ship_nb => (prepared message, payload size), latest wins
+        self.pending_updates = {}
+        self.over_budget_since = None
+
+        # max_messages_per_s token bucket, messages dropped by it since it was last full
+        self.allowance = 0.
+        self.allowance_time = 0.
+        self.rate_limited = 0
+
+        self.opened = False
+
+    def onConnect(self, request):
+        admit_connection(self)
+
     def onOpen(self):
         print(f"Player {self.peer} connected")
 
         self.packet_queue = queue.Queue()
         self._state = self.NOP # used only to get the server state
+
+        self.allowance = self.factory.limits["max_messages_per_s"]
+        self.allowance_time = time.perf_counter()
+
+        self.opened = True
+        self.factory.metrics.inc("connections")
         
     # a player quits, we remove it
     def onClose(self, wasClean, code, reason):
+        if self.opened:
+            self.factory.metrics.inc("connections", -1)
+
+        if self.wasMaxMessagePayloadSizeExceeded:
+            print(f"Player {self.peer} dropped: message over {self.factory.limits['max_message_bytes']} bytes")
+            self.factory.metrics.inc("messages_too_big_total")
+
+        self.factory.del_watcher(self)
         self.factory.del_player(self)
 
+        self.pending_updates.clear()
+        self.factory.backlogged.discard(self)
+
+    def sendMessage(self, payload, *args, **kwargs):
+        self.factory.metrics.inc("messages_out_total")
+        self.factory.metrics.inc("bytes_out_total", len(payload))
+
+        super().sendMessage(payload, *args, **kwargs)
+
     # message received from a player 
     def onMessage(self, payload, isBinary):
 
-        msg = msgpack.unpackb(payload, raw=False)
+        self.factory.stage = "message"
+        try:
+            self.process_message(payload)
+        finally:
+            self.factory.stage = None
+
+    def process_message(self, payload):
+
+        self.factory.metrics.inc("messages_in_total")
+        self.factory.metrics.inc("bytes_in_total", len(payload))
+
+        if not self.within_rate_limit():
+            return
+
+        started = time.perf_counter()
+        msg = self.decode(payload)
+
+        # charged to our room once we play in it
+        room_id = self.room_id if self._state == self.PLAY else None
+        self.factory.costs.add(room_id, self, DECODE, time.perf_counter() - started)
+        self.factory.costs.count_message(room_id, self)
+
+        if msg is None:
+            return
 
         if DEBUG_PRINT:
             print("Received action=%s, payload=%s, from: %s" % (Action(msg["a"]), msg["p"], self.peer))
 
         # A player wants to connect, we add it here to the player list 
         #     so that tick() can be called for this player
-        if msg["a"] == Action.LOGIN:
+        #     A connection plays in one room: another LOGIN would leave it a member of its current room
+        if msg["a"] == Action.LOGIN and self._state == self.PLAY:
+            self.factory.metrics.inc("logins_repeated_total")
+
+        elif msg["a"] == Action.LOGIN:
 
             p = msg["p"]
-            try:
-                self.room_id = int(p["room_id"])
-            except:
-                try:
-                    self.room_id = p["room_id"]
-                except:
-                    pass
-            
-            # 0, "", None means give me the first room where there is space
-            #   this is done by setting self.room_id to None
-            if self.room_id in (0, "0", "", "None", "none"):
-                self.room_id = None
+            room_id = self.room_id
+            self.room_id = login_room_id(p)
 
             print("room_id=", self.room_id)
 
+            if not login_version_ok(self, p):
+                self.room_id = room_id
+                return
+
             success = self.factory.add_player(self)
             if success:
                 self._state = self.PLAY
+                self.factory.metrics.inc("logins_total")
+            else:
+                self.room_id = room_id # denied: still a member of its room, if any
 
         elif msg["a"] == Action.SERVER_STAT_REGISTER:
             self.factory.add_watcher(self)
@@ -118,10 +335,77 @@ class PlayerProtocol(WebSocketServerProtocol):
             self.sendMessage(msgpack.packb(msg, use_bin_type=True), isBinary=True)
 
         # Other actions are put into the action queue, and going to be processed
-        #     into the tick() function
-        else:
+        #     into the tick() function (an idle room is woken up when our ship state changes).
+        #     Only a room tick drains the queue: outside a room (not logged in, watcher, denied) they are dropped
+        elif self._state == self.PLAY:
+            if msg["a"] == Action.PLAYER_UPDATE and self.state_changed(msg["p"]):
+                self.factory.wake_room(self.room_id)
+
             self.add_packet(self, msg)
 
+        else:
+            self.factory.metrics.inc("messages_not_playing_total")
+
+    def within_rate_limit(self):
+        """ max_messages_per_s token bucket, checked before decoding: a flood is dropped, then the connection """
+
+        limit = self.factory.limits["max_messages_per_s"]
+
+        now = time.perf_counter()
+        self.allowance = min(limit, self.allowance + (now - self.allowance_time) * limit)
+        self.allowance_time = now
+
+        # bucket refilled: the previous drops were a burst (lag spike...), not a flood
+        if self.allowance >= limit:
+            self.rate_limited = 0
+
+        if self.allowance >= 1:
+            self.allowance -= 1
+            return True
+
+        self.rate_limited += 1
+        self.factory.metrics.inc("messages_rate_limited_total")
+
+        if self.rate_limited >= limit * RATE_LIMIT_CLOSE_AFTER and self.state == WebSocketServerProtocol.STATE_OPEN:
+            print(f"Player {self.peer} dropped: over {limit} messages/s")
+            self.factory.metrics.inc("rate_limit_disconnects_total")
+            self.dropConnection(abort=True)
+
+        return False
+
+    def decode(self, payload):
+        """ The message, None if it is malformed or over the limits """
+
+        msg = decode_message(payload)
+        if msg is None:
+            self.factory.metrics.inc("messages_invalid_total")
+            return None
+
+        if msg["a"] == Action.PLAYER_UPDATE:
+            try:
+                shots = len(msg["p"].get("shots", ()))
+            except TypeError:
+                self.factory.metrics.inc("messages_invalid_total")
+                return None
+
+            if shots > self.factory.limits["max_shots"]:
+                self.factory.metrics.inc("shots_limited_total")
+                return None
+
+        return msg
+
+    def state_changed(self, update):
+        """ Is this PLAYER_UPDATE different from the previous one (besides its seq) """
+
+        state = dict(update)
+        state.pop("seq", None)
+
+        if state == self.last_state:
+            return False
+
+        self.last_state = state
+        return True
+
     def add_packet(self, sender, msg):
         self.packet_queue.put((sender, msg))
 
@@ -139,73 +423,365 @@ class PlayerProtocol(WebSocketServerProtocol):
     def tick(self):
         #print("tick called for %s" % self)
 
-        # Process the next packet in the queue
-        if not self.packet_queue.empty():
-            t = self.packet_queue.get()
+        # the encode / send of our updates are charged to us, the rest of the tick is the relay cost
+        costs = self.factory.costs
+        costs.owner = (self.room_id, self)
+        started = time.perf_counter()
+        charged = costs.charged
+
+        # Process all the packets received since the last tick: a relayed update is at most one tick late
+        packets = []
+        while True:
+            try:
+                packets.append(self.packet_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        self.queue_depth = len(packets)
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+
+        # only the newest PLAYER_UPDATE of each sender is relayed, the older ones are superseded
+        newest_update = {}
+        for i, (sender, msg) in enumerate(packets):
+            if msg["a"] == Action.PLAYER_UPDATE:
+                newest_update[sender] = i
+
+        dropped = 0
+        for i, t in enumerate(packets):
+            sender, msg = t
+            if msg["a"] == Action.PLAYER_UPDATE and newest_update[sender] != i:
+                dropped += 1
+                continue
+
             #print(self._state, t)
             self._state(*t)
 
-        if self._state == self.PLAY:
-            if DEBUG_PRINT:
-                print("Request player update for %s" % self)
+        if dropped:
+            self.factory.metrics.inc("updates_dropped_total", dropped)
 
-            # request player update
-            msg = {"a":Action.PLAYER_UPDATE_REQUEST, "p":"PLAYER_UPDATE_REQUEST"}
-            try:
-                self.sendMessage(msgpack.packb(msg, use_bin_type=True), isBinary=True)
-            except Disconnected:
-                print("Could not send %s, client disconnected" % msg)
+        costs.owner = None
+        costs.add(self.room_id, self, RELAY, time.perf_counter() - started - (costs.charged - charged))
 
 # -------------------------------------------------------------------------------------------------
 
 class GameServerFactory(WebSocketServerFactory):
 
-    def __init__(self, url):
+    def __init__(self, url, shard=0, shard_count=1, room_rate=ROOM_RATE, idle_rate=ROOM_IDLE_RATE, limits=DEFAULT_LIMITS):
         WebSocketServerFactory.__init__(self, url)
 
-        # { room_id : {"ships":[1, 2, 3, 4], "players":[] }
+        self.limits = limits
+        set_message_limit(self, limits["max_message_bytes"])
+
+        # { room_id : {"ships":[1, 2, 3, 4], "players":[], "tick_interval":1, "changed":tick } }
+        #   "ships": free ships heap, "tick_interval": base ticks between two room ticks, "changed": base tick of the last state change
         self.rooms = {}
+        self.player_count = 0
+
+        # rooms with a free ship, released room ids (worker of a sharded server: only the ids of its shard)
+        self.room_index = RoomIndex(shard + 1, shard_count)
+
+        # worker of a sharded server: called with load() when a player joins or leaves, with the metrics values each period
+        self.load_listener = None
+        self.metrics_listener = None
 
         self.add_player_lock = threading.Lock()
         self.del_player_lock = threading.Lock()
 
-        tickloop = task.LoopingCall(self.tick)
-        tickloop.start(1 / 60.)
-
-        # server status
+        # server status: metrics and rooms changed since the last watchers update
         self.server_watchers = []
+        self.metrics = Metrics()
+        self.dirty_rooms = set()
+        self.tick_max = 0.
+        self.published = time.perf_counter()
+
+        # time spent per room / player, base ticks over their period or skipped since the last report
+        self.costs = TickCosts()
+        self.overruns = 0
+        self.skipped_ticks = 0
+        self.report_tick_max = 0.
+
+        # players with pending updates (send buffer over SEND_BUDGET)
+        self.backlogged = set()
+
+        # rooms due at each base tick
+        self.tick_wheel = TickWheel()
+        self.room_tick_interval = self.tick_interval(room_rate)
+        self.idle_tick_interval = self.tick_interval(idle_rate)
+        self.idle_after_ticks = round(ROOM_IDLE_AFTER * TICK_RATE)
+
+        # called with the number of tick periods since the previous call: more than 1 when the loop is late
+        tickloop = task.LoopingCall.withCount(self.tick)
+        tickloop.start(1. / TICK_RATE)
+
+        metricsloop = task.LoopingCall(self.publish_metrics)
+        metricsloop.start(METRICS_PERIOD, now=False)
+
+        self.reported_dropped_updates = 0
+        statsloop = task.LoopingCall(self.log_queue_stats)
+        statsloop.start(QUEUE_STATS_PERIOD, now=False)
+
+        reportloop = task.LoopingCall(self.log_tick_costs)
+        reportloop.start(TICK_REPORT_PERIOD, now=False)
+
+        # what the reactor thread is doing (profiler samples tag), None: waiting for IO
+        self.stage = None
+        self.profiler = SamplingProfiler(lambda: self.stage, path="server-%Y%m%d-%H%M%S.folded")
+
+    def send_to_all(self, clients, msg, ship_nb=None):
+        """ Packs msg and builds its websocket frame once, then sends the same bytes to each client
+
+        ship_nb: msg is the state of this ship, a client over its send budget only keeps the newest one """
+
+        if not clients:
+            return
+
+        started = time.perf_counter()
+        payload = msgpack.packb(msg, use_bin_type=True)
+        prepared = self.prepareMessage(payload, isBinary=True)
+        encoded = time.perf_counter()
+
+        sent = 0
+        for client in clients:
+            # sendPreparedMessage() does not raise Disconnected
+            if client.state != WebSocketServerProtocol.STATE_OPEN:
+                print("Could not send %s, %s disconnected" % (msg["a"], client.peer))
+                continue
+
+            # an older update of this ship still waiting must not be sent after this one
+            if ship_nb is not None and (ship_nb in client.pending_updates or send_buffer_size(client) >= SEND_BUDGET):
+                if ship_nb in client.pending_updates:
+                    self.metrics.inc("updates_coalesced_total")
+
+                client.pending_updates[ship_nb] = (prepared, len(payload))
+                self.backlogged.add(client)
+                continue
+
+            client.sendPreparedMessage(prepared)
+            sent += 1
+
+        self.costs.add_owned(ENCODE, encoded - started)
+        self.costs.add_owned(SEND, time.perf_counter() - encoded)
+
+        self.metrics.inc("messages_out_total", sent)
+        self.metrics.inc("bytes_out_total", sent * len(payload))
+
+    def flush_pending_updates(self):
+        """ Sends the pending updates of the players whose send buffer drained under the budget """
+
+        started = time.perf_counter()
+
+        for client in list(self.backlogged):
+            if client.state != WebSocketServerProtocol.STATE_OPEN:
+                client.pending_updates.clear()
+
+            while client.pending_updates and send_buffer_size(client) < SEND_BUDGET:
+                ship_nb = next(iter(client.pending_updates))
+                prepared, size = client.pending_updates.pop(ship_nb)
+
+                client.sendPreparedMessage(prepared)
+                self.metrics.inc("messages_out_total")
+                self.metrics.inc("bytes_out_total", size)
+
+            if not client.pending_updates:
+                self.backlogged.discard(client)
+
+        self.costs.add_owned(SEND, time.perf_counter() - started)
+
+    def check_send_budget(self, client, size, now):
+        """ Drops a connection whose send buffer stayed over the budget for SEND_STALL_TIMEOUT """
+
+        if size < SEND_BUDGET:
+            client.over_budget_since = None
+            return
+
+        if client.over_budget_since is None:
+            client.over_budget_since = now
+
+        elif now - client.over_budget_since > SEND_STALL_TIMEOUT and client.state == WebSocketServerProtocol.STATE_OPEN:
+            print("Dropping %s: %s bytes not sent for %.0f s" % (client.peer, size, now - client.over_budget_since))
+
+            self.metrics.inc("slow_disconnects_total")
+            client.dropConnection(abort=True)
+
+    # server status update: room_id joined / left by a player
+    def server_status_update(self, room_id):
+        if self.load_listener:
+            self.load_listener(self.load())
+
+        self.dirty_rooms.add(room_id)
+
+    def load(self):
+        return {"players":self.player_count, "rooms":len(self.rooms), "free_rooms":self.room_index.free_room_count()}
+
+    def room_ships(self, room_id):
+        """ Ships taken in a room, None if it does not exist """
+
+        room = self.rooms.get(room_id)
+        if room is None:
+            return None
+
+        return sorted(player.ship_nb for player in room["players"])
+
+    def log_room(self, room_id):
+        print("Room %s: ships %s (%s rooms, %s players)" % (room_id, self.room_ships(room_id), len(self.rooms), self.player_count))
+
+    def publish_metrics(self):
+        """ Gauges and rates of the last period, then the changes to the watchers """
+
+        now = time.perf_counter()
+
+        queue_depth_max = send_buffer_bytes = send_buffer_max_bytes = 0
+        for room in self.rooms.values():
+            for player in room["players"]:
+                queue_depth_max = max(queue_depth_max, player.max_queue_depth)
+                player.max_queue_depth = 0
+
+                size = send_buffer_size(player)
+                send_buffer_bytes += size
+                send_buffer_max_bytes = max(send_buffer_max_bytes, size)
+
+                self.check_send_budget(player, size, now)
 
-    # server status update
-    def server_status_update(self):
         for watcher in self.server_watchers:
-                
-            msg = {"a":Action.SERVER_STAT_UPDATE, "p":{"state":repr(self.rooms)}}
-            try:
-                watcher.sendMessage(msgpack.packb(msg, use_bin_type=True), isBinary=True)
-            except Disconnected:
-                print("Could not send %s, watcher disconnected" % msg)
+            self.check_send_budget(watcher, send_buffer_size(watcher), now)
+
+        self.metrics.set("rooms", len(self.rooms))
+        self.metrics.set("players", self.player_count)
+        self.metrics.set("queue_depth_max", queue_depth_max)
+        self.metrics.set("send_buffer_bytes", send_buffer_bytes)
+        self.metrics.set("send_buffer_max_bytes", send_buffer_max_bytes)
+        self.metrics.set("backlogged_connections", len(self.backlogged))
+        self.metrics.set("tick_seconds_max", round(self.tick_max, 6))
+        for stage in STAGES:
+            self.metrics.set("%s_seconds_total" % stage, round(self.costs.totals[stage], 6))
+        self.metrics.update_rates(now - self.published)
+
+        self.tick_max = 0.
+        self.published = now
+
+        if self.metrics_listener:
+            self.metrics_listener(self.metrics.values)
+
+        self.update_watchers()
+
+    def update_watchers(self):
+        """ Only what changed since the last update """
+
+        delta = {"metrics":self.metrics.delta(), "rooms":[[room_id, self.room_ships(room_id)] for room_id in self.dirty_rooms]}
+        self.dirty_rooms.clear()
+
+        if self.server_watchers:
+            self.send_to_all(self.server_watchers, {"a":Action.SERVER_STAT_UPDATE, "p":delta})
+
+    def metrics_text(self):
+        return prometheus_text(SERVER_METRICS, [({}, self.metrics.values)])
+
+    def log_queue_stats(self):
+        dropped = self.metrics.values["updates_dropped_total"]
+
+        if dropped != self.reported_dropped_updates:
+            self.reported_dropped_updates = dropped
+            print("Packet queues: max depth %s, superseded updates dropped %s" % (self.metrics.values["queue_depth_max"], dropped))
+
+    def log_tick_costs(self):
+        """ The most expensive rooms and players of the period, if the tick loop could not keep up """
+
+        if self.overruns or self.skipped_ticks:
+            print("Tick loop: %s ticks over %.1f ms, %s ticks skipped in the last %s s (longest tick %.1f ms)" %
+                  (self.overruns, 1000. / TICK_RATE, self.skipped_ticks, TICK_REPORT_PERIOD, self.report_tick_max * 1000))
+
+            for room_id, cost in self.costs.top_rooms(TICK_REPORT_TOP):
+                print("    room %s: %s" % (room_id, cost_text(cost)))
+
+            for player, cost in self.costs.top_players(TICK_REPORT_TOP):
+                room_id, ship_nb = self.costs.player_info[player]
+                print("    player %s (room %s, ship #%s): %s" % (player.peer, room_id, ship_nb, cost_text(cost)))
+
+        self.overruns = 0
+        self.skipped_ticks = 0
+        self.report_tick_max = 0.
+        self.costs.reset()
 
     def add_watcher(self, watcher):
+
+        # the other watchers get the changes up to now, the new one gets everything
+        self.update_watchers()
+
         if watcher not in self.server_watchers:
             self.server_watchers.append(watcher)
 
-        # initial status
-        msg = {"a":Action.SERVER_STAT_UPDATE, "p":{"state":repr(self.rooms)}}
-        try:
-            watcher.sendMessage(msgpack.packb(msg, use_bin_type=True), isBinary=True)
-        except Disconnected:
-            print("Could not send %s, watcher disconnected" % msg)
+        status = {"metrics":dict(self.metrics.values), "rooms":[[room_id, self.room_ships(room_id)] for room_id in self.rooms]}
+
+        # prepared: sendMessage() refuses messages over max_message_bytes, the status of a busy server can be
+        self.send_to_all([watcher], {"a":Action.SERVER_STAT_UPDATE, "p":status})
 
     def del_watcher(self, watcher):
         if watcher in self.server_watchers:
             self.server_watchers.remove(watcher)
 
-    # player update
-    def tick(self):
-        for room_id in self.rooms:
-            for player in self.rooms[room_id]["players"]:
+    def tick_interval(self, rate):
+        """ Base ticks between two ticks at rate Hz """
+        return round(TICK_RATE / check_rate(rate))
+
+    def set_room_rate(self, room_id, rate):
+        self.rooms[room_id]["tick_interval"] = self.tick_interval(rate)
+
+    def create_room(self, room_id):
+        self.rooms[room_id] = {"ships":[2, 3, 4], "players":[], "tick_interval":self.room_tick_interval, "changed":self.tick_wheel.tick}
+        self.room_index.add_room(room_id)
+        self.tick_wheel.schedule(room_id, 1)
+
+    def wake_room(self, room_id):
+        """ State change in the room: back to its tick rate, from the next base tick """
+
+        room = self.rooms.get(room_id)
+        if room is None:
+            return
+
+        room["changed"] = self.tick_wheel.tick
+
+        # alone in the room: nothing to relay
+        if len(room["players"]) > 1:
+            self.tick_wheel.wake(room_id)
+
+    # player update, count: tick periods elapsed since the previous tick (LoopingCall.withCount)
+    def tick(self, count=1):
+        self.stage = "tick"
+        started = time.perf_counter()
+
+        if self.backlogged:
+            self.flush_pending_updates()
+
+        due = self.tick_wheel.advance()
+        for room_id in due:
+            room = self.rooms[room_id]
+
+            for player in room["players"]:
                 player.tick()
 
+            if len(room["players"]) < 2 or self.tick_wheel.tick - room["changed"] > self.idle_after_ticks:
+                self.tick_wheel.schedule(room_id, self.idle_tick_interval)
+            else:
+                self.tick_wheel.schedule(room_id, room["tick_interval"])
+
+        duration = time.perf_counter() - started
+        self.tick_max = max(self.tick_max, duration)
+        self.report_tick_max = max(self.report_tick_max, duration)
+
+        # the rooms are ticked once anyway (they are ticked less often while the server is overloaded)
+        skipped = count - 1
+        overrun = duration > 1. / TICK_RATE
+        self.skipped_ticks += skipped
+        self.overruns += overrun
+
+        self.metrics.inc("ticks_total")
+        self.metrics.inc("room_ticks_total", len(due))
+        self.metrics.inc("tick_seconds_total", duration)
+        self.metrics.inc("ticks_skipped_total", skipped)
+        self.metrics.inc("tick_overruns_total", overrun)
+
+        self.stage = None
+
     @synchronized('del_player_lock')
     def del_player(self, player):
 
@@ -213,78 +789,81 @@ class GameServerFactory(WebSocketServerFactory):
         if player.room_id:
             try:
                 self.rooms[player.room_id]["players"].remove(player)
-                self.rooms[player.room_id]["ships"].insert(0, player.ship_nb) # added back new freed ship into the avaible ship list
-                self.rooms[player.room_id]["ships"].sort()
+                self.player_count -= 1
+                heapq.heappush(self.rooms[player.room_id]["ships"], player.ship_nb) # added back new freed ship into the avaible ship list
 
                 print(f"Removed player {player} (using ship #{player.ship_nb}) from room {player.room_id}")
 
                 # no player left => remove the room
                 if not self.rooms[player.room_id]["players"]:
                     del self.rooms[player.room_id]
+                    self.room_index.remove_room(player.room_id)
+                    self.tick_wheel.remove(player.room_id)
                     print(f"Room {player.room_id} is empty, remove it")
                 else:
-                    # warn the other players in the room that we disconnected
-                    for ply in self.rooms[player.room_id]["players"]:
-                        msg = {"a":Action.OTHER_PLAYER_DISCONNECT, "p":player.ship_nb}
-                        try:
-                            ply.sendMessage(msgpack.packb(msg, use_bin_type=True), isBinary=True)   
-                        except Disconnected:
-                            print("Could not send %s, client disconnected" % msg)
+                    self.room_index.set_free(player.room_id, True)
+                    self.wake_room(player.room_id)
+
+                    # warn the other players in the room that we disconnected (a pending update would bring our ship back)
+                    for other in self.rooms[player.room_id]["players"]:
+                        other.pending_updates.pop(player.ship_nb, None)
+
+                    msg = {"a":Action.OTHER_PLAYER_DISCONNECT, "p":player.ship_nb}
+                    self.send_to_all(self.rooms[player.room_id]["players"], msg)
                 
             except Exception as e:
                 print("Failed to remove %s : %s" % (repr(player), repr(e)))
                 
-            self.server_status_update()
-
-            print("ROOMS=", self.rooms)
+            self.server_status_update(player.room_id)
+            self.log_room(player.room_id)
 
     @synchronized('add_player_lock')
     def add_player(self, player):
 
-        print("ROOMS=", self.rooms)
-
         # requested player.room_id is not None, we find the first room where there is a ship available
         #    if no place left, we create a new room for the new player
         if player.room_id is None:
 
             print("Player did not request a specific room")
 
-            for a_room in self.rooms:
-                if len(self.rooms[a_room]["ships"]) > 0:
+            a_room = self.room_index.first_free_room()
+            if a_room is not None:
 
-                    ship = self.rooms[a_room]["ships"].pop(0) # first ship available in ships list
+                ship = heapq.heappop(self.rooms[a_room]["ships"]) # first ship available in ships list
+                self.room_index.set_free(a_room, len(self.rooms[a_room]["ships"]) > 0)
 
-                    self.rooms[a_room]["players"].append(player)
-                    player.room_id = a_room
-                    player.ship_nb = ship
-                    
-                    print(f"Found space left: assigned ship #{ship} in room {a_room} to player {player}")
+                self.rooms[a_room]["players"].append(player)
+                self.player_count += 1
+                self.wake_room(a_room)
+                player.room_id = a_room
+                player.ship_nb = ship
+                
+                print(f"Found space left: assigned ship #{ship} in room {a_room} to player {player}")
 
-                    msg = {"a":Action.LOGIN_OK, "p": {"ship_nb":player.ship_nb, "room_id":player.room_id}}
-                    try:
-                        player.sendMessage(msgpack.packb(msg, use_bin_type=True), isBinary=True)    
-                    except Disconnected:
-                        print("Could not send %s, client disconnected" % msg)
+                msg = {"a":Action.LOGIN_OK, "p": {"ship_nb":player.ship_nb, "room_id":player.room_id}}
+                try:
+                    player.sendMessage(msgpack.packb(msg, use_bin_type=True), isBinary=True)    
+                except Disconnected:
+                    print("Could not send %s, client disconnected" % msg)
                 
-                    self.server_status_update()
-                    print("ROOMS=", self.rooms)
-                    return True
+                self.server_status_update(a_room)
+                self.log_room(a_room)
+                return True
                 
-            # if we are here this means no place left anywhere, we create a new room (id = start from 1 and inc)
-            new_room = 1
-            while 1:
-                if new_room in self.rooms:
-                   new_room += 1
-                else:
-                    break
+            # if we are here this means no place left anywhere, we create a new room (smallest unused id, from 1)
+            if self.rooms_full(player):
+                return False
+
+            new_room = self.room_index.new_room_id(self.rooms)
 
             # create the room
             print(f"Created room {new_room}")
 
-            self.rooms[new_room] = {"ships":[2, 3, 4], "players":[]}
+            self.create_room(new_room)
 
             # add the player into the room and assign it ship #1
             self.rooms[new_room]["players"].append(player)
+            self.player_count += 1
             player.room_id = new_room
             player.ship_nb = 1
 
@@ -297,8 +876,8 @@ class GameServerFactory(WebSocketServerFactory):
             except Disconnected:
                 print("Could not send %s, client disconnected" % msg)
         
-            self.server_status_update()
-            print("ROOMS=", self.rooms)
+            self.server_status_update(new_room)
+            self.log_room(new_room)
             return True
         
         # requested player.room_id is not None => try to find a place in this room
@@ -310,9 +889,12 @@ class GameServerFactory(WebSocketServerFactory):
                 # ship available ? yes
                 if len(self.rooms[player.room_id]["ships"]) > 0:
 
-                    ship = self.rooms[player.room_id]["ships"].pop(0) # first ship available in ships list
+                    ship = heapq.heappop(self.rooms[player.room_id]["ships"]) # first ship available in ships list
+                    self.room_index.set_free(player.room_id, len(self.rooms[player.room_id]["ships"]) > 0)
 
                     self.rooms[player.room_id]["players"].append(player) # .append(player.peer)
+                    self.player_count += 1
+                    self.wake_room(player.room_id)
                     player.ship_nb = ship
                     
                     print(f"Assigned ship #{ship} in room {player.room_id} to player {player}")
@@ -323,8 +905,8 @@ class GameServerFactory(WebSocketServerFactory):
                     except Disconnected:
                         print("Could not send %s, client disconnected" % msg)
                 
-                    self.server_status_update()
-                    print("ROOMS=", self.rooms)
+                    self.server_status_update(player.room_id)
+                    self.log_room(player.room_id)
                     return True
                 
                 # no ship left
@@ -335,19 +917,24 @@ class GameServerFactory(WebSocketServerFactory):
                     except Disconnected:
                         print("Could not send %s, client disconnected" % msg)
 
-                    self.server_status_update()
-                    print("ROOMS=", self.rooms)
+                    self.log_room(player.room_id)
+
+                    player.room_id = None # not a member of this room, nothing to remove when it disconnects
                     return False
 
             # room_id already exists ? no
             else:
+                if self.rooms_full(player):
+                    return False
+
                 # create the room
                 print(f"Created room {player.room_id}")
 
-                self.rooms[player.room_id] = {"ships":[2, 3, 4], "players":[]}
+                self.create_room(player.room_id)
 
                 # add the player into the room and assign it ship #1
                 self.rooms[player.room_id]["players"].append(player)
+                self.player_count += 1
                 player.ship_nb = 1
 
                 print(f"Assigned ship #1 in room {player.room_id} to player {player}")
@@ -359,44 +946,338 @@ class GameServerFactory(WebSocketServerFactory):
                 except Disconnected:
                     print("Could not send %s, client disconnected" % msg)
             
-                self.server_status_update()
-                print("ROOMS=", self.rooms)
+                self.server_status_update(player.room_id)
+                self.log_room(player.room_id)
                 return True
 
+    def rooms_full(self, player):
+        """ Denies the login if it needs a new room and the server has max_rooms """
+
+        if len(self.rooms) < self.limits["max_rooms"]:
+            return False
+
+        print(f"Player {player.peer} denied: {len(self.rooms)} rooms")
+        self.metrics.inc("rooms_denied_total")
+
+        player.room_id = None # not in a room, nothing to remove when it disconnects
+
+        msg = {"a":Action.LOGIN_DENY, "p":"Server full"}
+        try:
+            player.sendMessage(msgpack.packb(msg, use_bin_type=True), isBinary=True)
+        except Disconnected:
+            print("Could not send %s, client disconnected" % msg)
+
+        return True
+
     def broadcast_msg(self, from_player, update_payload_from_player):
 
-        for player in self.rooms[from_player.room_id]["players"]:
+        players = [player for player in self.rooms[from_player.room_id]["players"] if player != from_player]
 
-            if player != from_player:
-                msg = {"a":Action.OTHER_PLAYER_UPDATE, "p":update_payload_from_player}
-                try:
-                    player.sendMessage(msgpack.packb(msg, use_bin_type=True), isBinary=True)   
-                except Disconnected:
-                    print("Could not send %s, client disconnected" % msg)
-                    
-                if DEBUG_PRINT:
-                    print("Sent player update from %s to %s" % (from_player, player))
+        msg = {"a":Action.OTHER_PLAYER_UPDATE, "p":update_payload_from_player}
+        self.send_to_all(players, msg, from_player.ship_nb)
+
+        if DEBUG_PRINT:
+            print("Sent player update from %s to %s" % (from_player, players))
 
 # -------------------------------------------------------------------------------------------------
+# Sharded server (--workers N): this process only accepts the connections and answers each LOGIN
+# with the url of the worker process hosting the room (LOGIN_REDIRECT). Each worker is a plain
+# GameServerFactory with its own reactor and tick loop, on the port after ours + shard number.
+#
+# Room placement: named / numbered rooms on shard_of(room_id); "first room with space" on the least
+# loaded worker having a room with a free ship, else the least loaded one (it creates the room).
+# Workers report their load (a JSON line per change) on their stdout.
 
-if __name__ == '__main__':
+class LobbyProtocol(WebSocketServerProtocol):
+
+    def __init__(self):
+        super().__init__()
+        self.opened = False
+
+    def onConnect(self, request):
+        admit_connection(self, "lobby_")
+
+    def onOpen(self):
+        self.opened = True
+        self.factory.metrics.inc("lobby_connections")
+
+    def onClose(self, wasClean, code, reason):
+        if self.opened:
+            self.factory.metrics.inc("lobby_connections", -1)
+
+        self.factory.del_watcher(self)
+
+    def onMessage(self, payload, isBinary):
+
+        msg = decode_message(payload)
+        if msg is None:
+            return
+
+        if msg["a"] == Action.LOGIN:
+
+            p = msg["p"]
+            if not login_version_ok(self, p):
+                return
+
+            worker = self.factory.place(login_room_id(p))
+
+            # the worker port on the host the client used to reach us
+            host = self.http_request_host
+            if ":" in host and not host.endswith("]"):
+                host = host.rsplit(":", 1)[0]
+
+            url = "ws://%s:%s" % (host, worker.port)
+            print(f"Player {self.peer} room {p.get('room_id')} => shard {worker.shard} {url}")
 
-    log.startLogging(sys.stdout)
+            msg = {"a":Action.LOGIN_REDIRECT, "p":{"url":url}}
+            self.sendMessage(msgpack.packb(msg, use_bin_type=True), isBinary=True)
+
+            self.factory.metrics.inc("redirects_total")
+
+        elif msg["a"] == Action.SERVER_STAT_REGISTER:
+            self.factory.add_watcher(self)
+
+class WorkerProcess(ProcessProtocol):
+
+    def __init__(self, lobby, shard, url, args):
+        self.lobby = lobby
+        self.shard = shard
+        self.url = url
+        self.port = parse_url(url)[2]
+        self.args = args
+
+        self.pid = None
+        self.buffer = b""
+        self.load = {"players":0, "rooms":0, "free_rooms":0}
+        self.metrics = {}
+
+    def spawn(self):
+        # stdout: load and metrics reports, stderr: log, into ours
+        reactor.spawnProcess(self, sys.executable, [sys.executable] + self.args, env=os.environ, childFDs={0:"w", 1:"r", 2:1})
+
+    def connectionMade(self):
+        self.pid = self.transport.pid
+        print("Shard %s started on %s (pid %s)" % (self.shard, self.url, self.pid))
+
+    def outReceived(self, data):
+
+        lines = (self.buffer + data).split(b"\n")
+        self.buffer = lines.pop()
+
+        for line in lines:
+            report = json.loads(line)
+
+            if "load" in report:
+                self.load = report["load"]
+                self.lobby.status_changed = True
+
+            if "metrics" in report:
+                self.metrics = report["metrics"]
+
+    def processEnded(self, reason):
+        print("Shard %s (pid %s) exited: %s" % (self.shard, self.pid, reason.value))
+
+        self.pid = None
+        self.buffer = b""
+        self.load = {"players":0, "rooms":0, "free_rooms":0}
+        self.metrics = {}
+        self.lobby.status_changed = True
+
+        if not self.lobby.stopping:
+            reactor.callLater(WORKER_RESPAWN_DELAY, self.spawn)
+
+class LobbyFactory(WebSocketServerFactory):
+
+    def __init__(self, url, worker_count, profile="", room_rate=ROOM_RATE, idle_rate=ROOM_IDLE_RATE, limits=DEFAULT_LIMITS, profile_switch=False):
+        WebSocketServerFactory.__init__(self, url)
+
+        # max_connections for ours too, the others are the workers limits
+        self.limits = limits
+        set_message_limit(self, limits["max_message_bytes"])
+
+        _, host, port, _, _, _ = parse_url(url)
+
+        self.workers = []
+        for shard in range(worker_count):
+            worker_url = "ws://%s:%s" % (host, port + 1 + shard)
+
+            args = [os.path.abspath(__file__), "--url", worker_url, "--shard", str(shard), "--workers", str(worker_count),
+                    "--room_rate", str(room_rate), "--idle_rate", str(idle_rate)]
+            for name, value in limits.items():
+                args += ["--%s" % name, str(value)]
+            if profile:
+                args += ["--profile", "shard%s-%s" % (shard, profile)]
+            if profile_switch:
+                args += ["--profile_switch"]
+
+            self.workers.append(WorkerProcess(self, shard, worker_url, args))
+
+        # workers load sent to the watchers at most every METRICS_PERIOD
+        self.server_watchers = []
+        self.status_changed = False
+        self.metrics = Metrics(LOBBY_METRICS)
+
+        metricsloop = task.LoopingCall(self.publish_metrics)
+        metricsloop.start(METRICS_PERIOD, now=False)
+
+        self.stopping = False
+        reactor.addSystemEventTrigger("before", "shutdown", self.stop_workers)
+
+    def start_workers(self):
+        for worker in self.workers:
+            worker.spawn()
+
+    def stop_workers(self):
+        """ A worker stops when its stdin is closed """
+
+        self.stopping = True
+        for worker in self.workers:
+            if worker.pid:
+                worker.transport.closeStdin()
+
+    def place(self, room_id):
+        """ Worker hosting room_id, None: first room with space """
+
+        if room_id is not None:
+            return self.workers[shard_of(room_id, len(self.workers))]
+
+        with_space = [worker for worker in self.workers if worker.load["free_rooms"]]
+        worker = min(with_space or self.workers, key=lambda worker: worker.load["players"])
+
+        # until its next report (several logins in a row)
+        worker.load = dict(worker.load, players=worker.load["players"] + 1)
+
+        return worker
+
+    def publish_metrics(self):
+        self.metrics.set("workers", len([worker for worker in self.workers if worker.pid]))
+
+        if self.status_changed:
+            self.status_changed = False
+            self.server_status_update()
+
+    def metrics_text(self):
+        """ Ours, then the workers ones labelled with their shard """
+
+        workers = [({"shard":worker.shard}, worker.metrics) for worker in self.workers]
+        return prometheus_text(LOBBY_METRICS, [({}, self.metrics.values)]) + prometheus_text(SERVER_METRICS, workers)
+
+    def server_status_update(self):
+        if not self.server_watchers:
+            return
+
+        workers = [dict(worker.load, shard=worker.shard, url=worker.url, pid=worker.pid) for worker in self.workers]
+
+        msg = {"a":Action.SERVER_STAT_UPDATE, "p":{"workers":workers}}
+        prepared = self.prepareMessage(msgpack.packb(msg, use_bin_type=True), isBinary=True)
+        for watcher in self.server_watchers:
+            watcher.sendPreparedMessage(prepared)
+
+    def add_watcher(self, watcher):
+        if watcher not in self.server_watchers:
+            self.server_watchers.append(watcher)
+
+        msg = {"a":Action.SERVER_STAT_OK, "p":""}
+        watcher.sendMessage(msgpack.packb(msg, use_bin_type=True), isBinary=True)
+
+        self.server_status_update()
+
+    def del_watcher(self, watcher):
+        if watcher in self.server_watchers:
+            self.server_watchers.remove(watcher)
+
+class LoadReport(Protocol):
+    """ Worker side: stdout to the sharded server, stdin closed => stop """
+
+    def __init__(self, factory):
+        self.factory = factory
+
+    def connectionMade(self):
+        self.factory.load_listener = self.report_load
+        self.factory.metrics_listener = self.report_metrics
+        self.report_load(self.factory.load())
+
+    def report(self, report):
+        self.transport.write(json.dumps(report).encode("utf8") + b"\n")
+
+    def report_load(self, load):
+        self.report({"load":load})
+
+    def report_metrics(self, values):
+        self.report({"metrics":values})
+
+    def connectionLost(self, reason):
+        self.factory.load_listener = None
+        self.factory.metrics_listener = None
+        if reactor.running:
+            reactor.stop()
+
+# -------------------------------------------------------------------------------------------------
+
+if __name__ == '__main__':
 
     # options
     parser = argparse.ArgumentParser()
 
     parser.add_argument('-url', '--url', help='', action="store", default="ws://0.0.0.0:4444")
+    parser.add_argument('-profile', '--profile', help='Sample the reactor thread from the start, write collapsed stacks (flamegraph) to this file (time.strftime format) at exit. kill -USR1 toggles the profiler', action="store", default="")
+    parser.add_argument('-profile_switch', '--profile_switch', help='Lower the GIL switch interval while profiling: samples on time, but more overhead in the measured code', action="store_true", default=False)
+    parser.add_argument('-workers', '--workers', help='Sharded server: the rooms are spread over this many worker processes (on the next ports), this one redirects the players', type=int, action="store", default=0)
+    parser.add_argument('-room_rate', '--room_rate', help='Room tick rate (Hz, %.4f to %s)' % (MIN_ROOM_RATE, TICK_RATE), type=rate_option, action="store", default=ROOM_RATE)
+    parser.add_argument('-idle_rate', '--idle_rate', help='Tick rate (Hz, %.4f to %s) of the rooms without state change for %ss or with a single player' % (MIN_ROOM_RATE, TICK_RATE, ROOM_IDLE_AFTER), type=rate_option, action="store", default=ROOM_IDLE_RATE)
+    parser.add_argument('-metrics_port', '--metrics_port', help='Serve the metrics as Prometheus text on http://127.0.0.1:PORT/metrics (0: off)', type=int, action="store", default=0)
+    for name, value, help in LIMITS:
+        parser.add_argument('-%s' % name, '--%s' % name, help=help, type=int, action="store", default=value)
+    parser.add_argument('-shard', '--shard', help=argparse.SUPPRESS, type=int, action="store", default=-1) # worker of a sharded server
 
     result = parser.parse_args()
     args = dict(result._get_kwargs())
 
+    # a worker stdout is for its load reports
+    log.startLogging(sys.stderr if args["shard"] >= 0 else sys.stdout)
+
     print("Args=", args)
 
+    limits = {name: args[name] for name, _, _ in LIMITS}
+
+    if args["workers"] and args["shard"] < 0:
+        factory = LobbyFactory(args["url"], args["workers"], args["profile"], args["room_rate"], args["idle_rate"], limits, args["profile_switch"])
+        factory.protocol = LobbyProtocol
+        listenWS(factory)
+
+        if args["metrics_port"]:
+            listen_metrics(args["metrics_port"], factory.metrics_text)
+
+        factory.start_workers()
+
+        reactor.run()
+        sys.exit(0)
+
     ServerFactory = GameServerFactory
 
-    factory = ServerFactory(args["url"])
+    if args["shard"] >= 0:
+        factory = ServerFactory(args["url"], args["shard"], args["workers"], args["room_rate"], args["idle_rate"], limits)
+        stdio.StandardIO(LoadReport(factory))
+    else:
+        factory = ServerFactory(args["url"], room_rate=args["room_rate"], idle_rate=args["idle_rate"], limits=limits)
+
     factory.protocol = PlayerProtocol
     listenWS(factory)
 
-    reactor.run()
\ No newline at end of file
+    if args["metrics_port"]:
+        listen_metrics(args["metrics_port"], factory.metrics_text)
+
+    # profile a running server: kill -USR1 <pid> to start, again to stop and write the file
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: reactor.callFromThread(factory.profiler.toggle))
+
+    if args["profile_switch"]:
+        factory.profiler.switch_interval = PROFILE_SWITCH_INTERVAL
+
+    if args["profile"]:
+        factory.profiler.path = args["profile"]
+        factory.profiler.start()
+
+    reactor.run()
+
+    factory.profiler.stop()
\ No newline at end of file
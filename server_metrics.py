@@ -0,0 +1,130 @@
+"""
+Server metrics (server.py): counters (totals since the start) and gauges, published
+
+    - to the watchers (SERVER_STAT_REGISTER): all the values once, then every METRICS_PERIOD only the
+      ones which changed (SERVER_STAT_UPDATE {"metrics":{name:value}, "rooms":[[room_id, ships], ...]})
+    - as Prometheus text on a local HTTP port (server.py --metrics_port): GET /metrics
+
+    metrics = Metrics()
+    metrics.inc("messages_in_total")
+    metrics.set("players", 12)
+    metrics.update_rates(elapsed)    # the *_per_s gauges, once per period
+    metrics.delta()                  # values changed since the last delta()
+    prometheus_text(SERVER_METRICS, [({"shard":"0"}, metrics.values)])
+"""
+
+METRICS_PERIOD = 1. # s between two watcher updates (and rates computations)
+METRICS_PREFIX = "mayhem_"
+
+COUNTER = "counter"
+GAUGE = "gauge"
+
+# name, type, help
+SERVER_METRICS = [
+    ("connections",                    GAUGE,   "Open websocket connections (players, watchers, not logged yet)"),
+    ("rooms",                          GAUGE,   "Rooms"),
+    ("players",                        GAUGE,   "Players in a room"),
+    ("logins_total",                   COUNTER, "Players who entered a room"),
+    ("messages_in_total",              COUNTER, "Messages received"),
+    ("messages_out_total",             COUNTER, "Messages sent"),
+    ("bytes_in_total",                 COUNTER, "Message payload bytes received"),
+    ("bytes_out_total",                COUNTER, "Message payload bytes sent"),
+    ("messages_in_per_s",              GAUGE,   "Messages received per second over the last period"),
+    ("messages_out_per_s",             GAUGE,   "Messages sent per second over the last period"),
+    ("bytes_in_per_s",                 GAUGE,   "Message payload bytes received per second over the last period"),
+    ("bytes_out_per_s",                GAUGE,   "Message payload bytes sent per second over the last period"),
+    ("updates_dropped_total",          COUNTER, "Player updates superseded before being relayed"),
+    ("ticks_total",                    COUNTER, "Base ticks"),
+    ("room_ticks_total",               COUNTER, "Room ticks"),
+    ("tick_seconds_total",             COUNTER, "Time spent in the base ticks"),
+    ("tick_seconds_max",               GAUGE,   "Longest base tick over the last period"),
+    ("tick_overruns_total",            COUNTER, "Base ticks longer than the tick period"),
+    ("ticks_skipped_total",            COUNTER, "Base ticks skipped by a late tick loop"),
+    ("decode_seconds_total",           COUNTER, "Time spent unpacking the received messages"),
+    ("relay_seconds_total",            COUNTER, "Time spent processing the packet queues in the room ticks"),
+    ("encode_seconds_total",           COUNTER, "Time spent packing and framing the sent messages"),
+    ("send_seconds_total",             COUNTER, "Time spent writing the sent messages to the connections"),
+    ("queue_depth_max",                GAUGE,   "Deepest player packet queue at the last room tick"),
+    ("send_buffer_bytes",              GAUGE,   "Bytes waiting in the connections send buffers"),
+    ("send_buffer_max_bytes",          GAUGE,   "Largest connection send buffer"),
+    ("backlogged_connections",         GAUGE,   "Players whose send buffer is over the budget (their updates wait, the newest per ship)"),
+    ("updates_coalesced_total",        COUNTER, "Updates for a slow connection replaced by a newer one of the same ship"),
+    ("slow_disconnects_total",         COUNTER, "Connections dropped for staying over the send budget"),
+    ("connections_denied_total",       COUNTER, "Connections refused at the handshake (max_connections)"),
+    ("rooms_denied_total",             COUNTER, "Logins denied because they needed a new room (max_rooms)"),
+    ("messages_rate_limited_total",    COUNTER, "Messages dropped over max_messages_per_s"),
+    ("rate_limit_disconnects_total",   COUNTER, "Connections dropped for staying over max_messages_per_s"),
+    ("messages_too_big_total",         COUNTER, "Connections closed for a message over max_message_bytes"),
+    ("shots_limited_total",            COUNTER, "PLAYER_UPDATE messages dropped for having more than max_shots shots"),
+    ("messages_invalid_total",         COUNTER, "Messages dropped because they could not be decoded"),
+    ("messages_not_playing_total",     COUNTER, "Messages dropped because their connection is not in a room"),
+    ("logins_repeated_total",          COUNTER, "LOGIN messages ignored because their connection is already in a room"),
+]
+
+# sharded server front process (the workers metrics are labelled with their shard)
+LOBBY_METRICS = [
+    ("lobby_connections",              GAUGE,   "Open websocket connections"),
+    ("lobby_connections_denied_total", COUNTER, "Connections refused at the handshake (max_connections)"),
+    ("workers",                        GAUGE,   "Worker processes running"),
+    ("redirects_total",                COUNTER, "Players redirected to a worker"),
+]
+
+# gauge => counter it is the rate of
+RATES = {
+    "messages_in_per_s": "messages_in_total",
+    "messages_out_per_s": "messages_out_total",
+    "bytes_in_per_s": "bytes_in_total",
+    "bytes_out_per_s": "bytes_out_total",
+}
+
+# -------------------------------------------------------------------------------------------------
+
+class Metrics():
+
+    def __init__(self, definitions=SERVER_METRICS):
+
+        self.definitions = definitions
+        self.values = {name: 0 for name, _, _ in definitions}
+
+        # values at the last delta() / update_rates()
+        self.published = {}
+        self.rate_base = {}
+
+    def inc(self, name, amount=1):
+        self.values[name] += amount
+
+    def set(self, name, value):
+        self.values[name] = value
+
+    def update_rates(self, elapsed):
+
+        for gauge, counter in RATES.items():
+            if gauge in self.values:
+                value = self.values[counter]
+                self.values[gauge] = round((value - self.rate_base.get(counter, value)) / elapsed, 1) if elapsed > 0 else 0
+                self.rate_base[counter] = value
+
+    def delta(self):
+        """ Values changed since the last call """
+
+        changed = {name: value for name, value in self.values.items() if self.published.get(name) != value}
+        self.published.update(changed)
+
+        return changed
+
+def prometheus_text(definitions, sources):
+    """ Text exposition format: sources is [(labels dict, values dict), ...], one sample per source """
+
+    lines = []
+    for name, kind, help in definitions:
+        lines.append("# HELP %s%s %s" % (METRICS_PREFIX, name, help))
+        lines.append("# TYPE %s%s %s" % (METRICS_PREFIX, name, kind))
+
+        for labels, values in sources:
+            if name not in values:
+                continue
+
+            label_text = ",".join('%s="%s"' % (label, value) for label, value in labels.items())
+            lines.append("%s%s%s %s" % (METRICS_PREFIX, name, "{%s}" % label_text if label_text else "", values[name]))
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,362 @@
+"""
+Split mode (local game, --split): the simulation runs in its own process, the main process only
+handles the window, the inputs and the rendering.
+
+    simulation process                          render process (main)
+    MayhemEnv.step_local() at SIM_FPS  -- frames -->  MayhemEnv.render()
+                                       <-- inputs --  keyboard / joystick
+
+Both sides share one block of memory, a numpy structured array: the last two frames (double buffer
++ seqlock, the simulation never waits for the rendering) and the inputs / control fields.
+"""
+
+import os, time
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+import pygame
+
+# -------------------------------------------------------------------------------------------------
+
+SPLIT_SHIPS = 4
+SPLIT_MAX_SHOTS = 32 # per ship, >= MAX_SHOOT (mayhem.py)
+SPLIT_MAX_DEBRIS = 8 # Ship.init_debris()
+
+# ship image: ship_pic, ship_pic_thrust, ship_pic_shield
+IMAGE_NORMAL = 0
+IMAGE_THRUST = 1
+IMAGE_SHIELD = 2
+
+SHIP_DTYPE = np.dtype([
+    ("xpos", np.int32),
+    ("ypos", np.int32),
+    ("angle", np.float32),
+    ("image", np.uint8),
+    ("landed", np.bool_),
+    ("explod", np.bool_),
+    ("game_over", np.bool_),
+    ("explod_tick", np.int32),
+    ("lives", np.int32),
+    ("shots_count", np.int32),
+    ("shots", np.float32, (SPLIT_MAX_SHOTS, 2)),
+    ("debris_count", np.int32),
+    ("debris", np.float32, (SPLIT_MAX_DEBRIS, 2)),
+], align=True)
+
+FRAME_DTYPE = np.dtype([
+    ("frame", np.int64),
+    ("level", np.int32),
+    ("ships", SHIP_DTYPE, (SPLIT_SHIPS,)),
+], align=True)
+
+# written by the render process
+INPUT_DTYPE = np.dtype([
+    ("left", np.bool_),
+    ("right", np.bool_),
+    ("thrust", np.bool_),
+    ("shoot", np.bool_),
+    ("shield", np.bool_),
+], align=True)
+
+CONTROL_DTYPE = np.dtype([
+    ("writing", np.uint64),   # frame being written by the simulation
+    ("published", np.uint64), # last complete frame, frame n is in buffers[n % 2]
+    ("running", np.bool_),
+    ("paused", np.bool_),
+    ("level", np.int32),      # level asked by the render process
+    ("inputs", INPUT_DTYPE, (SPLIT_SHIPS,)),
+], align=True)
+
+LAYOUT_DTYPE = np.dtype([
+    ("control", CONTROL_DTYPE),
+    ("buffers", FRAME_DTYPE, (2,)),
+], align=True)
+
+# -------------------------------------------------------------------------------------------------
+
+class SharedState():
+    """ The shared memory block, created by the render process and attached by the simulation process """
+
+    def __init__(self, name=None):
+
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=LAYOUT_DTYPE.itemsize)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+
+        self.name = self.shm.name
+
+        layout = np.ndarray((), dtype=LAYOUT_DTYPE, buffer=self.shm.buf)
+        self.control = layout["control"]
+        self.inputs = self.control["inputs"]
+        self.buffers = layout["buffers"]
+
+        if self.owner:
+            layout[()] = np.zeros((), dtype=LAYOUT_DTYPE)
+
+    def close(self):
+        # numpy views on the buffer must be gone before closing it
+        del self.control, self.inputs, self.buffers
+
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    # simulation side
+
+    def publish(self, env):
+        """ Writes env state in the buffer not being read, then makes it the last complete frame """
+
+        n = int(self.control["published"]) + 1
+        self.control["writing"] = n
+
+        frame = self.buffers[n % 2]
+        frame["frame"] = env.frames
+        frame["level"] = env.level
+
+        ships = frame["ships"]
+
+        for i, ship in enumerate(env.ships):
+            s = ships[i]
+
+            s["xpos"] = ship.xpos
+            s["ypos"] = ship.ypos
+            s["angle"] = ship.angle
+
+            if ship.image is ship.ship_pic_thrust:
+                s["image"] = IMAGE_THRUST
+            elif ship.image is ship.ship_pic_shield:
+                s["image"] = IMAGE_SHIELD
+            else:
+                s["image"] = IMAGE_NORMAL
+
+            s["landed"] = ship.landed
+            s["explod"] = ship.explod
+            s["game_over"] = ship.game_over
+            s["explod_tick"] = ship.explod_tick
+            s["lives"] = ship.lives
+
+            shots = ship.shots[:SPLIT_MAX_SHOTS]
+            s["shots_count"] = len(shots)
+            if shots:
+                s["shots"][:len(shots)] = [(shot.x, shot.y) for shot in shots]
+
+            debris = ship.debris[:SPLIT_MAX_DEBRIS]
+            s["debris_count"] = len(debris)
+            if debris:
+                s["debris"][:len(debris)] = [(deb.x, deb.y) for deb in debris]
+
+        self.control["published"] = n
+
+    def read_inputs(self, ships):
+        for i, ship in enumerate(ships):
+            keys = self.inputs[i]
+
+            ship.left_pressed   = bool(keys["left"])
+            ship.right_pressed  = bool(keys["right"])
+            ship.thrust_pressed = bool(keys["thrust"])
+            ship.shoot_pressed  = bool(keys["shoot"])
+            ship.shield_pressed = bool(keys["shield"])
+
+    # render side
+
+    def read(self):
+        """ Returns (frame number, copy of the last complete frame), frame number = 0 if none yet """
+
+        while True:
+            n = int(self.control["published"])
+            frame = self.buffers[n % 2].copy()
+
+            # seqlock: the simulation did not start to overwrite this buffer while we were copying it
+            if int(self.control["writing"]) < n + 2:
+                return n, frame
+
+    def write_inputs(self, ships):
+        for i, ship in enumerate(ships):
+            keys = self.inputs[i]
+
+            keys["left"]   = ship.left_pressed
+            keys["right"]  = ship.right_pressed
+            keys["thrust"] = ship.thrust_pressed
+            keys["shoot"]  = ship.shoot_pressed
+            keys["shield"] = ship.shield_pressed
+
+# -------------------------------------------------------------------------------------------------
+
+def run_simulation(shm_name, width, height, env_args):
+    """ Simulation process: no window, no sound (the render process handles them) """
+
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    os.environ["SDL_AUDIODRIVER"] = "dummy"
+
+    import mayhem
+
+    pygame.init()
+    pygame.mixer.init()
+
+    game = mayhem.GameWindow(width, height)
+    env = mayhem.MayhemEnv(game, show_all_players=True, **env_args)
+
+    shared = SharedState(shm_name)
+
+    try:
+        while shared.control["running"]:
+
+            if shared.control["paused"]:
+                env.timestep.reset()
+                time.sleep(env.timestep.step)
+                continue
+
+            level = int(shared.control["level"])
+            if level != env.level:
+                env.set_level_and_ships(level)
+
+            steps = env.timestep.advance()
+
+            for _ in range(steps):
+                shared.read_inputs(env.ships)
+                env.step_local()
+
+            if steps:
+                shared.publish(env)
+            else:
+                # sleep until the next step is due
+                time.sleep(max(0, env.timestep.step - env.timestep.accumulator))
+
+        env.record_it()
+
+    finally:
+        shared.close()
+
+# -------------------------------------------------------------------------------------------------
+
+def apply_frame(env, frame):
+    """ Copies a published frame in the render process ships """
+
+    import mayhem
+
+    env.frames = int(frame["frame"])
+
+    for ship, s in zip(env.ships, frame["ships"]):
+
+        image = ship.ship_pic
+        if s["image"] == IMAGE_THRUST:
+            image = ship.ship_pic_thrust
+        elif s["image"] == IMAGE_SHIELD:
+            image = ship.ship_pic_shield
+
+        # sounds, from the state changes
+        explod = bool(s["explod"])
+        if explod and not ship.explod:
+            ship.sound_thrust.stop()
+            ship.sound_shield.stop()
+            ship.sound_explod.play()
+
+        if image is not ship.image:
+            ship.sound_thrust.stop()
+            ship.sound_shield.stop()
+
+            if image is ship.ship_pic_thrust:
+                ship.sound_thrust.play(-1)
+            elif image is ship.ship_pic_shield:
+                ship.sound_shield.play(-1)
+
+        if int(s["shots_count"]) > len(ship.shots):
+            ship.sound_shoot.play()
+
+        # rotation only when needed (the simulation process has its own masks)
+        angle = float(s["angle"])
+        if image is not ship.image or angle != ship.angle:
+            ship.image = image
+            ship.angle = angle
+            ship.image_rotated = pygame.transform.rotate(image, angle)
+
+            rect = ship.image_rotated.get_rect()
+            ship.rot_xoffset = int( ((mayhem.SHIP_SPRITE_SIZE - rect.width)/2) )
+            ship.rot_yoffset = int( ((mayhem.SHIP_SPRITE_SIZE - rect.height)/2) )
+
+        ship.save_position()
+        ship.xpos = int(s["xpos"])
+        ship.ypos = int(s["ypos"])
+
+        ship.landed = bool(s["landed"])
+        ship.explod = explod
+        ship.game_over = bool(s["game_over"])
+        ship.explod_tick = int(s["explod_tick"])
+        ship.lives = int(s["lives"])
+
+        ship.shots = []
+        for x, y in s["shots"][:s["shots_count"]]:
+            shot = mayhem.Shot()
+            shot.x = int(x)
+            shot.y = int(y)
+            ship.shots.append(shot)
+
+        ship.debris = []
+        for x, y in s["debris"][:s["debris_count"]]:
+            deb = mayhem.Debris()
+            deb.x = int(x)
+            deb.y = int(y)
+            ship.debris.append(deb)
+
+def run_split_loop(game_env, fps, env_args):
+    """ Render process: starts the simulation process then renders each new frame it publishes """
+
+    shared = SharedState()
+    shared.control["running"] = True
+    shared.control["level"] = game_env.level
+
+    # spawn: a forked child would share the SDL window and audio device
+    ctx = multiprocessing.get_context("spawn")
+    simulation = ctx.Process(target=run_simulation, daemon=True,
+                             args=(shared.name, game_env.game.screen_width, game_env.game.screen_height, env_args))
+    simulation.start()
+
+    clock = pygame.time.Clock()
+    rendered = 0
+
+    # the ships are drawn between the last two published frames (so one frame late), interpolated
+    # on the time since the last one arrived over the time it simulated
+    step = game_env.timestep.step
+    applied = 0.
+    span = step
+    alpha = 1.
+
+    try:
+        while game_env.running and simulation.is_alive():
+
+            game_env.timers.start("input")
+            game_env.handle_local_events()
+
+            shared.write_inputs(game_env.ships)
+            shared.control["paused"] = game_env.paused
+            shared.control["level"] = game_env.level
+
+            n, frame = shared.read()
+
+            # frames of the previous level are still coming until the simulation switched
+            if n != rendered and frame["level"] == game_env.level:
+                steps = int(frame["frame"]) - game_env.frames
+                apply_frame(game_env, frame)
+                rendered = n
+
+                applied = time.perf_counter()
+                span = max(1, steps) * step
+                alpha = 0.
+                game_env.render(game_env.ships, alpha)
+
+            # until the last frame is reached (no new frame: paused, or the simulation is late)
+            elif rendered and alpha < 1.:
+                alpha = min(1., (time.perf_counter() - applied) / span)
+                game_env.render(game_env.ships, alpha)
+
+            game_env.timers.end_frame()
+            clock.tick(fps)
+
+    finally:
+        shared.control["running"] = False
+        simulation.join(timeout=5)
+        shared.close()
@@ -0,0 +1,148 @@
+"""
+Per stage frame timers: how long each stage of the game loop (input, update, collision, map blit,
+texture upload, flip...) took in each frame, over the last STAGE_WINDOW frames.
+
+    timers.start("update")     # stops the previous stage, if any
+    ...
+    timers.start("collision")
+    ...
+    timers.stop()
+    timers.end_frame()         # one sample per stage for this frame (a stage can run several times per frame)
+
+Disabled (default): start() / stop() / end_frame() return at once.
+"""
+
+import os, json, time, collections
+
+# -------------------------------------------------------------------------------------------------
+
+STAGE_WINDOW = 300 # frames kept per stage for the percentiles
+STAGE_FLUSH = 60   # frames between two flushes of the output file
+
+# -------------------------------------------------------------------------------------------------
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100.))]
+
+class StageTimers():
+
+    def __init__(self, window=STAGE_WINDOW):
+
+        self.enabled = False
+        self.window = window
+
+        # stage => deque of per frame durations (s), in first seen order
+        self.stages = collections.OrderedDict()
+
+        # current frame: stage => accumulated duration (s)
+        self.frame = collections.OrderedDict()
+        self.frames = 0
+
+        self.stage = None
+        self.t0 = 0.
+
+        # CSV or JSONL stream, one line per frame
+        self.output = None
+        self.output_format = None
+        self.output_columns = None
+        self.output_header = False
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+        self.stage = None
+        self.frame.clear()
+
+    def open_output(self, path, columns=None):
+        """ Streams the per frame durations (ms) to path: .csv (columns: the stages to write) or .jsonl """
+
+        self.output_format = "csv" if os.path.splitext(path)[1].lower() == ".csv" else "jsonl"
+        self.output_columns = list(columns) if columns else None
+        self.output_header = False
+        self.output = open(path, "w")
+        self.enable()
+
+    def close_output(self):
+        if self.output:
+            self.output.close()
+            self.output = None
+
+    def start(self, stage):
+        if not self.enabled:
+            return
+
+        t = time.perf_counter()
+
+        if self.stage:
+            self.frame[self.stage] = self.frame.get(self.stage, 0.) + t - self.t0
+
+        self.stage = stage
+        self.t0 = t
+
+    def stop(self):
+        if not self.enabled or not self.stage:
+            return
+
+        self.frame[self.stage] = self.frame.get(self.stage, 0.) + time.perf_counter() - self.t0
+        self.stage = None
+
+    def end_frame(self):
+        if not self.enabled:
+            return
+
+        self.stop()
+        self.frames += 1
+
+        for stage, duration in self.frame.items():
+            samples = self.stages.get(stage)
+            if samples is None:
+                samples = self.stages[stage] = collections.deque(maxlen=self.window)
+            samples.append(duration)
+
+        if self.output:
+            self.write_frame()
+
+        self.frame.clear()
+
+    def write_frame(self):
+
+        if self.output_format == "csv":
+            if not self.output_header:
+                # default columns: the stages seen in the first frame written
+                if self.output_columns is None:
+                    self.output_columns = list(self.frame)
+                self.output.write("frame,%s\n" % ",".join(self.output_columns))
+                self.output_header = True
+
+            values = ["%.3f" % (self.frame.get(stage, 0.) * 1000.) for stage in self.output_columns]
+            self.output.write("%s,%s\n" % (self.frames, ",".join(values)))
+        else:
+            row = {"frame": self.frames}
+            for stage, duration in self.frame.items():
+                row[stage] = round(duration * 1000., 3)
+            self.output.write(json.dumps(row) + "\n")
+
+        if self.frames % STAGE_FLUSH == 0:
+            self.output.flush()
+
+    def summary(self):
+        """ stage => {"p50", "p95", "p99", "max"} in ms """
+
+        result = collections.OrderedDict()
+
+        for stage, samples in self.stages.items():
+            values = sorted(samples)
+            result[stage] = {
+                "p50": percentile(values, 50) * 1000.,
+                "p95": percentile(values, 95) * 1000.,
+                "p99": percentile(values, 99) * 1000.,
+                "max": values[-1] * 1000. if values else 0.,
+            }
+
+        return result
+
+    def reset(self):
+        self.stages.clear()
+        self.frame.clear()
+        self.stage = None
@@ -0,0 +1,67 @@
+import pytest
+
+import mayhem
+from mayhem import FixedTimestep, SIM_FPS, MAX_CATCHUP_STEPS
+
+STEP = 1. / SIM_FPS
+
+# -------------------------------------------------------------------------------------------------
+
+@pytest.fixture
+def clock(monkeypatch):
+    """ clock[0]: the time FixedTimestep reads """
+
+    now = [100.]
+    monkeypatch.setattr(mayhem.time, "perf_counter", lambda: now[0])
+    return now
+
+def test_steps_at_the_simulation_rate(clock):
+    timestep = FixedTimestep()
+
+    # render at 144 Hz for 1 s: SIM_FPS steps whatever the render rate
+    steps = 0
+    for _ in range(144):
+        clock[0] += 1. / 144
+        steps += timestep.advance()
+
+    assert steps in (SIM_FPS - 1, SIM_FPS)
+
+    # render at 30 Hz: 2 steps per frame
+    clock[0] += 1. / 30 + STEP / 2
+    assert timestep.advance() in (2, 3)
+
+def test_alpha(clock):
+    timestep = FixedTimestep()
+
+    clock[0] += STEP * 2.25
+    assert timestep.advance() == 2
+    assert timestep.alpha() == pytest.approx(0.25)
+
+    clock[0] += STEP / 2
+    assert timestep.advance() == 0
+    assert timestep.alpha() == pytest.approx(0.75)
+
+    clock[0] += STEP / 2
+    assert timestep.advance() == 1
+    assert timestep.alpha() == pytest.approx(0.25)
+
+def test_catch_up_is_bounded(clock):
+    timestep = FixedTimestep()
+
+    # window dragged for 2 s: the backlog is dropped, no burst of steps after it
+    clock[0] += 2.
+    assert timestep.advance() == MAX_CATCHUP_STEPS
+    assert timestep.alpha() == 0.
+
+    clock[0] += STEP * 1.5
+    assert timestep.advance() == 1
+
+def test_reset(clock):
+    timestep = FixedTimestep()
+
+    # paused: the time spent is not simulated when it resumes
+    clock[0] += 10.
+    timestep.reset()
+
+    clock[0] += STEP * 1.5
+    assert timestep.advance() == 1
@@ -0,0 +1,132 @@
+import matchmaking
+from matchmaking import RoomIndex, shard_of
+
+# -------------------------------------------------------------------------------------------------
+
+def new_rooms(index, rooms, count):
+    """ count rooms created with new_room_id(), returns their ids """
+
+    room_ids = []
+    for _ in range(count):
+        room_id = index.new_room_id(rooms)
+        rooms[room_id] = {}
+        index.add_room(room_id)
+        room_ids.append(room_id)
+
+    return room_ids
+
+def remove_room(index, rooms, room_id):
+    del rooms[room_id]
+    index.remove_room(room_id)
+
+def test_first_free_room_in_creation_order():
+    index = RoomIndex()
+    rooms = {}
+
+    assert index.first_free_room() is None
+
+    new_rooms(index, rooms, 3)
+    assert index.first_free_room() == 1
+
+    index.set_free(1, False)
+    assert index.first_free_room() == 2
+
+    index.set_free(2, False)
+    index.set_free(3, False)
+    assert index.first_free_room() is None
+    assert index.free_room_count() == 0
+
+    # a ship given back in the oldest room
+    index.set_free(1, True)
+    assert index.first_free_room() == 1
+
+def test_removed_room_is_not_free():
+    index = RoomIndex()
+    rooms = {}
+
+    new_rooms(index, rooms, 2)
+    remove_room(index, rooms, 1)
+
+    assert index.first_free_room() == 2
+    assert len(index) == 1
+
+def test_recreated_room_is_the_newest():
+    index = RoomIndex()
+
+    index.add_room("tony")
+    index.add_room("bob")
+    index.remove_room("tony")
+    index.add_room("tony")
+
+    # the stale heap entry of the first "tony" is dropped
+    assert index.first_free_room() == "bob"
+    index.set_free("bob", False)
+    assert index.first_free_room() == "tony"
+
+def test_new_room_id_reuses_the_smallest():
+    index = RoomIndex()
+    rooms = {}
+
+    assert new_rooms(index, rooms, 4) == [1, 2, 3, 4]
+
+    remove_room(index, rooms, 3)
+    remove_room(index, rooms, 2)
+    assert new_rooms(index, rooms, 3) == [2, 3, 5]
+
+def test_new_room_id_skips_the_rooms_created_by_id():
+    index = RoomIndex()
+    rooms = {}
+
+    # LOGIN with room_id 2, then 1 for a "first room with space" player
+    rooms[2] = {}
+    index.add_room(2)
+    assert new_rooms(index, rooms, 2) == [1, 3]
+
+    # a released id taken again by a LOGIN with this id
+    remove_room(index, rooms, 1)
+    rooms[1] = {}
+    index.add_room(1)
+    assert new_rooms(index, rooms, 1) == [4]
+
+def test_named_rooms_are_not_reused():
+    index = RoomIndex()
+    rooms = {"tony": {}}
+
+    index.add_room("tony")
+    remove_room(index, rooms, "tony")
+
+    assert index.released_ids == []
+    assert new_rooms(index, rooms, 1) == [1]
+
+def test_shard_ids():
+    shard_count = 3
+    indexes = [RoomIndex(shard + 1, shard_count) for shard in range(shard_count)]
+
+    for shard, index in enumerate(indexes):
+        rooms = {}
+        room_ids = new_rooms(index, rooms, 4)
+
+        assert room_ids == [shard + 1 + k * shard_count for k in range(4)]
+        assert all(shard_of(room_id, shard_count) == shard for room_id in room_ids)
+
+        # the id of another shard is not ours to reuse
+        index.add_room(100 + (shard + 1) % shard_count)
+        index.remove_room(100 + (shard + 1) % shard_count)
+
+        remove_room(index, rooms, room_ids[1])
+        assert new_rooms(index, rooms, 2) == [room_ids[1], shard + 1 + 4 * shard_count]
+
+def test_free_rooms_heap_compaction():
+    index = RoomIndex()
+    rooms = {}
+
+    room_ids = new_rooms(index, rooms, 10)
+
+    # full / free churn: stale entries pile up, then the heap is rebuilt
+    for _ in range(matchmaking.FREE_ROOMS_COMPACT):
+        for room_id in room_ids:
+            index.set_free(room_id, False)
+            index.set_free(room_id, True)
+
+    assert len(index.free_rooms) <= max(matchmaking.FREE_ROOMS_COMPACT, 2 * len(room_ids))
+    assert index.first_free_room() == 1
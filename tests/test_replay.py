@@ -0,0 +1,170 @@
+import os, random
+
+import pytest
+
+from conftest import ROOT
+
+import replay
+from replay import ReplayWriter, ReplayReader, state_hash, turbo_replay, REPLAY_CHUNK_FRAMES, REPLAY_KEYFRAME_FRAMES
+
+FRAMES = REPLAY_CHUNK_FRAMES + REPLAY_KEYFRAME_FRAMES // 2 # 2 input chunks, keyframes at 0, 300, 600
+LEVEL_SWITCH_FRAME = 400
+
+# -------------------------------------------------------------------------------------------------
+
+class StubShip():
+    def __init__(self):
+        self.left_pressed = self.right_pressed = self.thrust_pressed = self.shoot_pressed = self.shield_pressed = False
+
+def test_file_round_trip(tmp_path):
+    path = str(tmp_path / "inputs.mrp")
+    rng = random.Random(1)
+
+    ships = [StubShip() for _ in range(4)]
+    writer = ReplayWriter(path, {"level":1, "ships":4})
+
+    recorded = []
+    for frame in range(FRAMES):
+        masks = [rng.randrange(1 << replay.INPUT_BITS) for _ in ships]
+        for ship, mask in zip(ships, masks):
+            replay.set_ship_inputs(ship, mask)
+
+        if frame == LEVEL_SWITCH_FRAME:
+            writer.record_event(frame, {"level":3})
+        if frame % REPLAY_KEYFRAME_FRAMES == 0:
+            writer.record_keyframe(frame, {"frame":frame})
+
+        writer.record_frame(frame, ships)
+        recorded.append(masks)
+
+    writer.close()
+
+    reader = ReplayReader(path)
+    assert reader.header == {"level":1, "ships":4}
+
+    frames = list(reader.frames())
+    assert [masks for _, _, masks in frames] == recorded
+    assert [frame for frame, _, _ in frames] == list(range(FRAMES))
+    assert [(frame, events) for frame, events, _ in frames if events] == [(LEVEL_SWITCH_FRAME, [{"level":3}])]
+
+    assert [frame for frame, _ in reader.index()] == [0, 300, 600]
+    assert reader.last_frame == FRAMES - 1
+
+    keyframe_frame, state, offset = reader.keyframe(599)
+    assert (keyframe_frame, state) == (300, {"frame":300})
+    assert next(reader.frames(offset))[0] == 300
+
+    reader.close()
+
+def test_truncated_file(tmp_path):
+    path = str(tmp_path / "truncated.mrp")
+
+    writer = ReplayWriter(path, {"level":1, "ships":1})
+    for frame in range(REPLAY_CHUNK_FRAMES + 10):
+        writer.record_frame(frame, [StubShip()])
+    writer.close()
+
+    # crash while writing the second chunk: the first one is still read
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 3)
+
+    reader = ReplayReader(path)
+    assert len(list(reader.frames())) == REPLAY_CHUNK_FRAMES
+    reader.close()
+
+def test_not_a_replay(tmp_path):
+    path = tmp_path / "other.bin"
+    path.write_bytes(b"not a replay file")
+
+    with pytest.raises(ValueError):
+        ReplayReader(str(path))
+
+# -------------------------------------------------------------------------------------------------
+
+@pytest.fixture(scope="module")
+def game():
+    import pygame, mayhem
+
+    cwd = os.getcwd()
+    os.chdir(ROOT) # assets paths are relative
+
+    pygame.init()
+    pygame.mixer.init()
+
+    yield mayhem.GameWindow(704, 448, use_opengl=False)
+
+    pygame.quit()
+    os.chdir(cwd)
+
+@pytest.fixture(scope="module")
+def recording(game, tmp_path_factory):
+    """ (replay path, recorded final state hash): 4 ships with random inputs, a level switch """
+    import mayhem
+
+    path = str(tmp_path_factory.mktemp("replay") / "match.mrp")
+    rng = random.Random(1)
+
+    env = mayhem.MayhemEnv(game, level=1, max_fps=60, record_play=path)
+    for frame in range(FRAMES):
+        for ship in env.ships:
+            ship.thrust_pressed = rng.random() < 0.5
+            ship.left_pressed = rng.random() < 0.3
+            ship.shoot_pressed = rng.random() < 0.3
+
+        if frame == LEVEL_SWITCH_FRAME:
+            env.set_level_and_ships(2)
+
+        env.step_local()
+
+    final_hash = state_hash(env)
+    env.record_it()
+
+    return path, final_hash
+
+@pytest.fixture(scope="module")
+def playback(game, recording, tmp_path_factory):
+    """ (turbo_replay() summary, {frame: state hash}) of the recording, from another level """
+    import mayhem
+
+    path, _ = recording
+    hashes_path = str(tmp_path_factory.mktemp("hashes") / "hashes.txt")
+
+    env = mayhem.MayhemEnv(game, level=3, max_fps=0, play_recorded=path)
+    summary = turbo_replay(env, hashes_path=hashes_path)
+
+    with open(hashes_path) as f:
+        hashes = {int(frame): h for frame, h in (line.split() for line in f)}
+
+    return summary, hashes
+
+def test_replay_reproduces_the_game(recording, playback):
+    _, final_hash = recording
+    summary, hashes = playback
+
+    assert summary["frames"] == FRAMES
+    assert summary["level"] == 2
+    assert summary["hash"] == final_hash
+    assert sorted(hashes) == list(range(1, FRAMES + 1))
+
+@pytest.mark.parametrize("frame", [0, 1, 299, 300, 301, LEVEL_SWITCH_FRAME, LEVEL_SWITCH_FRAME + 1, 650, FRAMES - 1])
+def test_seek_state_hash(game, recording, playback, frame):
+    import mayhem
+
+    path, _ = recording
+    _, hashes = playback
+
+    # backward then forward: each seek restores a keyframe, not the current state
+    env = mayhem.MayhemEnv(game, level=1, max_fps=0, play_recorded=path)
+    env.seek(FRAMES - 1)
+    env.seek(frame)
+
+    assert env.frames == frame
+    if frame:
+        assert state_hash(env) == hashes[frame]
+
+    # and the playback goes on from there
+    for _ in range(20):
+        env.step_local()
+        if not env.running:
+            break
+        assert state_hash(env) == hashes[env.frames]
@@ -0,0 +1,90 @@
+from room_scheduler import TickWheel, TICK_WHEEL_SIZE
+
+# -------------------------------------------------------------------------------------------------
+
+def due_ticks(wheel, ticks):
+    """ {base tick: rooms due} over the next ticks (not scheduled again) """
+
+    due = {}
+    for _ in range(ticks):
+        rooms = wheel.advance()
+        if rooms:
+            due[wheel.tick] = set(rooms)
+
+    return due
+
+def test_schedule():
+    wheel = TickWheel()
+
+    wheel.schedule(1, 1)
+    wheel.schedule(2, 3)
+    wheel.schedule(3, 3)
+
+    assert len(wheel) == 3
+    assert due_ticks(wheel, 5) == {1: {1}, 3: {2, 3}}
+    assert len(wheel) == 0
+
+def test_reschedule_at_its_interval():
+    wheel = TickWheel()
+    wheel.schedule("room", 4)
+
+    ticks = []
+    for _ in range(20):
+        if "room" in wheel.advance():
+            ticks.append(wheel.tick)
+            wheel.schedule("room", 4)
+
+    assert ticks == [4, 8, 12, 16, 20]
+
+def test_longest_interval_wraps_around():
+    wheel = TickWheel()
+
+    # past the wheel end, more than once
+    for _ in range(3):
+        start = wheel.tick
+        wheel.schedule(1, TICK_WHEEL_SIZE - 1)
+        assert due_ticks(wheel, TICK_WHEEL_SIZE) == {start + TICK_WHEEL_SIZE - 1: {1}}
+
+def test_schedule_again_replaces():
+    wheel = TickWheel()
+
+    wheel.schedule(1, 10)
+    wheel.schedule(1, 2)
+
+    assert len(wheel) == 1
+    assert due_ticks(wheel, 20) == {2: {1}}
+
+def test_wake():
+    wheel = TickWheel()
+
+    # idle room: due in 30 ticks, an input wakes it up for the next tick
+    wheel.schedule(1, 30)
+    wheel.advance()
+    wheel.wake(1)
+
+    assert due_ticks(wheel, 40) == {2: {1}}
+
+def test_wake_does_not_delay():
+    wheel = TickWheel()
+
+    wheel.schedule(1, 1)
+    wheel.wake(1)
+    assert due_ticks(wheel, 5) == {1: {1}}
+
+    # a room not scheduled (being ticked): due at the next tick
+    wheel.schedule(2, 1)
+    assert wheel.advance() == {2}
+    wheel.wake(2)
+    next_tick = wheel.tick + 1
+    assert due_ticks(wheel, 5) == {next_tick: {2}}
+
+def test_remove():
+    wheel = TickWheel()
+
+    wheel.schedule(1, 2)
+    wheel.schedule(2, 2)
+    wheel.remove(1)
+    wheel.remove(3) # not scheduled: nothing to do
+
+    assert len(wheel) == 1
+    assert due_ticks(wheel, 5) == {2: {2}}
@@ -0,0 +1,187 @@
+import msgpack
+import pytest
+
+import server
+from game_protocol import Action, PROTOCOL_VERSION
+
+SHIPS_PER_ROOM = 4
+
+# -------------------------------------------------------------------------------------------------
+
+class Player(server.PlayerProtocol):
+    """ PlayerProtocol without a connection: the messages sent are kept in sent (not the room broadcasts) """
+
+    state = server.PlayerProtocol.STATE_OPEN
+
+    def sendMessage(self, payload, *args, **kwargs):
+        self.sent.append(msgpack.unpackb(payload, raw=False))
+
+    def sendPreparedMessage(self, prepared):
+        pass
+
+def new_factory(max_rooms=server.DEFAULT_LIMITS["max_rooms"]):
+    # the reactor does not run: the tick loops are scheduled, never called
+    return server.GameServerFactory("ws://127.0.0.1:4444", limits=dict(server.DEFAULT_LIMITS, max_rooms=max_rooms))
+
+def connect(factory, number=0):
+    player = Player()
+    player.factory = factory
+    player.peer = "test:%s" % number
+    player.wasMaxMessagePayloadSizeExceeded = False
+    player.sent = []
+
+    player.onOpen()
+    return player
+
+def disconnect(player):
+    player.onClose(True, 1000, "")
+
+def send(player, action, payload):
+    player.process_message(msgpack.packb({"a":action, "p":payload}, use_bin_type=True))
+
+def login(player, room_id=0, version=PROTOCOL_VERSION):
+    """ The server answer """
+
+    player.sent.clear()
+    send(player, Action.LOGIN, {"room_id":room_id, "version":version})
+
+    answers = [msg for msg in player.sent if msg["a"] in (Action.LOGIN_OK, Action.LOGIN_DENY)]
+    assert len(answers) == 1
+    return answers[0]
+
+def check_rooms(factory, players):
+    """ rooms, player_count, the room index and the (connected) players room_id / ship_nb agree """
+
+    in_rooms = []
+    for room_id, room in factory.rooms.items():
+        ships = sorted(player.ship_nb for player in room["players"])
+
+        assert room["players"]
+        assert sorted(ships + room["ships"]) == list(range(1, SHIPS_PER_ROOM + 1))
+        assert all(player.room_id == room_id for player in room["players"])
+        assert (room_id in factory.room_index.has_free) == bool(room["ships"])
+        assert room_id in factory.tick_wheel.due
+
+        in_rooms += room["players"]
+
+    assert factory.player_count == len(in_rooms) == len(set(in_rooms))
+    assert len(factory.room_index) == len(factory.rooms) == len(factory.tick_wheel)
+    assert len(factory.rooms) <= factory.limits["max_rooms"]
+
+    for player in players:
+        playing = player._state == player.PLAY
+        assert (player in in_rooms) == playing
+        assert (player.room_id is not None) == playing
+
+# -------------------------------------------------------------------------------------------------
+
+def test_first_room_with_space():
+    factory = new_factory()
+    players = [connect(factory, i) for i in range(6)]
+
+    answers = [login(player) for player in players]
+
+    assert [msg["p"] for msg in answers] == [{"room_id":1, "ship_nb":ship} for ship in (1, 2, 3, 4)] + \
+                                            [{"room_id":2, "ship_nb":ship} for ship in (1, 2)]
+    check_rooms(factory, players)
+
+    while players:
+        disconnect(players.pop(0))
+        check_rooms(factory, players)
+
+    assert factory.rooms == {}
+
+def test_freed_ship_is_reused():
+    factory = new_factory()
+    players = [connect(factory, i) for i in range(4)]
+    for player in players:
+        login(player, "tony")
+
+    disconnect(players.pop(1))
+    check_rooms(factory, players)
+
+    newcomer = connect(factory, 4)
+    assert login(newcomer, "tony")["p"] == {"room_id":"tony", "ship_nb":2}
+    check_rooms(factory, players + [newcomer])
+
+def test_room_full():
+    factory = new_factory()
+    players = [connect(factory, i) for i in range(SHIPS_PER_ROOM + 1)]
+
+    answers = [login(player, 7) for player in players]
+    assert answers[-1] == {"a":Action.LOGIN_DENY, "p":"Room is full"}
+    check_rooms(factory, players)
+
+    # the denied connection leaving does not remove anybody
+    denied = players.pop()
+    disconnect(denied)
+    check_rooms(factory, players)
+    assert len(factory.rooms[7]["players"]) == SHIPS_PER_ROOM
+
+def test_max_rooms():
+    factory = new_factory(max_rooms=2)
+    players = [connect(factory, i) for i in range(3)]
+
+    assert login(players[0], 1)["a"] == Action.LOGIN_OK
+    assert login(players[1])["a"] == Action.LOGIN_OK     # room 1 has space
+    assert login(players[2], "tony")["a"] == Action.LOGIN_OK
+
+    late = [connect(factory, i) for i in range(3, 5)]
+    assert login(late[0], "bob") == {"a":Action.LOGIN_DENY, "p":"Server full"}
+    check_rooms(factory, players + late)
+
+    # the first room with space, no new room needed
+    assert login(late[1])["p"] == {"room_id":1, "ship_nb":3}
+    check_rooms(factory, players + late)
+
+    # a room removed: the denied player can log in
+    disconnect(players.pop(2))
+    assert login(late[0], "bob")["a"] == Action.LOGIN_OK
+    check_rooms(factory, players + late)
+
+    assert factory.metrics.values["rooms_denied_total"] == 1
+
+def test_login_again_while_playing():
+    # one connection must not hold several rooms (up to max_rooms) after it leaves
+    factory = new_factory(max_rooms=5)
+    player = connect(factory)
+
+    assert login(player, 1)["a"] == Action.LOGIN_OK
+    for room_id in range(2, 11):
+        send(player, Action.LOGIN, {"room_id":room_id, "version":PROTOCOL_VERSION})
+
+    assert player.room_id == 1
+    assert list(factory.rooms) == [1]
+    assert factory.metrics.values["logins_repeated_total"] == 9
+    check_rooms(factory, [player])
+
+    disconnect(player)
+    assert factory.rooms == {}
+    assert factory.player_count == 0
+
+def test_old_protocol_version():
+    factory = new_factory()
+    player = connect(factory)
+
+    assert login(player, 1, version=PROTOCOL_VERSION - 1)["a"] == Action.LOGIN_DENY
+    check_rooms(factory, [player])
+
+    assert login(player, 1)["a"] == Action.LOGIN_OK
+    check_rooms(factory, [player])
+
+@pytest.mark.parametrize("room_id", [1, "tony"])
+def test_messages_outside_a_room_are_dropped(room_id):
+    factory = new_factory(max_rooms=1)
+
+    other = connect(factory, 1)
+    login(other, "bob")
+
+    player = connect(factory)
+    login(player, room_id) # denied: no room left
+
+    for _ in range(10):
+        send(player, Action.PLAYER_UPDATE, {"xpos":1, "ypos":2})
+
+    assert player.packet_queue.empty()
+    assert factory.metrics.values["messages_not_playing_total"] == 10
+    check_rooms(factory, [player, other])
@@ -0,0 +1,126 @@
+import time, threading
+
+import pytest
+
+import split_mode
+from split_mode import SharedState, IMAGE_NORMAL, IMAGE_THRUST, SPLIT_MAX_SHOTS
+
+# -------------------------------------------------------------------------------------------------
+
+class Point():
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+class StubShip():
+    """ What SharedState.publish() reads of a Ship """
+
+    def __init__(self, number):
+        self.ship_pic, self.ship_pic_thrust, self.ship_pic_shield = object(), object(), object()
+        self.image = self.ship_pic
+
+        self.xpos = 100 * number
+        self.ypos = 200 * number
+        self.angle = 45. * number
+        self.landed = self.explod = self.game_over = False
+        self.explod_tick = 0
+        self.lives = 10
+
+        self.shots = []
+        self.debris = []
+
+        self.left_pressed = self.right_pressed = self.thrust_pressed = self.shoot_pressed = self.shield_pressed = False
+
+class StubEnv():
+    def __init__(self):
+        self.frames = 0
+        self.level = 1
+        self.ships = [StubShip(i) for i in range(split_mode.SPLIT_SHIPS)]
+
+@pytest.fixture
+def shared():
+    shared = SharedState()
+    yield shared
+    shared.close()
+
+def test_no_frame_yet(shared):
+    n, frame = shared.read()
+    assert n == 0
+
+def test_publish_read(shared):
+    env = StubEnv()
+    ship = env.ships[1]
+
+    ship.image = ship.ship_pic_thrust
+    ship.shots = [Point(i, i + 1) for i in range(SPLIT_MAX_SHOTS + 5)] # over the shared array: truncated
+    ship.debris = [Point(7, 8)]
+    env.frames = 42
+
+    shared.publish(env)
+    n, frame = shared.read()
+
+    assert n == 1
+    assert (frame["frame"], frame["level"]) == (42, 1)
+
+    s = frame["ships"][1]
+    assert (s["xpos"], s["ypos"], s["angle"], s["image"]) == (100, 200, 45., IMAGE_THRUST)
+    assert s["shots_count"] == SPLIT_MAX_SHOTS
+    assert s["shots"][SPLIT_MAX_SHOTS - 1].tolist() == [SPLIT_MAX_SHOTS - 1, SPLIT_MAX_SHOTS]
+    assert s["debris_count"] == 1
+    assert frame["ships"][0]["image"] == IMAGE_NORMAL
+
+def test_double_buffer(shared):
+    env = StubEnv()
+
+    for frames in (1, 2, 3):
+        env.frames = frames
+        shared.publish(env)
+
+    # the last frame is read, the one before stays intact in the other buffer
+    n, frame = shared.read()
+    assert (n, frame["frame"]) == (3, 3)
+    assert shared.buffers[2 % 2]["frame"] == 2
+
+    # a copy: publishing again does not change it
+    env.frames = 4
+    shared.publish(env)
+    assert frame["frame"] == 3
+
+def test_read_waits_for_a_torn_copy(shared):
+    env = StubEnv()
+    env.frames = 1
+    shared.publish(env)
+
+    # the simulation started overwriting the buffer being read (2 frames ahead): read() copies it again
+    shared.control["writing"] = 3
+
+    result = []
+    reader = threading.Thread(target=lambda: result.append(shared.read()))
+    reader.start()
+
+    time.sleep(0.05)
+    assert not result
+
+    env.frames = 2
+    # the copy is consistent again once a frame is published: 2, or 3 if the reader was not scheduled in between
+    shared.publish(env)
+    shared.publish(env)
+
+    reader.join(timeout=5)
+    n, frame = result[0]
+    assert n in (2, 3) and frame["frame"] == 2
+
+def test_inputs(shared):
+    render_ships = [StubShip(i) for i in range(split_mode.SPLIT_SHIPS)]
+    render_ships[2].thrust_pressed = True
+    render_ships[3].shield_pressed = True
+    render_ships[3].left_pressed = True
+
+    shared.write_inputs(render_ships)
+
+    simulation_ships = [StubShip(i) for i in range(split_mode.SPLIT_SHIPS)]
+    shared.read_inputs(simulation_ships)
+
+    pressed = [(ship.left_pressed, ship.right_pressed, ship.thrust_pressed, ship.shoot_pressed, ship.shield_pressed)
+               for ship in simulation_ships]
+    assert pressed == [(False,) * 5, (False,) * 5, (False, False, True, False, False), (True, False, False, False, True)]
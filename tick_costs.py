@@ -0,0 +1,96 @@
+"""
+Server time accounting (server.py): where the reactor thread spends its time, per room and per player,
+to find what makes the base tick overrun its period (a room full of busy ships, a client spamming updates).
+
+    decode   unpacking the messages received from a player (outside the ticks)
+    relay    processing its packet queue in the room tick (without the encode / send below)
+    encode   packing its updates and building their websocket frames, once for all the recipients
+    send     writing them to the other players of the room
+
+    costs = TickCosts()
+    costs.add(room_id, player, DECODE, seconds)
+    costs.owner = (room_id, player)  # charged for the encode / send of the messages it causes
+    costs.top_rooms(3), costs.top_players(3)
+    costs.reset()                    # each report period
+"""
+
+DECODE = "decode"
+RELAY = "relay"
+ENCODE = "encode"
+SEND = "send"
+
+STAGES = (DECODE, RELAY, ENCODE, SEND)
+
+# -------------------------------------------------------------------------------------------------
+
+class TickCosts():
+
+    def __init__(self):
+
+        self.totals = {stage: 0. for stage in STAGES} # since the start
+        self.charged = 0. # since the start, all the stages
+
+        # (room_id, player) being processed, None: nobody in particular (room events, watchers)
+        self.owner = None
+
+        self.reset()
+
+    def reset(self):
+
+        # since the last reset: room_id => {stage: s, "messages": n}, player => {...}
+        self.rooms = {}
+        self.players = {}
+
+        # player => (room_id, ship_nb) when it was last charged (it may have left since)
+        self.player_info = {}
+
+    def entry(self, costs, key):
+        cost = costs.get(key)
+        if cost is None:
+            cost = costs[key] = {stage: 0. for stage in STAGES}
+            cost["messages"] = 0
+        return cost
+
+    def add(self, room_id, player, stage, seconds):
+
+        self.totals[stage] += seconds
+        self.charged += seconds
+
+        if room_id is not None:
+            self.entry(self.rooms, room_id)[stage] += seconds
+
+        if player is not None:
+            self.entry(self.players, player)[stage] += seconds
+            self.player_info[player] = (room_id, player.ship_nb)
+
+    def add_owned(self, stage, seconds):
+        """ Charged to the current owner, if any """
+
+        if self.owner is None:
+            self.totals[stage] += seconds
+            self.charged += seconds
+        else:
+            self.add(*self.owner, stage, seconds)
+
+    def count_message(self, room_id, player):
+        if room_id is not None:
+            self.entry(self.rooms, room_id)["messages"] += 1
+        self.entry(self.players, player)["messages"] += 1
+
+    def top(self, costs, count):
+        """ [(key, cost), ...] most expensive first """
+        return sorted(costs.items(), key=lambda item: -sum(item[1][stage] for stage in STAGES))[:count]
+
+    def top_rooms(self, count):
+        return self.top(self.rooms, count)
+
+    def top_players(self, count):
+        return self.top(self.players, count)
+
+def cost_text(cost):
+    """ "4.1 ms (decode 0.2, relay 0.5, encode 1.1, send 2.3; 120 msgs)" """
+
+    total = sum(cost[stage] for stage in STAGES)
+    stages = ", ".join("%s %.1f" % (stage, cost[stage] * 1000) for stage in STAGES)
+
+    return "%.1f ms (%s; %s msgs)" % (total * 1000, stages, cost["messages"])